@@ -0,0 +1,205 @@
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator
+from datetime import date, datetime, timedelta
+from modelos_datos import FacturaEndesaCliente
+
+# Base de datos local con el histórico de facturas parseadas (no se borra con /clear_files)
+DB_PATH = os.environ.get("ENDESA_DB_PATH", os.path.join("datos", "facturas.db"))
+
+FORMATO_FECHA_API = '%d/%m/%Y'
+
+
+def parsear_fecha(texto: str | None) -> date | None:
+    """Convierte las fechas del portal/API (DD/MM/YYYY, DD-MM-YYYY o YYYY-MM-DD) a date."""
+    if not texto:
+        return None
+    for formato in (FORMATO_FECHA_API, '%d-%m-%Y', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(texto.strip(), formato).date()
+        except ValueError:
+            continue
+    return None
+
+
+def clave_cups(cups: str | None) -> str:
+    """
+    Clave con la que se guarda y se busca un CUPS: el portal puede devolver el CUPS de 22
+    caracteres (con sufijo de punto frontera, p.ej. '0F') de un CUPS de 20 pedido.
+    """
+    return (cups or "").strip().upper()[:20]
+
+
+def _iso(texto: str | None) -> str | None:
+    fecha = parsear_fecha(texto)
+    return fecha.isoformat() if fecha else None
+
+
+class AlmacenFacturas:
+    """
+    Almacén SQLite de facturas ya extraídas. Además de las facturas guarda, por CUPS,
+    los rangos de fechas de emisión que ya se buscaron completos en el portal, de forma
+    que una consulta solo necesita buscar en el portal los huecos no cubiertos.
+    """
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._conectar() as con:
+            con.executescript("""
+                CREATE TABLE IF NOT EXISTS facturas (
+                    cups TEXT NOT NULL,
+                    numero_factura TEXT NOT NULL,
+                    fecha_emision TEXT,
+                    fecha_inicio_periodo TEXT,
+                    fecha_fin_periodo TEXT,
+                    datos TEXT NOT NULL,
+                    actualizado TEXT NOT NULL,
+                    PRIMARY KEY (cups, numero_factura)
+                );
+                CREATE INDEX IF NOT EXISTS idx_facturas_emision ON facturas (cups, fecha_emision);
+                CREATE INDEX IF NOT EXISTS idx_facturas_periodo ON facturas (cups, fecha_inicio_periodo, fecha_fin_periodo);
+
+                CREATE TABLE IF NOT EXISTS rangos_cubiertos (
+                    cups TEXT NOT NULL,
+                    desde TEXT NOT NULL,
+                    hasta TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_rangos_cups ON rangos_cubiertos (cups, desde);
+            """)
+            # Bases anteriores guardaban el CUPS tal como venía del portal: se pasa a la clave normalizada
+            con.execute("UPDATE OR REPLACE facturas SET cups = UPPER(SUBSTR(TRIM(cups), 1, 20)) WHERE cups != UPPER(SUBSTR(TRIM(cups), 1, 20))")
+            con.execute("UPDATE rangos_cubiertos SET cups = UPPER(SUBSTR(TRIM(cups), 1, 20)) WHERE cups != UPPER(SUBSTR(TRIM(cups), 1, 20))")
+
+    @contextmanager
+    def _conectar(self) -> Iterator[sqlite3.Connection]:
+        # Una conexión por operación: seguro desde cualquier hilo y sin estado compartido
+        con = sqlite3.connect(self.db_path)
+        try:
+            with con: # commit / rollback
+                yield con
+        finally:
+            con.close()
+
+    # --- Facturas ---
+
+    def guardar_facturas(self, facturas: list[FacturaEndesaCliente]):
+        """Inserta o actualiza las facturas válidas (ignora registros de error y 'SIN_FACTURAS')."""
+        ahora = datetime.now().isoformat(timespec="seconds")
+        filas = [
+            (
+                clave_cups(f.cups), f.numero_factura, _iso(f.fecha_emision),
+                _iso(f.fecha_inicio_periodo), _iso(f.fecha_fin_periodo),
+                json.dumps(f.model_dump(), ensure_ascii=False), ahora,
+            )
+            for f in facturas
+            if not f.error_RPA and f.numero_factura not in (None, "", "N/A")
+        ]
+        if not filas:
+            return
+        with self._conectar() as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO facturas VALUES (?, ?, ?, ?, ?, ?, ?)", filas
+            )
+
+    def consultar(self, cups: str, desde: date, hasta: date) -> list[FacturaEndesaCliente]:
+        """Facturas de un CUPS emitidas en [desde, hasta], de la más reciente a la más antigua."""
+        with self._conectar() as con:
+            filas = con.execute(
+                "SELECT datos FROM facturas WHERE cups = ? AND fecha_emision BETWEEN ? AND ? "
+                "ORDER BY fecha_emision DESC",
+                (clave_cups(cups), desde.isoformat(), hasta.isoformat()),
+            ).fetchall()
+        return [FacturaEndesaCliente(**json.loads(datos)) for (datos,) in filas]
+
+    def iterar_lotes(
+        self, cups: list[str] | None = None, desde: date | None = None, hasta: date | None = None, lote: int = 500
+    ) -> Iterator[list[FacturaEndesaCliente]]:
+        """
+        Facturas del filtro (todos los CUPS si 'cups' es None) en lotes de 'lote', por fecha de emisión.
+        Cada lote es una consulta independiente que continúa tras la última fila del anterior,
+        así no se carga todo el histórico ni se mantiene una conexión abierta entre lotes.
+        """
+        filtros, parametros = [], []
+        if cups:
+            filtros.append(f"cups IN ({', '.join('?' for _ in cups)})")
+            parametros.extend(clave_cups(c) for c in cups)
+        if desde:
+            filtros.append("fecha_emision >= ?")
+            parametros.append(desde.isoformat())
+        if hasta:
+            filtros.append("fecha_emision <= ?")
+            parametros.append(hasta.isoformat())
+        orden = "COALESCE(fecha_emision, ''), cups, numero_factura"
+        filtros.append(f"({orden}) > (?, ?, ?)")
+        consulta = f"SELECT {orden}, datos FROM facturas WHERE {' AND '.join(filtros)} ORDER BY {orden} LIMIT ?"
+
+        ultima = ("", "", "")
+        while True:
+            with self._conectar() as con:
+                filas = con.execute(consulta, (*parametros, *ultima, lote)).fetchall()
+            if not filas:
+                return
+            ultima = filas[-1][:3]
+            yield [FacturaEndesaCliente(**json.loads(fila[3])) for fila in filas]
+            if len(filas) < lote:
+                return
+
+    # --- Cobertura de rangos ---
+
+    def _rangos(self, con: sqlite3.Connection, cups: str) -> list[tuple[date, date]]:
+        filas = con.execute(
+            "SELECT desde, hasta FROM rangos_cubiertos WHERE cups = ? ORDER BY desde", (clave_cups(cups),)
+        ).fetchall()
+        return [(date.fromisoformat(d), date.fromisoformat(h)) for d, h in filas]
+
+    def marcar_cubierto(self, cups: str, desde: date, hasta: date):
+        """
+        Registra que [desde, hasta] se buscó completo en el portal para este CUPS.
+        Nunca se marca el día de hoy ni posteriores: aún pueden emitirse facturas.
+        """
+        hasta = min(hasta, date.today() - timedelta(days=1))
+        if desde > hasta:
+            return
+        with self._conectar() as con:
+            # Fusionamos con los rangos solapados o contiguos para mantener la tabla compacta
+            fusionados = []
+            for d, h in self._rangos(con, cups):
+                if d <= hasta + timedelta(days=1) and h >= desde - timedelta(days=1):
+                    desde, hasta = min(desde, d), max(hasta, h)
+                else:
+                    fusionados.append((d, h))
+            fusionados.append((desde, hasta))
+            con.execute("DELETE FROM rangos_cubiertos WHERE cups = ?", (clave_cups(cups),))
+            con.executemany(
+                "INSERT INTO rangos_cubiertos VALUES (?, ?, ?)",
+                [(clave_cups(cups), d.isoformat(), h.isoformat()) for d, h in fusionados],
+            )
+
+    def rangos_pendientes(self, cups: str, desde: date, hasta: date) -> list[tuple[date, date]]:
+        """Sub-rangos de [desde, hasta] que todavía no están cubiertos para este CUPS."""
+        with self._conectar() as con:
+            cubiertos = self._rangos(con, cups)
+        pendientes = []
+        cursor = desde
+        for d, h in cubiertos:
+            if h < cursor or d > hasta:
+                continue
+            if d > cursor:
+                pendientes.append((cursor, d - timedelta(days=1)))
+            cursor = max(cursor, h + timedelta(days=1))
+            if cursor > hasta:
+                break
+        if cursor <= hasta:
+            pendientes.append((cursor, hasta))
+        return pendientes
+
+
+def ordenar_por_emision(facturas: list[FacturaEndesaCliente]) -> list[FacturaEndesaCliente]:
+    """Ordena de la más reciente a la más antigua (las fechas no reconocibles al final)."""
+    return sorted(
+        facturas,
+        key=lambda f: parsear_fecha(f.fecha_emision) or date.min,
+        reverse=True,
+    )
@@ -5,27 +5,99 @@ import sys
 if sys.platform == 'win32':
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-from fastapi import FastAPI, HTTPException, Query
-from typing import List, Dict, Any
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Literal
 from pydantic import BaseModel
-from modelos_datos import FacturaEndesaCliente
+from modelos_datos import FacturaEndesaCliente, EstadoTarea, EstadoSincronizacion
 # Importamos la función ASÍNCRONA para la extracción de datos
 from robotEndesa import ejecutar_robot_api 
+# Variante en streaming (generador asíncrono por CUPS)
+from robotEndesa import iterar_robot_api
+import json
 # Importamos la función SÍNCRONA para la lectura de PDF local
 from robotEndesa import obtener_pdf_local_base64 
+# Variante binaria: ruta del documento y respuesta por bloques con ETag/Range
+from robotEndesa import ruta_documento_local
+from respuesta_archivo import responder_archivo
+# ZIP de documentos en streaming (/documentos/zip) a partir del almacén local
+from robotEndesa import ALMACEN
+from zip_documentos import generar_zip_documentos
+# CSV consolidado en streaming (/facturas/csv)
+from exportacion import lotes_csv
+# Pool de navegadores precalentados (vive lo mismo que la aplicación)
+from robotEndesa import asegurar_sesion
+# Manifiesto de facturas ya procesadas (se vacía junto con las descargas)
+from robotEndesa import MANIFIESTO
+from pool_navegadores import PoolNavegadores, POOL_SIZE
+# Cola de tareas asíncronas (/jobs)
+from tareas import GestorTareas
+# Sincronización incremental de los CUPS registrados (/sync)
+from sincronizacion import PlanificadorSincronizacion
+from almacen_facturas import parsear_fecha
+# Pool de procesos del parseo XML
+from pipeline_documentos import cerrar_pool_procesos
+# Motor OCR compartido (cliente OpenAI con pool de conexiones)
+from pdf_parser import MOTOR_OCR, CACHE_OCR
 import asyncio
 import re
 import os # Necesario para manejar FileNotFoundError
 import shutil
-from logs import escribir_log
+from logs import escribir_log, contexto_log, vaciar_log
+import uuid
+from datetime import datetime
+# Métricas en formato Prometheus (/metrics)
+from metricas import exponer_metricas, PETICIONES_HTTP, NAVEGADORES_LIBRES, TAREAS_EN_COLA
 
 
+# --- Ciclo de vida: pool de navegadores ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Arranca el pool de navegadores y la cola de tareas al iniciar la API y los cierra al apagarla."""
+    pool = PoolNavegadores(POOL_SIZE, preparar=asegurar_sesion)
+    app.state.pool_navegadores = pool
+    await pool.iniciar()
+    gestor_tareas = GestorTareas(ejecutar_robot_api)
+    app.state.gestor_tareas = gestor_tareas
+    await gestor_tareas.iniciar()
+    NAVEGADORES_LIBRES.funcion = pool.libres
+    TAREAS_EN_COLA.funcion = gestor_tareas.en_cola
+    planificador = PlanificadorSincronizacion(ejecutar_robot_api, pool=pool)
+    app.state.planificador_sync = planificador
+    await planificador.iniciar()
+    try:
+        yield
+    finally:
+        await planificador.cerrar()
+        await gestor_tareas.cerrar()
+        await pool.cerrar()
+        cerrar_pool_procesos()
+        await MOTOR_OCR.cerrar()
+
 # Inicializar la aplicación de FastAPI
 app = FastAPI(
     title="API de Extracción de Facturas Endesa",
-    description="API que automatiza la búsqueda y extracción de datos detallados de facturas de Endesa."
+    description="API que automatiza la búsqueda y extracción de datos detallados de facturas de Endesa.",
+    lifespan=lifespan
 )
 
+# --- Identificador de petición en el log ---
+@app.middleware("http")
+async def asignar_request_id(request, call_next):
+    """Todas las líneas de log de una petición llevan su 'request_id' (también en la cabecera X-Request-ID)."""
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:12]
+    with contexto_log(request_id=request_id):
+        with PETICIONES_HTTP.medir(metodo=request.method) as medicion:
+            respuesta = await call_next(request)
+            # Ruta de la plantilla (/jobs/{job_id}), no la URL concreta, para acotar las series
+            ruta = request.scope.get("route")
+            medicion.etiquetas = {"ruta": ruta.path if ruta else "desconocida", "codigo": respuesta.status_code}
+            if respuesta.status_code >= 500:
+                medicion.fallo()
+    respuesta.headers["X-Request-ID"] = request_id
+    return respuesta
+
 # --- Funciones de Validación ---
 
 def validar_cups(cups: str):
@@ -51,6 +123,24 @@ class FacturaRequest(BaseModel):
     fecha_desde: str
     fecha_hasta: str
     cups: List[str]
+    forzar_refresco: bool = False # Ignora el manifiesto y vuelve a descargar/parsear
+
+class DocumentoRef(BaseModel):
+    cups: str
+    numero_factura: str
+
+class ZipDocumentosRequest(BaseModel):
+    # O bien facturas concretas...
+    facturas: List[DocumentoRef] | None = None
+    # ...o bien un filtro por CUPS y fecha de emisión (DD/MM/YYYY) sobre el histórico local
+    cups: List[str] | None = None
+    fecha_desde: str | None = None
+    fecha_hasta: str | None = None
+    tipos: List[Literal["PDF", "XML"]] = ["PDF", "XML"]
+
+class SyncRequest(BaseModel):
+    cups: List[str]
+    fecha_desde: str | None = None # Primera sincronización desde esta fecha (DD/MM/YYYY)
 
 # --- Endpoint de Extracción de Metadatos ---
 
@@ -72,7 +162,6 @@ async def clear_files():
     """
     escribir_log("\nAPI llamada: /clear_files - Iniciando limpieza de archivos temporales, logs y CSVs.",pretexto="")
     carpeta_archivos_temporales = "temp_endesa_downloads"
-    archivo_logs = "logs/log.txt"
     carpeta_cvs = "csv" # Corregido a 'carpeta_cvs' para consistencia
 
     
@@ -81,6 +170,7 @@ async def clear_files():
         if os.path.exists(carpeta_archivos_temporales):
             # Usamos rmtree para eliminar la carpeta y todo lo que contenga.
             shutil.rmtree(carpeta_archivos_temporales)
+            MANIFIESTO.vaciar()
             escribir_log(f"Carpeta '{carpeta_archivos_temporales}' y su contenido eliminados.")
             
             # Opcional: Recrear la carpeta raíz vacía inmediatamente para prevenir colisiones en la siguiente llamada a /facturas
@@ -115,9 +205,8 @@ async def clear_files():
 
     # 3. Limpiar (vaciar) el archivo de logs
     try:
-        # Abrir en modo 'w' para truncar (vaciar) el archivo. Si no existe, lo crea.
-        with open(archivo_logs, "w") as f:
-             pass 
+        # El truncado lo hace el hilo escritor del log, en orden con las líneas pendientes
+        vaciar_log()
         escribir_log("\nAPI llamada: /clear_files - Completada\n",pretexto="")
     except Exception as e:
         escribir_log(f"Error al limpiar el archivo de logs: {e}")
@@ -125,6 +214,23 @@ async def clear_files():
 
     return {"message": "Limpieza de archivos temporales, logs y CSVs completada."}
 
+# --- Endpoint de Métricas (Prometheus) ---
+@app.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    summary="Contadores, indicadores e histogramas de latencia por etapa en formato de texto de Prometheus."
+)
+def get_metrics():
+    return PlainTextResponse(exponer_metricas(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# --- Endpoint de Estadísticas de la Caché de OCR ---
+@app.get(
+    "/cache_ocr"
+)
+def get_cache_ocr():
+    """Aciertos, fallos, tasa de acierto y ocupación de la caché de respuestas del OCR."""
+    return CACHE_OCR.estadisticas()
+
 # --- Endpoint de Extracción de Metadatos ---
 @app.get(
     "/facturas", 
@@ -134,8 +240,8 @@ async def clear_files():
 async def get_facturas(
     fecha_desde: str, # Formato DD/MM/YYYY
     fecha_hasta: str,  # Formato DD/MM/YYYY
-    cups: List[str] = Query(..., description="Lista de códigos CUPS a procesar.")
-    
+    cups: List[str] = Query(..., description="Lista de códigos CUPS a procesar."),
+    forzar_refresco: bool = Query(False, description="Vuelve a descargar y parsear aunque la factura ya esté en el manifiesto local.")
 ):
     """
     Realiza el proceso completo de Login -> Búsqueda -> Descarga -> Extracción XML.
@@ -157,7 +263,9 @@ async def get_facturas(
         facturas = await ejecutar_robot_api(
             lista_cups=cups, 
             fecha_desde=fecha_desde, 
-            fecha_hasta=fecha_hasta
+            fecha_hasta=fecha_hasta,
+            pool=app.state.pool_navegadores,
+            forzar_refresco=forzar_refresco
         )
 
         escribir_log(f"\n[API] ÉXITO (Metadata): {len(facturas)} facturas extraídas.\n\n",pretexto="")
@@ -186,6 +294,7 @@ async def post_facturas(request: FacturaRequest):
     fecha_desde = request.fecha_desde
     fecha_hasta = request.fecha_hasta
     cups = request.cups
+    forzar_refresco = request.forzar_refresco
 
     escribir_log(f"\nAPI llamada POST (Metadata): {len(cups)} CUPs, Desde={fecha_desde}, Hasta={fecha_hasta}\n", pretexto="\n")
     
@@ -201,7 +310,9 @@ async def post_facturas(request: FacturaRequest):
         facturas = await ejecutar_robot_api(
             lista_cups=cups, 
             fecha_desde=fecha_desde, 
-            fecha_hasta=fecha_hasta
+            fecha_hasta=fecha_hasta,
+            pool=app.state.pool_navegadores,
+            forzar_refresco=forzar_refresco
         )
 
         escribir_log(f"\n[API] ÉXITO (Metadata): {len(facturas)} facturas extraídas.\n\n", pretexto="")
@@ -213,6 +324,96 @@ async def post_facturas(request: FacturaRequest):
         error_msg = f"Fallo crítico en el proceso RPA: {e}"
         escribir_log(f"ERROR: {error_msg}")
         raise HTTPException(status_code=500, detail=error_msg)
+# --- Endpoints de Extracción en Streaming (NDJSON) ---
+
+async def _stream_facturas_ndjson(cups: List[str], fecha_desde: str, fecha_hasta: str, forzar_refresco: bool):
+    """
+    Emite una línea JSON por CUPS en cuanto termina: {"cups": ..., "facturas": [...]}.
+    Si el robot falla a mitad, la última línea es {"error": ...}.
+    """
+    escribir_log(f"\nAPI llamada (Stream): {len(cups)} CUPs, Desde={fecha_desde}, Hasta={fecha_hasta}\n", pretexto="\n")
+    enviadas = 0
+    try:
+        async for _, cups_actual, facturas_cups in iterar_robot_api(
+            cups, fecha_desde, fecha_hasta,
+            pool=app.state.pool_navegadores,
+            forzar_refresco=forzar_refresco
+        ):
+            enviadas += len(facturas_cups)
+            linea = {"cups": cups_actual, "facturas": [f.model_dump() for f in facturas_cups]}
+            yield json.dumps(linea, ensure_ascii=False) + "\n"
+        escribir_log(f"\n[API] ÉXITO (Stream): {enviadas} facturas enviadas.\n\n", pretexto="")
+    except Exception as e:
+        error_msg = f"Fallo crítico en el proceso RPA: {e}"
+        escribir_log(f"ERROR: {error_msg}")
+        yield json.dumps({"error": error_msg}, ensure_ascii=False) + "\n"
+
+@app.get(
+    "/facturas/stream",
+    summary="Igual que GET /facturas pero devuelve NDJSON: una línea por CUPS en cuanto termina."
+)
+async def get_facturas_stream(
+    fecha_desde: str, # Formato DD/MM/YYYY
+    fecha_hasta: str,  # Formato DD/MM/YYYY
+    cups: List[str] = Query(..., description="Lista de códigos CUPS a procesar."),
+    forzar_refresco: bool = Query(False, description="Vuelve a descargar y parsear aunque la factura ya esté en el manifiesto local.")
+):
+    validar_fecha(fecha_desde)
+    validar_fecha(fecha_hasta)
+    for c in cups:
+        validar_cups(c)
+    return StreamingResponse(
+        _stream_facturas_ndjson(cups, fecha_desde, fecha_hasta, forzar_refresco),
+        media_type="application/x-ndjson"
+    )
+
+@app.post(
+    "/facturas/stream",
+    summary="Igual que POST /facturas pero devuelve NDJSON: una línea por CUPS en cuanto termina."
+)
+async def post_facturas_stream(request: FacturaRequest):
+    validar_fecha(request.fecha_desde)
+    validar_fecha(request.fecha_hasta)
+    for c in request.cups:
+        validar_cups(c)
+    return StreamingResponse(
+        _stream_facturas_ndjson(request.cups, request.fecha_desde, request.fecha_hasta, request.forzar_refresco),
+        media_type="application/x-ndjson"
+    )
+
+async def _stream_csv(cups: List[str] | None, fecha_desde: str | None, fecha_hasta: str | None):
+    """CSV por lotes desde el histórico local: cada lote se lee en un hilo y se envía al momento."""
+    lotes = ALMACEN.iterar_lotes(cups, parsear_fecha(fecha_desde), parsear_fecha(fecha_hasta))
+    trozos = lotes_csv(lotes)
+    while (trozo := await asyncio.to_thread(next, trozos, None)) is not None:
+        yield trozo.encode("utf-8")
+
+@app.get(
+    "/facturas/csv",
+    summary="CSV consolidado (todos los campos) de las facturas del histórico local, en streaming."
+)
+async def get_facturas_csv(
+    cups: List[str] | None = Query(None, description="CUPS a incluir (todos si se omite)."),
+    fecha_desde: str | None = None, # Fecha de emisión, DD/MM/YYYY
+    fecha_hasta: str | None = None,
+):
+    """
+    Una fila por factura ya extraída, con todas las columnas del modelo (incluidos los importes
+    por periodo), separadas por ';'. No consulta el portal. Las filas se leen del almacén por
+    lotes, sin cargar el resultado entero en memoria.
+    """
+    for fecha in (fecha_desde, fecha_hasta):
+        if fecha:
+            validar_fecha(fecha)
+    for c in cups or []:
+        validar_cups(c)
+    nombre = f"facturas_endesa_{datetime.now():%Y%m%d_%H%M%S}.csv"
+    return StreamingResponse(
+        _stream_csv(cups, fecha_desde, fecha_hasta),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{nombre}"'}
+    )
+
 # --- Endpoint de Lectura de PDF Local ---
 @app.get(
     "/pdf-local/{cups}/{numero_factura}",
@@ -239,4 +440,180 @@ def get_pdf_local(
         numero_factura=numero_factura,
     )
 
-    return resultado
\ No newline at end of file
+    return resultado
+
+@app.api_route(
+    "/pdf-local/{cups}/{numero_factura}/binario",
+    methods=["GET", "HEAD"],
+    summary="Descarga el PDF local en binario (por bloques, con ETag, Range y GET condicional)."
+)
+async def get_pdf_local_binario(cups: str, numero_factura: str, request: Request):
+    """
+    Mismo documento que /pdf-local/{cups}/{numero_factura}, sin base64 ni JSON.
+    Responde 304 si el 'If-None-Match' coincide con el ETag y 206 a las peticiones 'Range'.
+    A diferencia de la variante JSON, un archivo inexistente devuelve 404.
+    """
+    validar_cups(cups)
+    escribir_log(f"API llamada (PDF Local binario): CUPS={cups}, Factura={numero_factura}", pretexto="")
+    ruta = ruta_documento_local(cups, numero_factura, 'PDF')
+    try:
+        return await responder_archivo(request, ruta, "application/pdf", os.path.basename(ruta))
+    except FileNotFoundError:
+        escribir_log(f"⚠️ PDF no encontrado en disco: {os.path.basename(ruta)}.")
+        raise HTTPException(status_code=404, detail=f"No hay PDF local para la factura {numero_factura} del CUPS {cups}.")
+
+# --- Exportación en bloque de documentos (ZIP en streaming) ---
+@app.post(
+    "/documentos/zip",
+    summary="Devuelve un ZIP, generado en streaming, con los PDF/XML locales de varias facturas."
+)
+async def post_documentos_zip(request: ZipDocumentosRequest):
+    """
+    Recibe una lista de facturas (cups, numero_factura) o un filtro por CUPS y fechas de emisión,
+    que se resuelve con el histórico local (las facturas ya extraídas). No abre el navegador:
+    solo empaqueta lo que ya está en disco. Los documentos que falten se listan en
+    'manifiesto.json', dentro del propio ZIP.
+    """
+    if bool(request.facturas) == bool(request.cups):
+        raise HTTPException(status_code=400, detail="Indique 'facturas' o bien 'cups' con 'fecha_desde' y 'fecha_hasta', pero no ambos.")
+    if not request.tipos:
+        raise HTTPException(status_code=400, detail="Indique al menos un tipo de documento (PDF, XML).")
+
+    if request.facturas:
+        for ref in request.facturas:
+            validar_cups(ref.cups)
+        pares = [(ref.cups, ref.numero_factura) for ref in request.facturas]
+    else:
+        if not request.fecha_desde or not request.fecha_hasta:
+            raise HTTPException(status_code=400, detail="El filtro por CUPS requiere 'fecha_desde' y 'fecha_hasta'.")
+        validar_fecha(request.fecha_desde)
+        validar_fecha(request.fecha_hasta)
+        for c in request.cups:
+            validar_cups(c)
+        desde, hasta = parsear_fecha(request.fecha_desde), parsear_fecha(request.fecha_hasta)
+        pares = []
+        for c in request.cups:
+            facturas = await asyncio.to_thread(ALMACEN.consultar, c, desde, hasta)
+            pares.extend((f.cups, f.numero_factura) for f in facturas)
+
+    documentos = [
+        {"cups": cups, "numero_factura": numero, "tipo": tipo, "ruta": ruta_documento_local(cups, numero, tipo)}
+        for cups, numero in dict.fromkeys(pares) # sin repetidos, en el orden pedido
+        for tipo in dict.fromkeys(request.tipos)
+    ]
+    escribir_log(f"API llamada (ZIP documentos): {len(documentos)} documento(s) de {len(set(pares))} factura(s).", pretexto="")
+    nombre = f"documentos_endesa_{datetime.now():%Y%m%d_%H%M%S}.zip"
+    return StreamingResponse(
+        generar_zip_documentos(documentos),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{nombre}"'}
+    )
+
+# --- API de Tareas Asíncronas (para lotes largos) ---
+@app.post(
+    "/jobs",
+    response_model=EstadoTarea,
+    status_code=202,
+    summary="Encola una extracción de facturas y devuelve inmediatamente el id de la tarea."
+)
+async def post_job(request: FacturaRequest):
+    """
+    Mismos parámetros que POST /facturas, pero sin mantener la conexión abierta.
+    Consulte el avance en /jobs/{id} y el resultado en /jobs/{id}/result.
+    """
+    escribir_log(f"\nAPI llamada POST (Jobs): {len(request.cups)} CUPs, Desde={request.fecha_desde}, Hasta={request.fecha_hasta}\n", pretexto="\n")
+
+    validar_fecha(request.fecha_desde)
+    validar_fecha(request.fecha_hasta)
+    for c in request.cups:
+        validar_cups(c)
+
+    tarea = app.state.gestor_tareas.encolar(
+        lista_cups=request.cups,
+        fecha_desde=request.fecha_desde,
+        fecha_hasta=request.fecha_hasta,
+        pool=app.state.pool_navegadores,
+        forzar_refresco=request.forzar_refresco
+    )
+    return tarea.a_estado()
+
+def _obtener_tarea(job_id: str):
+    tarea = app.state.gestor_tareas.obtener(job_id)
+    if tarea is None:
+        raise HTTPException(status_code=404, detail=f"La tarea '{job_id}' no existe o ha caducado.")
+    return tarea
+
+@app.get(
+    "/jobs/{job_id}",
+    response_model=EstadoTarea,
+    summary="Estado y progreso por CUPS de una tarea de extracción."
+)
+async def get_job(job_id: str):
+    return _obtener_tarea(job_id).a_estado()
+
+@app.get(
+    "/jobs/{job_id}/result",
+    response_model=List[FacturaEndesaCliente],
+    summary="Resultado de una tarea terminada (misma respuesta que /facturas)."
+)
+async def get_job_result(job_id: str):
+    """Devuelve 409 si la tarea aún no ha terminado y 500 si terminó con un fallo crítico."""
+    tarea = _obtener_tarea(job_id)
+    if not tarea.terminada():
+        raise HTTPException(status_code=409, detail=f"La tarea '{job_id}' aún está {tarea.estado}.")
+    if tarea.estado == "fallida":
+        raise HTTPException(status_code=500, detail=f"Fallo crítico en el proceso RPA: {tarea.error}")
+    return tarea.resultado
+
+# --- Sincronización Incremental (CUPS registrados) ---
+@app.get(
+    "/sync",
+    summary="CUPS registrados para la sincronización incremental y su marca de agua."
+)
+def get_sync():
+    planificador = app.state.planificador_sync
+    return {
+        "en_curso": planificador.en_curso(),
+        "ultima_ejecucion": planificador.ultima_ejecucion,
+        "proxima_ejecucion": planificador.proxima_ejecucion,
+        "cups": [e.model_dump() for e in planificador.registro.listar()],
+    }
+
+@app.post(
+    "/sync/cups",
+    response_model=List[EstadoSincronizacion],
+    summary="Registra CUPS para sincronizarlos periódicamente en el almacén local."
+)
+def post_sync_cups(request: SyncRequest):
+    """
+    Los CUPS ya registrados conservan su marca. Sin 'fecha_desde', la primera
+    sincronización busca los últimos ENDESA_SYNC_DIAS_INICIALES días.
+    """
+    if request.fecha_desde:
+        validar_fecha(request.fecha_desde)
+    for c in request.cups:
+        validar_cups(c)
+    registro = app.state.planificador_sync.registro
+    for c in request.cups:
+        registro.registrar(c, parsear_fecha(request.fecha_desde))
+    escribir_log(f"API llamada POST (Sync): {len(request.cups)} CUPS registrados.", pretexto="")
+    return registro.listar()
+
+@app.delete(
+    "/sync/cups/{cups}",
+    summary="Da de baja un CUPS de la sincronización (sus facturas siguen en el almacén)."
+)
+def delete_sync_cups(cups: str):
+    if not app.state.planificador_sync.registro.eliminar(cups):
+        raise HTTPException(status_code=404, detail=f"El CUPS '{cups}' no está registrado.")
+    return {"message": f"CUPS '{cups}' dado de baja de la sincronización."}
+
+@app.post(
+    "/sync/run",
+    status_code=202,
+    summary="Lanza ahora una sincronización de los CUPS registrados (en segundo plano)."
+)
+async def post_sync_run():
+    # En el event loop (no en el threadpool): 'lanzar' activa un asyncio.Event del planificador
+    app.state.planificador_sync.lanzar()
+    return {"message": "Sincronización lanzada."}
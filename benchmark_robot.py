@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+# --- BENCHMARK DE EXTREMO A EXTREMO CONTRA EL PORTAL FALSO ---
+# Arranca portal_falso.py en local, apunta el robot a él (ENDESA_URL_BASE) y ejecuta
+# ejecutar_robot_api con distintos tamaños de lote y paralelismos: login, búsqueda,
+# paginación, descargas y parseo reales, sin credenciales ni red.
+# Uso: python benchmark_robot.py --lotes 1,5,20 --paralelismo 1,2,4 --latencia-ms 50
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+
+
+def _enteros(texto: str) -> list[int]:
+    return [int(v) for v in texto.split(",") if v.strip()]
+
+
+def _preparar_entorno(url_base: str, directorio: str):
+    """Configura el robot antes de importarlo: portal falso, credenciales ficticias y rutas temporales."""
+    os.environ["ENDESA_URL_BASE"] = url_base
+    os.environ.setdefault("ENDESA_USER", "benchmark")
+    os.environ.setdefault("ENDESA_PASSWORD", "benchmark")
+    os.environ["ENDESA_DB_PATH"] = os.path.join(directorio, "datos", "facturas.db")
+    os.environ["ENDESA_LOG_PATH"] = os.path.join(directorio, "logs", "log.txt")
+    # El robot usa rutas relativas (descargas, csv/, sesion/): se ejecuta en el directorio temporal
+    os.chdir(directorio)
+    os.makedirs("csv", exist_ok=True)
+    if RAIZ not in sys.path:
+        sys.path.insert(0, RAIZ)
+
+
+def _diferencia_etapas(antes: dict, despues: dict) -> dict[str, dict]:
+    """Llamadas, media y total por etapa (y resultado) entre dos lecturas del histograma ETAPAS."""
+    etapas = {}
+    for (etapa, resultado), (cuenta, suma) in sorted(despues.items()):
+        cuenta_previa, suma_previa = antes.get((etapa, resultado), (0, 0.0))
+        llamadas = cuenta - cuenta_previa
+        if llamadas:
+            total = suma - suma_previa
+            nombre = etapa if resultado == "ok" else f"{etapa} ({resultado})"
+            etapas[nombre] = {"llamadas": llamadas, "media_s": round(total / llamadas, 4), "total_s": round(total, 3)}
+    return etapas
+
+
+async def _ejecutar_escenario(ejecutar_robot_api, etapas_hist, filas_hist, lista_cups: list[str], desde: str, hasta: str, paralelismo: int) -> dict:
+    antes_etapas, antes_filas = etapas_hist.totales(), filas_hist.valor()
+    inicio = time.perf_counter()
+    facturas = await ejecutar_robot_api(
+        lista_cups, desde, hasta, paralelismo=paralelismo, forzar_refresco=True, usar_almacen=False
+    )
+    segundos = time.perf_counter() - inicio
+    filas = filas_hist.valor() - antes_filas
+    return {
+        "cups": len(lista_cups),
+        "paralelismo": paralelismo,
+        "segundos": round(segundos, 2),
+        "facturas": sum(1 for f in facturas if not f.error_RPA),
+        "errores": sum(1 for f in facturas if f.error_RPA),
+        "cups_por_minuto": round(len(lista_cups) / segundos * 60, 2),
+        "filas_por_segundo": round(filas / segundos, 2),
+        "etapas": _diferencia_etapas(antes_etapas, etapas_hist.totales()),
+    }
+
+
+def _imprimir(resultado: dict):
+    print(
+        f"\n[BENCH] {resultado['cups']} CUPS x paralelismo {resultado['paralelismo']}: {resultado['segundos']} s | "
+        f"{resultado['cups_por_minuto']} CUPS/min | {resultado['filas_por_segundo']} filas/s | "
+        f"{resultado['facturas']} facturas, {resultado['errores']} errores"
+    )
+    for etapa, datos in resultado["etapas"].items():
+        print(f"        {etapa:<28} {datos['llamadas']:>6} llamadas  media {datos['media_s']:>8.4f} s  total {datos['total_s']:>9.3f} s")
+
+
+async def _main(args) -> list[dict]:
+    from portal_falso import crear_portal, iniciar_en_hilo
+
+    portal = crear_portal(max(_enteros(args.lotes)), args.meses, args.latencia_ms, args.filas_por_pagina)
+    url_base, servidor = iniciar_en_hilo(portal)
+    _preparar_entorno(url_base, args.directorio or tempfile.mkdtemp(prefix="bench_endesa_"))
+    print(f"[BENCH] Portal falso en {url_base} | directorio de trabajo {os.getcwd()}")
+
+    # Import diferido: robotEndesa lee ENDESA_URL_BASE y las rutas al importarse
+    from robotEndesa import ejecutar_robot_api
+    from metricas import ETAPAS, FILAS_TABLA
+
+    hasta = date.today()
+    desde = hasta - timedelta(days=31 * args.meses + 10)
+    resultados = []
+    try:
+        for num_cups in _enteros(args.lotes):
+            for paralelismo in _enteros(args.paralelismo):
+                resultado = await _ejecutar_escenario(
+                    ejecutar_robot_api, ETAPAS, FILAS_TABLA, portal.state.datos.cups[:num_cups],
+                    desde.strftime("%d/%m/%Y"), hasta.strftime("%d/%m/%Y"), paralelismo
+                )
+                resultado["latencia_ms"] = args.latencia_ms
+                resultados.append(resultado)
+                _imprimir(resultado)
+    finally:
+        servidor.should_exit = True
+    return resultados
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo del robot contra el portal falso de Endesa.")
+    parser.add_argument("--lotes", default="1,5,20", help="Tamaños de lote (número de CUPS), separados por comas.")
+    parser.add_argument("--paralelismo", default="1,2,4", help="Workers paralelos a probar, separados por comas.")
+    parser.add_argument("--latencia-ms", type=float, default=50, help="Latencia añadida por el portal a cada petición.")
+    parser.add_argument("--meses", type=int, default=6, help="Facturas mensuales por CUPS en el portal.")
+    parser.add_argument("--filas-por-pagina", type=int, default=10)
+    parser.add_argument("--directorio", help="Directorio de trabajo del robot (por defecto, uno temporal).")
+    parser.add_argument("--json", dest="salida_json", help="Guarda los resultados en este fichero JSON.")
+    args = parser.parse_args()
+    if args.salida_json:
+        args.salida_json = os.path.abspath(args.salida_json)
+
+    resultados = asyncio.run(_main(args))
+    if args.salida_json:
+        with open(args.salida_json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+        print(f"[BENCH] Resultados guardados en {args.salida_json}")
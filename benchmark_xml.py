@@ -0,0 +1,159 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# --- BENCHMARK Y REFERENCIA DEL PARSER XML (procesar_xml_local) ---
+# Genera un corpus Facturae sintético (generador_facturae.generar_corpus), mide parseos por
+# segundo y memoria pico, y compara los campos extraídos con una referencia guardada.
+# Termina con código 1 si algún campo cambia. El rendimiento solo se compara con una línea
+# base medida en la misma máquina (datos/, no versionada); sin ella solo se informa.
+#   python benchmark_xml.py                         -> compara con referencia_benchmark_xml.json
+#   python benchmark_xml.py --guardar-referencia    -> regenera la referencia (tras un cambio deliberado)
+#   python benchmark_xml.py --guardar-linea-base    -> guarda los parseos/s de esta máquina
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+REFERENCIA_PATH = os.path.join(RAIZ, "referencia_benchmark_xml.json")
+LINEA_BASE_PATH = os.path.join(RAIZ, "datos", "linea_base_benchmark_xml.json")
+UMBRAL_CAIDA = 0.20 # caída de parseos/s tolerada frente a la línea base de la misma máquina
+
+
+def _campos(factura) -> dict:
+    """Campos extraídos, sin los que vienen de la tabla del portal ni los que están vacíos."""
+    return {k: v for k, v in factura.model_dump().items() if v not in (None, 0.0, "N/A", False) and k != "cups"}
+
+
+def _parsear_corpus(procesar, modelo, directorio: str, corpus: list[dict]) -> dict[str, dict]:
+    resultados = {}
+    for variante in corpus:
+        factura = modelo(cups=variante["cups"], numero_factura=variante["numero_factura"])
+        ok = procesar(factura, os.path.join(directorio, variante["nombre"]))
+        resultados[variante["nombre"]] = {"ok": ok, **_campos(factura)}
+    return resultados
+
+
+def _medir(procesar, modelo, directorio: str, corpus: list[dict], rondas: int) -> tuple[float, int]:
+    """Parseos/s (la mejor de 'rondas' pasadas, la menos afectada por ruido) y memoria pico de una pasada."""
+    mejor = float("inf")
+    for _ in range(rondas):
+        inicio = time.perf_counter()
+        _parsear_corpus(procesar, modelo, directorio, corpus)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    tracemalloc.start()
+    _parsear_corpus(procesar, modelo, directorio, corpus)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(corpus) / mejor, pico
+
+
+def _diferencias(esperado: dict[str, dict], obtenido: dict[str, dict]) -> list[str]:
+    errores = []
+    for nombre in sorted(esperado.keys() | obtenido.keys()):
+        a, b = esperado.get(nombre), obtenido.get(nombre)
+        if a is None or b is None:
+            errores.append(f"{nombre}: {'no está en la referencia' if a is None else 'falta en el corpus'}")
+            continue
+        for campo in sorted(a.keys() | b.keys()):
+            if a.get(campo) != b.get(campo):
+                errores.append(f"{nombre}: {campo} = {b.get(campo)!r} (referencia {a.get(campo)!r})")
+    return errores
+
+
+def _comparar_rendimiento(args, parseos_s: float) -> list[str]:
+    """Caída de parseos/s frente a la línea base de esta máquina (sin línea base solo avisa)."""
+    linea_base = None
+    if os.path.exists(args.linea_base):
+        with open(args.linea_base, encoding="utf-8") as f:
+            linea_base = json.load(f)
+    if not linea_base or (linea_base["cantidad"], linea_base["semilla"]) != (args.cantidad, args.semilla):
+        print(f"[BENCH XML] AVISO: sin línea base de rendimiento de esta máquina para este corpus; "
+              f"no se comparan los parseos/s (genérela con --guardar-linea-base antes del cambio).")
+        return []
+    minimo = linea_base["parseos_por_segundo"] * (1 - args.umbral)
+    print(f"[BENCH XML] Línea base: {linea_base['parseos_por_segundo']} parseos/s (mínimo aceptado {minimo:.1f}), memoria pico {linea_base['memoria_pico_kb']} KB")
+    if parseos_s < minimo:
+        return [f"rendimiento: {parseos_s:.1f} parseos/s < {minimo:.1f} (caída de más del {args.umbral:.0%})"]
+    return []
+
+
+def main(args) -> int:
+    # El parser escribe una línea de log por factura: se descarta para no medir la consola ni el disco
+    os.environ["ENDESA_LOG_PATH"] = os.devnull
+    if RAIZ not in sys.path:
+        sys.path.insert(0, RAIZ)
+    from generador_facturae import generar_corpus
+    from modelos_datos import FacturaEndesaCliente
+    from xml_parser import procesar_xml_local
+
+    directorio = args.directorio or tempfile.mkdtemp(prefix="corpus_xml_")
+    corpus = generar_corpus(directorio, args.cantidad, args.semilla)
+    tamano = sum(os.path.getsize(os.path.join(directorio, v["nombre"])) for v in corpus)
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            obtenido = _parsear_corpus(procesar_xml_local, FacturaEndesaCliente, directorio, corpus)
+            parseos_s, pico = _medir(procesar_xml_local, FacturaEndesaCliente, directorio, corpus, args.rondas)
+    finally:
+        if not args.directorio:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+    print(f"[BENCH XML] {len(corpus)} ficheros ({tamano / 1024:.0f} KB)")
+    print(f"[BENCH XML] {parseos_s:.1f} parseos/s | {tamano / 1024 / 1024 * parseos_s / len(corpus):.2f} MB/s | memoria pico {pico / 1024:.0f} KB")
+
+    if args.guardar_linea_base:
+        os.makedirs(os.path.dirname(args.linea_base) or ".", exist_ok=True)
+        with open(args.linea_base, "w", encoding="utf-8") as f:
+            json.dump(
+                {"cantidad": args.cantidad, "semilla": args.semilla, "parseos_por_segundo": round(parseos_s, 1),
+                 "memoria_pico_kb": round(pico / 1024)},
+                f, indent=1, sort_keys=True,
+            )
+        print(f"[BENCH XML] Línea base de esta máquina guardada en {args.linea_base}")
+    if args.guardar_referencia:
+        # Solo los campos: los parseos/s dependen de la máquina y no se versionan
+        with open(args.referencia, "w", encoding="utf-8") as f:
+            json.dump(
+                {"cantidad": args.cantidad, "semilla": args.semilla, "resultados": obtenido},
+                f, ensure_ascii=False, indent=1, sort_keys=True,
+            )
+        print(f"[BENCH XML] Referencia guardada en {args.referencia}")
+    if args.guardar_linea_base or args.guardar_referencia:
+        return 0
+
+    if not os.path.exists(args.referencia):
+        print(f"[BENCH XML] No existe {args.referencia}: genérela con --guardar-referencia")
+        return 1
+    with open(args.referencia, encoding="utf-8") as f:
+        referencia = json.load(f)
+
+    fallos = []
+    if (referencia["cantidad"], referencia["semilla"]) == (args.cantidad, args.semilla):
+        fallos += _diferencias(referencia["resultados"], obtenido)
+    else:
+        print("[BENCH XML] El corpus no es el de la referencia: no se comparan los campos.")
+    fallos += _comparar_rendimiento(args, parseos_s)
+
+    for fallo in fallos:
+        print(f"[BENCH XML] FALLO {fallo}")
+    print(f"[BENCH XML] {'FALLO' if fallos else 'OK'}")
+    return 1 if fallos else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark y referencia de campos del parser XML de Facturae.")
+    parser.add_argument("--cantidad", type=int, default=48, help="Número de facturas del corpus.")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--rondas", type=int, default=10, help="Pasadas cronometradas (se toma la mejor).")
+    parser.add_argument("--umbral", type=float, default=UMBRAL_CAIDA, help="Caída de rendimiento tolerada frente a la línea base (0.20 = 20%%).")
+    parser.add_argument("--referencia", default=REFERENCIA_PATH, help="Fichero JSON de referencia de campos.")
+    parser.add_argument("--linea-base", default=LINEA_BASE_PATH, help="Fichero JSON con los parseos/s medidos en esta máquina.")
+    parser.add_argument("--directorio", help="Dónde escribir el corpus (por defecto, un directorio temporal).")
+    parser.add_argument("--guardar-referencia", action="store_true", help="Guarda los campos actuales como referencia.")
+    parser.add_argument("--guardar-linea-base", action="store_true", help="Guarda el rendimiento actual como línea base de esta máquina.")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,117 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+from datetime import datetime
+from logs import escribir_log
+
+# Caché persistente de respuestas del OCR (no se borra con /clear_files)
+CACHE_OCR_PATH = os.environ.get("ENDESA_CACHE_OCR_PATH", os.path.join("datos", "cache_ocr.db"))
+# Tamaño máximo de la caché (MB); al superarlo se eliminan las entradas usadas hace más tiempo
+CACHE_OCR_MAX_MB = float(os.environ.get("ENDESA_CACHE_OCR_MAX_MB", "50"))
+
+
+class CacheOCR:
+    """
+    Caché SQLite del JSON estructurado devuelto por el OCR, indexada por el SHA-256 del PDF
+    y la versión del OCR (modelo + prompt + esquema). Un cambio de prompt o de esquema
+    invalida las entradas anteriores sin borrarlas; la expulsión por tamaño (LRU) las
+    elimina con el tiempo. Lleva contadores de aciertos y fallos para la tasa de acierto.
+    """
+    def __init__(self, db_path: str = CACHE_OCR_PATH, max_bytes: int = int(CACHE_OCR_MAX_MB * 1024 * 1024)):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock() # contadores compartidos con los hilos del OCR síncrono
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._conectar() as con:
+            con.executescript("""
+                CREATE TABLE IF NOT EXISTS ocr (
+                    sha256 TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    datos TEXT NOT NULL,
+                    tamano INTEGER NOT NULL,
+                    creado TEXT NOT NULL,
+                    ultimo_uso TEXT NOT NULL,
+                    PRIMARY KEY (sha256, version)
+                );
+                CREATE INDEX IF NOT EXISTS idx_ocr_uso ON ocr (ultimo_uso);
+            """)
+
+    @contextmanager
+    def _conectar(self) -> Iterator[sqlite3.Connection]:
+        con = sqlite3.connect(self.db_path)
+        try:
+            with con: # commit / rollback
+                yield con
+        finally:
+            con.close()
+
+    def obtener(self, sha256: str, version: str) -> dict | None:
+        """Devuelve el JSON guardado para este PDF y versión del OCR, o None (y cuenta el acierto/fallo)."""
+        try:
+            with self._conectar() as con:
+                fila = con.execute(
+                    "SELECT datos FROM ocr WHERE sha256 = ? AND version = ?", (sha256, version)
+                ).fetchone()
+                if fila:
+                    con.execute(
+                        "UPDATE ocr SET ultimo_uso = ? WHERE sha256 = ? AND version = ?",
+                        (datetime.now().isoformat(timespec="microseconds"), sha256, version),
+                    )
+        except Exception as e:
+            escribir_log(f"[CACHE OCR] Fallo al consultar la caché: {e}")
+            fila = None
+
+        with self._lock:
+            if fila:
+                self.aciertos += 1
+            else:
+                self.fallos += 1
+        return json.loads(fila[0]) if fila else None
+
+    def guardar(self, sha256: str, version: str, datos: dict):
+        """Guarda la respuesta del OCR y expulsa las entradas más antiguas si se supera el tamaño máximo."""
+        texto = json.dumps(datos, ensure_ascii=False)
+        ahora = datetime.now().isoformat(timespec="microseconds")
+        try:
+            with self._conectar() as con:
+                con.execute(
+                    "INSERT OR REPLACE INTO ocr VALUES (?, ?, ?, ?, ?, ?)",
+                    (sha256, version, texto, len(texto.encode("utf-8")), ahora, ahora),
+                )
+                self._expulsar(con)
+        except Exception as e:
+            escribir_log(f"[CACHE OCR] Fallo al guardar en la caché: {e}")
+
+    def _expulsar(self, con: sqlite3.Connection):
+        total = con.execute("SELECT COALESCE(SUM(tamano), 0) FROM ocr").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        expulsadas = 0
+        for sha256, version, tamano in con.execute(
+            "SELECT sha256, version, tamano FROM ocr ORDER BY ultimo_uso"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            con.execute("DELETE FROM ocr WHERE sha256 = ? AND version = ?", (sha256, version))
+            total -= tamano
+            expulsadas += 1
+        escribir_log(f"[CACHE OCR] {expulsadas} entrada(s) expulsada(s) por tamaño.")
+
+    def estadisticas(self) -> dict:
+        """Contadores de uso y ocupación de la caché."""
+        with self._conectar() as con:
+            entradas, total = con.execute("SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM ocr").fetchone()
+        consultas = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_acierto": round(self.aciertos / consultas, 4) if consultas else 0.0,
+            "entradas": entradas,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,161 @@
+import asyncio
+import os
+import time
+from playwright.async_api import APIRequestContext
+from modelos_datos import FacturaEndesaCliente
+from logs import escribir_log
+from metricas import medir_etapa, DESCARGAS_EN_CURSO
+
+# Descargas directas simultáneas como máximo (por proceso)
+MAX_DESCARGAS_CONCURRENTES = max(1, int(os.environ.get("ENDESA_DESCARGAS_CONCURRENTES", "6")))
+# Tras este número de fallos seguidos de la vía directa de un tipo de documento, se vuelve a los clics
+MAX_FALLOS_DIRECTOS = 3
+# Segundos que la vía directa de ese tipo queda desactivada antes de volver a intentarla
+ENFRIAMIENTO_DIRECTAS_S = max(0.0, float(os.environ.get("ENDESA_DESCARGAS_ENFRIAMIENTO_S", "300")))
+DESCARGA_TIMEOUT = 30000 # ms, igual que la espera de la descarga por clic
+
+# Campos de la fila que pueden identificar el documento dentro de la URL de descarga
+CAMPOS_IDENTIFICADORES = ('descarga_selector', 'numero_factura')
+
+
+def _contenido_valido(doc_type: str, cabecera: bytes) -> bool:
+    """Descarta respuestas que no son el documento (p. ej. la página de login en HTML)."""
+    inicio = cabecera.lstrip()[:64].lower()
+    if doc_type == 'PDF':
+        return inicio.startswith(b'%pdf')
+    return inicio.startswith(b'<') and not inicio.startswith((b'<!doctype html', b'<html'))
+
+
+def _guardar_documento(save_path: str, cuerpo: bytes):
+    """Escritura atómica: el documento solo aparece con su nombre final cuando está completo."""
+    os.makedirs(os.path.dirname(save_path) or ".", exist_ok=True)
+    tmp_path = save_path + ".part"
+    with open(tmp_path, "wb") as f:
+        f.write(cuerpo)
+    os.replace(tmp_path, save_path)
+
+
+class MotorDescargas:
+    """
+    Descarga directa de documentos con el APIRequestContext autenticado del contexto de Playwright,
+    sin clics ni esperas de 'expect_download', con varias descargas a la vez.
+
+    La URL de cada documento se resuelve a partir de la fila:
+    - si 'descarga_selector' ya es una URL, se usa tal cual (PDF);
+    - si no, a partir de la URL capturada en una descarga por clic anterior del mismo tipo,
+      sustituyendo el identificador de aquella fila por el de la actual ('aprender').
+    Si no hay plantilla, o la descarga directa falla, el robot usa la descarga por clic.
+    Tras MAX_FALLOS_DIRECTOS fallos seguidos de un tipo, su vía directa se desactiva durante
+    ENFRIAMIENTO_DIRECTAS_S segundos y su plantilla se olvida (se vuelve a aprender del clic).
+    """
+    def __init__(self, max_concurrentes: int = MAX_DESCARGAS_CONCURRENTES):
+        self.max_concurrentes = max_concurrentes
+        # doc_type -> (url capturada, campo identificador, valor en aquella fila)
+        self._plantillas: dict[str, tuple[str, str, str]] = {}
+        self._fallos_seguidos: dict[str, int] = {}
+        self._desactivado_hasta: dict[str, float] = {} # doc_type -> time.monotonic()
+        self._semaforo: asyncio.Semaphore | None = None
+        self.directas = 0
+        self.fallidas = 0
+
+    def _obtener_semaforo(self) -> asyncio.Semaphore:
+        # Se crea dentro del event loop en el primer uso
+        if self._semaforo is None:
+            self._semaforo = asyncio.Semaphore(self.max_concurrentes)
+        return self._semaforo
+
+    def aprender(self, doc_type: str, url: str, factura: FacturaEndesaCliente):
+        """Registra la URL de una descarga por clic como plantilla para las siguientes filas."""
+        if doc_type in self._plantillas or not url.startswith(("http://", "https://")):
+            return # blob:/data: se generan en el navegador y no se pueden repetir
+        for campo in CAMPOS_IDENTIFICADORES:
+            valor = getattr(factura, campo) or ""
+            if len(valor) >= 4 and valor in url:
+                self._plantillas[doc_type] = (url, campo, valor)
+                escribir_log(f"    -> [DESCARGAS] Plantilla de descarga directa {doc_type} aprendida (por {campo}).")
+                return
+
+    def _activo(self, doc_type: str) -> bool:
+        """False mientras dura el enfriamiento tras demasiados fallos seguidos de ese tipo."""
+        hasta = self._desactivado_hasta.get(doc_type)
+        if hasta is None:
+            return True
+        if time.monotonic() < hasta:
+            return False
+        del self._desactivado_hasta[doc_type]
+        self._fallos_seguidos[doc_type] = 0
+        escribir_log(f"    -> [DESCARGAS] Fin del enfriamiento: se reintenta la descarga directa {doc_type}.")
+        return True
+
+    def _registrar_fallo(self, doc_type: str):
+        self._fallos_seguidos[doc_type] = self._fallos_seguidos.get(doc_type, 0) + 1
+        self.fallidas += 1
+        if self._fallos_seguidos[doc_type] >= MAX_FALLOS_DIRECTOS and doc_type not in self._desactivado_hasta:
+            self._desactivado_hasta[doc_type] = time.monotonic() + ENFRIAMIENTO_DIRECTAS_S
+            # La URL aprendida puede haber caducado: la siguiente descarga por clic aporta una nueva
+            self._plantillas.pop(doc_type, None)
+            escribir_log(f"    -> [DESCARGAS] {MAX_FALLOS_DIRECTOS} fallos seguidos: descarga directa {doc_type} desactivada {ENFRIAMIENTO_DIRECTAS_S:.0f}s.")
+
+    def resolver_url(self, doc_type: str, factura: FacturaEndesaCliente) -> str | None:
+        """URL directa del documento de esta fila, o None si hay que usar el clic."""
+        if not self._activo(doc_type):
+            return None
+        if doc_type == 'PDF' and (factura.descarga_selector or "").startswith(("http://", "https://")):
+            return factura.descarga_selector
+        plantilla = self._plantillas.get(doc_type)
+        if not plantilla:
+            return None
+        url, campo, valor = plantilla
+        nuevo_valor = getattr(factura, campo) or ""
+        if not nuevo_valor or nuevo_valor == "N/A":
+            return None
+        return url.replace(valor, nuevo_valor)
+
+    @medir_etapa(lambda self, request, doc_type, *_: f"descarga_directa_{doc_type.lower()}", es_fallo=lambda ok: not ok)
+    async def descargar(self, request: APIRequestContext, doc_type: str, url: str, save_path: str) -> bool:
+        """Descarga 'url' en 'save_path' (escritura atómica). Devuelve False si no es el documento esperado."""
+        async with self._obtener_semaforo():
+            respuesta = None
+            try:
+                respuesta = await request.get(url, timeout=DESCARGA_TIMEOUT)
+                if not respuesta.ok:
+                    raise ValueError(f"HTTP {respuesta.status}")
+                cuerpo = await respuesta.body()
+                if not _contenido_valido(doc_type, cuerpo[:1024]):
+                    raise ValueError("la respuesta no es un documento " + doc_type)
+
+                # Escritura en un hilo: no bloquea el event loop con documentos grandes
+                await asyncio.to_thread(_guardar_documento, save_path, cuerpo)
+
+                self._fallos_seguidos[doc_type] = 0
+                self.directas += 1
+                escribir_log(f"    -> [OK] [DESCARGA DIRECTA {doc_type}] Guardado en: {save_path}")
+                return True
+            except Exception as e:
+                self._registrar_fallo(doc_type)
+                escribir_log(f"    -> [ADVERTENCIA {doc_type}] Descarga directa fallida ({e}). Se usará el clic.")
+                return False
+            finally:
+                if respuesta is not None:
+                    await respuesta.dispose()
+
+    async def descargar_fila(self, request: APIRequestContext, factura: FacturaEndesaCliente, destinos: dict[str, str]) -> dict[str, str | None]:
+        """
+        Descarga a la vez los documentos de la fila con URL resoluble.
+        Devuelve doc_type -> ruta guardada, o None si hay que recurrir al clic.
+        """
+        urls = {doc_type: self.resolver_url(doc_type, factura) for doc_type in destinos}
+
+        async def _uno(doc_type: str) -> str | None:
+            if not urls[doc_type]:
+                return None
+            with DESCARGAS_EN_CURSO.en_curso():
+                ok = await self.descargar(request, doc_type, urls[doc_type], destinos[doc_type])
+            return destinos[doc_type] if ok else None
+
+        rutas = await asyncio.gather(*(_uno(doc_type) for doc_type in destinos))
+        return dict(zip(destinos, rutas))
+
+    def puede_descargar_directo(self, factura: FacturaEndesaCliente) -> bool:
+        """Indica si al menos un documento de la fila tiene URL directa."""
+        return any(self.resolver_url(doc_type, factura) for doc_type in ('XML', 'PDF'))
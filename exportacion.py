@@ -0,0 +1,155 @@
+import csv
+import io
+import os
+import threading
+import typing
+import uuid
+from datetime import datetime
+from typing import Iterable, Iterator
+from modelos_datos import FacturaEndesaCliente
+from almacen_facturas import AlmacenFacturas, parsear_fecha
+from logs import escribir_log
+
+# pyarrow es opcional: sin él no se escribe el dataset Parquet (el CSV en streaming sigue disponible)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# --- EXPORTACIÓN CONSOLIDADA (dataset Parquet y CSV en streaming) ---
+# Cada factura procesada se añade a un único dataset Parquet con todos los campos del modelo
+# y columnas tipadas (importes float64, días int64, fechas date32), particionado al estilo
+# Hive por mes de emisión y CUPS:  datos/export/mes=2025-03/cups=ES.../part-*.parquet
+# Se lee entero con pyarrow.parquet.read_table("datos/export") (o pandas, DuckDB, Spark...).
+
+EXPORT_DIR = os.environ.get("ENDESA_EXPORT_DIR", os.path.join("datos", "export"))
+# "0" desactiva el dataset aunque pyarrow esté instalado
+EXPORT_ACTIVO = os.environ.get("ENDESA_EXPORT_PARQUET", "1") != "0"
+# Al llegar a este número de ficheros, una partición se compacta en uno solo (sin repetidos)
+EXPORT_COMPACTAR = max(2, int(os.environ.get("ENDESA_EXPORT_COMPACTAR", "8")))
+
+PARTICIONES = ["mes", "cups"]
+CAMPOS = list(FacturaEndesaCliente.model_fields) # orden del modelo (también el de las columnas del CSV)
+CAMPOS_FECHA = {'fecha_emision', 'fecha_inicio_periodo', 'fecha_fin_periodo', 'fecha_de_vencimiento', 'fecha_de_cobro_en_banco'}
+
+
+def _tipo_arrow(nombre: str, anotacion):
+    if nombre in CAMPOS_FECHA:
+        return pa.date32()
+    # Optional[X] -> X
+    base = next((a for a in typing.get_args(anotacion) if a is not type(None)), anotacion)
+    return {bool: pa.bool_(), int: pa.int64(), float: pa.float64()}.get(base, pa.string())
+
+
+def _esquema():
+    campos = [pa.field(n, _tipo_arrow(n, c.annotation)) for n, c in FacturaEndesaCliente.model_fields.items()]
+    # 'exportado' en microsegundos: decide la versión más reciente de una factura al compactar
+    return pa.schema(campos + [pa.field("exportado", pa.timestamp("us")), pa.field("mes", pa.string())])
+
+
+def _es_exportable(factura: FacturaEndesaCliente) -> bool:
+    return not factura.error_RPA and factura.numero_factura not in (None, "", "N/A")
+
+
+def _fila(factura: FacturaEndesaCliente, exportado: datetime) -> dict:
+    fila = factura.model_dump()
+    for campo in CAMPOS_FECHA:
+        fila[campo] = parsear_fecha(fila[campo])
+    emision = fila["fecha_emision"]
+    fila["mes"] = emision.strftime("%Y-%m") if emision else "desconocido"
+    fila["exportado"] = exportado
+    return fila
+
+
+class ExportadorParquet:
+    """
+    Dataset Parquet de las facturas procesadas. Cada llamada a 'anadir' escribe un fichero
+    nuevo por partición (mes, CUPS); una factura reprocesada se vuelve a añadir y la
+    compactación de la partición conserva solo su versión más reciente ('exportado').
+    """
+    def __init__(self, directorio: str = EXPORT_DIR, activo: bool = EXPORT_ACTIVO):
+        self.directorio = directorio
+        self.activo = activo and pa is not None
+        self._lock = threading.Lock()
+        if activo and pa is None:
+            escribir_log("[EXPORT] pyarrow no está instalado: no se genera el dataset Parquet (pip install pyarrow).")
+        self.esquema = _esquema() if self.activo else None
+
+    def anadir(self, facturas: Iterable[FacturaEndesaCliente]) -> int:
+        """Añade las facturas válidas al dataset. Devuelve cuántas se escribieron."""
+        if not self.activo:
+            return 0
+        ahora = datetime.now()
+        filas = [_fila(f, ahora) for f in facturas if _es_exportable(f)]
+        if not filas:
+            return 0
+        try:
+            with self._lock:
+                tabla = pa.Table.from_pylist(filas, schema=self.esquema)
+                pq.write_to_dataset(
+                    tabla, self.directorio, partition_cols=PARTICIONES,
+                    basename_template=f"part-{ahora:%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}-{{i}}.parquet",
+                )
+                for particion in {(fila["mes"], fila["cups"]) for fila in filas}:
+                    self._compactar_si_procede(*particion)
+        except Exception as e:
+            escribir_log(f"[EXPORT] ERROR al escribir el dataset Parquet: {e}")
+            return 0
+        return len(filas)
+
+    def _ruta_particion(self, mes: str, cups: str) -> str:
+        return os.path.join(self.directorio, f"mes={mes}", f"cups={cups}")
+
+    def _compactar_si_procede(self, mes: str, cups: str):
+        ruta = self._ruta_particion(mes, cups)
+        ficheros = sorted(os.path.join(ruta, f) for f in os.listdir(ruta) if f.endswith(".parquet"))
+        if len(ficheros) < EXPORT_COMPACTAR:
+            return
+        # Los ficheros de la partición no llevan las columnas mes/cups (van en la ruta)
+        esquema = pa.schema([c for c in self.esquema if c.name not in PARTICIONES])
+        recientes: dict[str, dict] = {}
+        for fichero in ficheros:
+            for fila in pq.read_table(fichero).to_pylist():
+                previa = recientes.get(fila["numero_factura"])
+                if previa is None or fila["exportado"] >= previa["exportado"]:
+                    recientes[fila["numero_factura"]] = fila
+        destino = os.path.join(ruta, f"part-{datetime.now():%Y%m%d%H%M%S}-compactado.parquet")
+        pq.write_table(pa.Table.from_pylist(list(recientes.values()), schema=esquema), destino + ".tmp")
+        os.replace(destino + ".tmp", destino)
+        for fichero in ficheros:
+            if fichero != destino:
+                os.remove(fichero)
+        escribir_log(f"[EXPORT] Partición mes={mes}/cups={cups} compactada: {len(ficheros)} ficheros -> 1 ({len(recientes)} facturas).")
+
+
+EXPORTADOR = ExportadorParquet()
+
+
+# --- CSV consolidado en streaming ---
+
+def _valor_csv(valor) -> str:
+    return "" if valor is None else str(valor)
+
+
+def lotes_csv(lotes: Iterator[list[FacturaEndesaCliente]]) -> Iterator[str]:
+    """Texto CSV (';', todos los campos del modelo) de cada lote de facturas, con la cabecera al principio."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=';')
+    escritor.writerow(CAMPOS)
+    for lote in lotes:
+        escritor.writerows([_valor_csv(getattr(f, c)) for c in CAMPOS] for f in lote)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue() # solo la cabecera (filtro sin facturas)
+
+
+if __name__ == "__main__":
+    # Carga inicial: vuelca al dataset todo el histórico del almacén local
+    almacen = AlmacenFacturas()
+    if not EXPORTADOR.activo:
+        raise SystemExit("El dataset Parquet está desactivado o pyarrow no está instalado.")
+    total = sum(EXPORTADOR.anadir(lote) for lote in almacen.iterar_lotes(lote=2000))
+    print(f"[EXPORT] {total} facturas del almacén exportadas a {EXPORT_DIR}")
@@ -0,0 +1,182 @@
+import os
+import random
+from datetime import date, timedelta
+
+# --- FACTURAE SINTÉTICA ESTILO ENDESA ---
+# Genera XML con la misma forma que las facturas electrónicas que descarga el robot
+# (Facturae 3.2 con la extensión de Endesa: tarifa, dirección del suministro y medidas por
+# periodo). Lo usan el portal falso del benchmark, benchmark_xml.py y las pruebas del parser
+# XML (tests/test_xml_parser.py).
+
+NAMESPACE_FACTURAE = "http://www.facturae.gob.es/formato/Versiones/Facturaev3_2.xml"
+TIPO_IVA = 21.0
+TIPO_IMPUESTO_ELECTRICO = 5.11269632
+
+
+def _importe(valor: float) -> str:
+    return f"{valor:.2f}"
+
+
+def _linea(p: str, descripcion: str, cantidad: float, precio: float, fecha: date) -> tuple[str, float]:
+    """Una InvoiceLine de Facturae y su importe."""
+    total = round(cantidad * precio, 2)
+    xml = (
+        f"<{p}InvoiceLine>"
+        f"<{p}ItemDescription>{descripcion}</{p}ItemDescription>"
+        f"<{p}Quantity>{cantidad:.2f}</{p}Quantity>"
+        f"<{p}UnitOfMeasure>01</{p}UnitOfMeasure>"
+        f"<{p}UnitPriceWithoutTax>{precio:.6f}</{p}UnitPriceWithoutTax>"
+        f"<{p}TotalCost>{_importe(total)}</{p}TotalCost>"
+        f"<{p}GrossAmount>{_importe(total)}</{p}GrossAmount>"
+        f"<{p}TransactionDate>{fecha.isoformat()}</{p}TransactionDate>"
+        f"</{p}InvoiceLine>"
+    )
+    return xml, total
+
+
+def generar_facturae(
+    cups: str, numero_factura: str, fecha_emision: date, inicio: date, fin: date,
+    rng: random.Random | None = None, periodos: int = 3, indexada: bool = False, prefijo: str = "fe", relleno: int = 0,
+    direccion: str = "CALLE MAYOR 1", codigo_postal: str = "28001", poblacion: str = "MADRID", provincia: str = "MADRID",
+) -> bytes:
+    """
+    Factura Facturae de un suministro para el periodo [inicio, fin], codificada en latin-1
+    (como las del portal). 'periodos' (1-6) fija los términos de potencia y energía;
+    con 'indexada' la energía se factura como 'Energia precio indexado Px'.
+    'prefijo' es el prefijo del espacio de nombres ("" = espacio de nombres por defecto).
+    'relleno' añade líneas informativas a coste cero (solo aumentan el tamaño del fichero).
+    """
+    rng = rng or random.Random(numero_factura)
+    p = f"{prefijo}:" if prefijo else ""
+    dias = (fin - inicio).days + 1
+    fecha_linea = fin
+    lineas: list[str] = []
+    base = 0.0
+
+    for i in range(1, periodos + 1):
+        kw = rng.choice((10.0, 15.0, 25.0, 50.0, 100.0))
+        xml, total = _linea(p, f"Pot. P{i}", kw * dias, round(rng.uniform(0.002, 0.09), 6), fecha_linea)
+        lineas.append(xml)
+        base += total
+    consumos: dict[int, float] = {}
+    for i in range(1, periodos + 1):
+        consumos[i] = round(rng.uniform(50, 4000), 2)
+        descripcion = f"Energia precio indexado P{i}" if indexada else f"Consumo P{i}"
+        xml, total = _linea(p, descripcion, consumos[i], round(rng.uniform(0.08, 0.25), 6), fecha_linea)
+        lineas.append(xml)
+        base += total
+    if rng.random() < 0.2:
+        xml, total = _linea(p, "Exceso Pot. P1", round(rng.uniform(1, 30), 2), 1.4064, fecha_linea)
+        lineas.append(xml)
+        base += total
+
+    for i in range(1, relleno + 1):
+        lineas.append(_linea(p, f"Informacion regulada {i}", 0, 0, fecha_linea)[0])
+
+    xml, bono = _linea(p, "Bono Social", dias, 0.012742, fecha_linea)
+    lineas.append(xml)
+    base += bono
+    impuesto = round(base * TIPO_IMPUESTO_ELECTRICO / 100, 2)
+    xml, _ = _linea(p, "Impuesto Electricidad", 1, impuesto, fecha_linea)
+    lineas.append(xml)
+    base += impuesto
+    xml, alquiler = _linea(p, "Alquiler del contador", dias, 0.0268, fecha_linea)
+    lineas.append(xml)
+    base += alquiler
+
+    base = round(base, 2)
+    iva = round(base * TIPO_IVA / 100, 2)
+    total_factura = round(base + iva, 2)
+    tarifa = "3.0TD" if periodos > 3 else "2.0TD"
+    medidas = "".join(
+        f"<{p}Medida><{p}CodigoDH>AEA{i}</{p}CodigoDH>"
+        f"<{p}LecturaDesde>{rng.randint(0, 90000)}</{p}LecturaDesde>"
+        f"<{p}ConsumoCalculado>{consumos[i]:.2f}</{p}ConsumoCalculado></{p}Medida>"
+        for i in consumos
+    )
+    xmlns = f'xmlns:{prefijo}="{NAMESPACE_FACTURAE}"' if prefijo else f'xmlns="{NAMESPACE_FACTURAE}"'
+
+    documento = (
+        f'<?xml version="1.0" encoding="ISO-8859-1"?>\n'
+        f'<{p}Facturae {xmlns}>'
+        f"<{p}FileHeader><{p}SchemaVersion>3.2</{p}SchemaVersion><{p}Modality>I</{p}Modality>"
+        f"<{p}InvoiceIssuerType>EM</{p}InvoiceIssuerType></{p}FileHeader>"
+        f"<{p}Parties><{p}SellerParty><{p}LegalEntity><{p}CorporateName>ENDESA ENERGÍA, S.A.U.</{p}CorporateName>"
+        f"</{p}LegalEntity></{p}SellerParty></{p}Parties>"
+        f"<{p}Invoices><{p}Invoice>"
+        f"<{p}InvoiceHeader><{p}InvoiceNumber>{numero_factura}</{p}InvoiceNumber>"
+        f"<{p}InvoiceDocumentType>FC</{p}InvoiceDocumentType></{p}InvoiceHeader>"
+        f"<{p}InvoiceIssueData><{p}IssueDate>{fecha_emision.isoformat()}</{p}IssueDate>"
+        f"<{p}InvoicingPeriod><{p}StartDate>{inicio.isoformat()}</{p}StartDate><{p}EndDate>{fin.isoformat()}</{p}EndDate>"
+        f"</{p}InvoicingPeriod></{p}InvoiceIssueData>"
+        f"<{p}TaxesOutputs><{p}Tax><{p}TaxTypeCode>01</{p}TaxTypeCode><{p}TaxRate>{TIPO_IVA:.2f}</{p}TaxRate>"
+        f"<{p}TaxAmount><{p}TotalAmount>{_importe(iva)}</{p}TotalAmount></{p}TaxAmount></{p}Tax></{p}TaxesOutputs>"
+        f"<{p}InvoiceTotals><{p}TotalGrossAmount>{_importe(base)}</{p}TotalGrossAmount>"
+        f"<{p}TotalGrossAmountBeforeTaxes>{_importe(base)}</{p}TotalGrossAmountBeforeTaxes>"
+        f"<{p}TotalTaxOutputs>{_importe(iva)}</{p}TotalTaxOutputs>"
+        f"<{p}InvoiceTotal>{_importe(total_factura)}</{p}InvoiceTotal>"
+        f"<{p}TotalExecutableAmount>{_importe(total_factura)}</{p}TotalExecutableAmount></{p}InvoiceTotals>"
+        f"<{p}Items>{''.join(lineas)}</{p}Items>"
+        f"<{p}PaymentDetails><{p}Installment>"
+        f"<{p}InstallmentDueDate>{(fecha_emision + timedelta(days=20)).isoformat()}</{p}InstallmentDueDate>"
+        f"<{p}InstallmentAmount>{_importe(total_factura)}</{p}InstallmentAmount>"
+        f"<{p}PaymentMeans>02</{p}PaymentMeans></{p}Installment></{p}PaymentDetails>"
+        f"<{p}AdditionalData><{p}Extensions><{p}DatosSuministro>"
+        f"<{p}CUPS>{cups}</{p}CUPS><{p}CodigoTarifa>{tarifa}</{p}CodigoTarifa>"
+        f"<{p}DireccionSuministro><{p}Direccion>{direccion}</{p}Direccion>"
+        f"<{p}CodigoPostal>{codigo_postal}</{p}CodigoPostal><{p}Poblacion>{poblacion}</{p}Poblacion>"
+        f"<{p}Provincia>{provincia}</{p}Provincia></{p}DireccionSuministro>"
+        f"</{p}DatosSuministro><{p}Medidas>{medidas}</{p}Medidas></{p}Extensions></{p}AdditionalData>"
+        f"</{p}Invoice></{p}Invoices></{p}Facturae>\n"
+    )
+    return documento.encode("latin-1")
+
+
+# --- CORPUS PARA EL BENCHMARK DEL PARSER XML ---
+
+# Direcciones con caracteres latin-1 (Ñ, tildes, apóstrofo) como las del portal
+DIRECCIONES_LATIN1 = (
+    ("CALLE MAYOR 1", "28001", "MADRID", "MADRID"),
+    ("AVDA. DE LA PEÑA 12", "15001", "A CORUÑA", "A CORUÑA"),
+    ("PLAZA DEL OBISPO Nº 3", "29001", "MÁLAGA", "MÁLAGA"),
+    ("CTRA. ÁVILA-ÚBEDA KM 4", "05001", "ÁVILA", "ÁVILA"),
+    ("CARRER DE L'ESGLÉSIA 7", "08901", "L'HOSPITALET DE LLOBREGAT", "BARCELONA"),
+    ("POLÍGONO INDUSTRIAL SEÑORÍO", "10001", "CÁCERES", "CÁCERES"),
+)
+PREFIJOS = ("fe", "", "ns0", "ns2")
+RELLENOS = (0, 0, 0, 20, 200) # la mayoría de facturas son pequeñas; algunas, muy largas
+
+
+def generar_corpus(directorio: str, cantidad: int = 48, semilla: int = 1) -> list[dict]:
+    """
+    Escribe 'cantidad' facturas en 'directorio' combinando periodos (1-6), energía indexada,
+    prefijos de espacio de nombres, direcciones latin-1 y tamaños. Es determinista para una
+    semilla dada (fechas fijas, no relativas a hoy) para poder compararlo con una referencia.
+    Devuelve la descripción de cada fichero (nombre, cups, numero_factura y variantes).
+    """
+    rng = random.Random(semilla)
+    os.makedirs(directorio, exist_ok=True)
+    corpus = []
+    for n in range(cantidad):
+        fin = date(2024, 1, 31) + timedelta(days=30 * (n % 24))
+        inicio = fin.replace(day=1)
+        variante = {
+            "cups": f"ES0031{n + 1:012d}{rng.choice('ABCDEFGHJK')}{rng.choice('LMNPQRSTVW')}",
+            "numero_factura": f"B{semilla:02d}{n:05d}",
+            "periodos": n % 6 + 1,
+            "indexada": n % 4 == 1,
+            "prefijo": PREFIJOS[n % len(PREFIJOS)],
+            "relleno": RELLENOS[n % len(RELLENOS)],
+        }
+        direccion, codigo_postal, poblacion, provincia = DIRECCIONES_LATIN1[n % len(DIRECCIONES_LATIN1)]
+        contenido = generar_facturae(
+            variante["cups"], variante["numero_factura"], fin + timedelta(days=5), inicio, fin,
+            random.Random(f"{semilla}-{n}"), periodos=variante["periodos"], indexada=variante["indexada"],
+            prefijo=variante["prefijo"], relleno=variante["relleno"],
+            direccion=direccion, codigo_postal=codigo_postal, poblacion=poblacion, provincia=provincia,
+        )
+        variante["nombre"] = f"{variante['cups']}_{variante['numero_factura']}.xml"
+        with open(os.path.join(directorio, variante["nombre"]), "wb") as f:
+            f.write(contenido)
+        corpus.append(variante)
+    return corpus
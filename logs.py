@@ -1,15 +1,148 @@
+import atexit
+import json
+import multiprocessing
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
 
+# --- LOG ESTRUCTURADO NO BLOQUEANTE ---
+# escribir_log solo encola el registro; un hilo de fondo lo escribe por lotes (una escritura
+# y un flush por lote) y rota el fichero por tamaño. Cada línea del fichero es un JSON con
+# la fecha, el mensaje y el contexto activo (petición, tarea, CUPS, factura).
+
+LOG_PATH = os.environ.get("ENDESA_LOG_PATH", os.path.join("logs", "log.txt"))
+# Formato del fichero: "json" (una línea JSON por registro) o "texto" (formato clásico)
+LOG_FORMATO = os.environ.get("ENDESA_LOG_FORMATO", "json").lower()
+# Rotación: al superar LOG_MAX_MB se renombra a log.txt.1 (y así hasta LOG_BACKUPS copias)
+LOG_MAX_MB = float(os.environ.get("ENDESA_LOG_MAX_MB", "10"))
+LOG_BACKUPS = max(0, int(os.environ.get("ENDESA_LOG_BACKUPS", "5")))
+LOG_LOTE_MAX = 500 # registros como máximo por escritura
+
+# Contexto que se añade a cada registro (se hereda en las tareas asyncio creadas dentro)
+_contexto: ContextVar[dict] = ContextVar("contexto_log", default={})
+
+_VACIAR = object() # orden para truncar el fichero desde el hilo escritor
+
+
+@contextmanager
+def contexto_log(**campos):
+    """Añade 'campos' (p. ej. request_id, cups, numero_factura) a los registros del bloque."""
+    token = _contexto.set({**_contexto.get(), **{k: v for k, v in campos.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _contexto.reset(token)
+
+
+def _anadir(ruta: str, lineas: list[str]):
+    if lineas:
+        with open(ruta, "a", encoding="utf-8") as f:
+            f.write("".join(lineas))
+
+
+class _EscritorLog:
+    """Hilo de fondo que vacía la cola de registros en el fichero de log."""
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self.cola: queue.SimpleQueue = queue.SimpleQueue()
+        self.hilo = threading.Thread(target=self._bucle, name="escritor-log", daemon=True)
+        self.hilo.start()
+
+    def _bucle(self):
+        while True:
+            lote = [self.cola.get()]
+            while len(lote) < LOG_LOTE_MAX:
+                try:
+                    lote.append(self.cola.get_nowait())
+                except queue.Empty:
+                    break
+            fin = None in lote
+            try:
+                self._escribir([r for r in lote if r is not None])
+            except Exception as e:
+                print(f"[LOG] No se pudo escribir en {self.ruta}: {e}")
+            if fin:
+                return
+
+    def _escribir(self, lote: list):
+        os.makedirs(os.path.dirname(self.ruta) or ".", exist_ok=True)
+        pendientes: list[str] = []
+        for registro in lote:
+            if registro is _VACIAR:
+                _anadir(self.ruta, pendientes)
+                pendientes = []
+                open(self.ruta, "w").close()
+            else:
+                pendientes.append(registro)
+        _anadir(self.ruta, pendientes)
+        if LOG_BACKUPS and os.path.exists(self.ruta) and os.path.getsize(self.ruta) > LOG_MAX_MB * 1024 * 1024:
+            self._rotar()
+
+    def _rotar(self):
+        for i in range(LOG_BACKUPS - 1, 0, -1):
+            if os.path.exists(f"{self.ruta}.{i}"):
+                os.replace(f"{self.ruta}.{i}", f"{self.ruta}.{i + 1}")
+        os.replace(self.ruta, f"{self.ruta}.1")
+
+    def cerrar(self):
+        self.cola.put(None)
+        self.hilo.join(timeout=5)
+
+
+_escritor: _EscritorLog | None = None
+_lock_escritor = threading.Lock()
+
+
+def _encolar(linea: str):
+    # Los procesos hijos (pool de parseo) escriben directamente: no tienen event loop que
+    # proteger, no rotan el fichero y terminan sin ejecutar atexit (se perderían registros)
+    if multiprocessing.parent_process() is not None:
+        _anadir(LOG_PATH, [linea])
+        return
+    _obtener_escritor().cola.put(linea)
+
+
+def _obtener_escritor() -> _EscritorLog:
+    global _escritor
+    if _escritor is None:
+        with _lock_escritor:
+            if _escritor is None:
+                _escritor = _EscritorLog(LOG_PATH)
+    return _escritor
+
+
 def escribir_log(mensaje, mostrar_en_consola=True, mostrar_tiempo=True, pretexto="\t"):
         '''
         Registra un mensaje en el archivo de log y opcionalmente lo muestra en la consola.
+        La escritura en disco se hace en segundo plano (no bloquea el event loop).
         '''
-        timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
+        ahora = datetime.now()
+        timestamp = ahora.strftime("[%Y-%m-%d %H:%M:%S]")
         if mostrar_tiempo:
             linea = f"{pretexto}{timestamp} {mensaje}\n"
         else:
             linea = f"{pretexto} {mensaje}\n"
-        with open("logs/log.txt", "a", encoding="utf-8") as log_file:
-            log_file.write(linea)
+        if LOG_FORMATO == "json":
+            registro = {"ts": ahora.isoformat(timespec="milliseconds"), "msg": str(mensaje).strip(), **_contexto.get()}
+            _encolar(json.dumps(registro, ensure_ascii=False, default=str) + "\n")
+        else:
+            _encolar(linea)
         if mostrar_en_consola:
-            print(linea, end="")
\ No newline at end of file
+            print(linea, end="")
+
+
+def vaciar_log():
+    """Trunca el fichero de log (en orden con los registros ya encolados)."""
+    _obtener_escritor().cola.put(_VACIAR)
+
+
+@atexit.register
+def cerrar_log():
+    """Escribe los registros pendientes y detiene el hilo escritor."""
+    global _escritor
+    if _escritor is not None:
+        _escritor.cerrar()
+        _escritor = None
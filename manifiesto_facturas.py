@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from modelos_datos import FacturaEndesaCliente
+from logs import escribir_log
+
+
+def calcular_sha256(filepath: str) -> str:
+    """Hash SHA-256 de un archivo leído por bloques (no carga el archivo entero en memoria)."""
+    sha = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+class ManifiestoFacturas:
+    """
+    Registro persistente (JSON) de las facturas ya descargadas y procesadas,
+    indexado por (cups, numero_factura). Para cada una guarda la ruta y el hash
+    de cada documento (XML/PDF) y la factura ya parseada, de forma que una fila
+    presente en el manifiesto se sirve sin volver a descargar ni parsear.
+    'registrar' y 'guardar' pueden llamarse desde hilos (asyncio.to_thread).
+    """
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self._entradas: dict[str, dict] | None = None
+        self._pendiente_guardar = False
+        self._lock = threading.Lock() # entradas en memoria
+        self._lock_disco = threading.Lock() # un solo volcado a la vez, en orden
+
+    @staticmethod
+    def _clave(cups: str, numero_factura: str) -> str:
+        return f"{cups}|{numero_factura}"
+
+    def _cargar(self) -> dict[str, dict]:
+        if self._entradas is None:
+            try:
+                with open(self.filepath, "r", encoding="utf-8") as f:
+                    self._entradas = json.load(f)
+            except FileNotFoundError:
+                self._entradas = {}
+            except Exception as e:
+                escribir_log(f"[MANIFIESTO] No se pudo leer {self.filepath}, se empieza vacío: {e}")
+                self._entradas = {}
+        return self._entradas
+
+    def obtener(self, cups: str, numero_factura: str) -> FacturaEndesaCliente | None:
+        """
+        Devuelve una copia de la factura registrada, o None si no está o si alguno
+        de sus documentos ya no existe en disco (p. ej. tras /clear_files).
+        """
+        with self._lock:
+            entradas = self._cargar()
+            entrada = entradas.get(self._clave(cups, numero_factura))
+            if not entrada:
+                return None
+            for documento in entrada["documentos"].values():
+                if not os.path.exists(documento["path"]):
+                    del entradas[self._clave(cups, numero_factura)]
+                    self._pendiente_guardar = True
+                    return None
+            return FacturaEndesaCliente(**entrada["factura"])
+
+    def registrar(self, factura: FacturaEndesaCliente, rutas: dict[str, str | None]):
+        """Registra (o sustituye) una factura procesada junto con sus documentos descargados."""
+        documentos = {}
+        for doc_type, path in rutas.items():
+            if path and os.path.exists(path):
+                documentos[doc_type] = {"path": path, "sha256": calcular_sha256(path)}
+        if not documentos:
+            return
+        entrada = {
+            "documentos": documentos,
+            "factura": factura.model_dump(),
+            "actualizado": datetime.now().isoformat(timespec="seconds"),
+        }
+        with self._lock:
+            self._cargar()[self._clave(factura.cups, factura.numero_factura)] = entrada
+            self._pendiente_guardar = True
+
+    def guardar(self):
+        """Vuelca el manifiesto a disco si hubo cambios (escritura atómica)."""
+        with self._lock_disco:
+            with self._lock:
+                if not self._pendiente_guardar or self._entradas is None:
+                    return
+                texto = json.dumps(self._entradas, ensure_ascii=False)
+                self._pendiente_guardar = False
+            try:
+                os.makedirs(os.path.dirname(self.filepath) or ".", exist_ok=True)
+                tmp_path = self.filepath + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(texto)
+                os.replace(tmp_path, self.filepath)
+            except Exception as e:
+                self._pendiente_guardar = True
+                escribir_log(f"[MANIFIESTO] Fallo al guardar {self.filepath}: {e}")
+
+    def vaciar(self):
+        """Olvida todas las entradas (se usa al limpiar las descargas)."""
+        with self._lock:
+            self._entradas = {}
+            self._pendiente_guardar = False
@@ -0,0 +1,229 @@
+import asyncio
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+# --- MÉTRICAS EN FORMATO DE EXPOSICIÓN DE PROMETHEUS (GET /metrics) ---
+# Registro mínimo en memoria (sin dependencias): contadores, indicadores e histogramas con
+# etiquetas. Los valores son del proceso de la API; los procesos del pool de parseo no
+# publican métricas propias, por eso las etapas se miden desde el proceso principal.
+
+# Límites (segundos) de los histogramas de latencia: de una lectura de tabla a un OCR lento
+BUCKETS_LATENCIA = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres: tuple[str, ...], valores: tuple, extra: str = "") -> str:
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _numero(valor: float) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if not float(valor).is_integer() else str(int(valor))
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple[str, ...] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._valores: dict[tuple, object] = {}
+        self._lock = threading.Lock() # se actualizan también desde hilos (OCR síncrono)
+        if not etiquetas and self.tipo != "histogram":
+            self._valores[()] = 0 # las series sin etiquetas se exponen desde el arranque
+        REGISTRO.append(self)
+
+    def _clave(self, etiquetas: dict) -> tuple:
+        return tuple(str(etiquetas.get(n, "")) for n in self.etiquetas)
+
+    def exponer(self) -> list[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        with self._lock:
+            valores = list(self._valores.items())
+        for clave, valor in sorted(valores):
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}")
+        return lineas
+
+
+class Contador(_Metrica):
+    """Valor que solo crece (p. ej. número de intentos de login)."""
+    tipo = "counter"
+
+    def inc(self, cantidad: float = 1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def valor(self, **etiquetas) -> float:
+        with self._lock:
+            return self._valores.get(self._clave(etiquetas), 0)
+
+
+class Indicador(_Metrica):
+    """Valor que sube y baja (p. ej. navegadores abiertos). Con 'funcion' se lee al exponer."""
+    tipo = "gauge"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple[str, ...] = (), funcion: Callable[[], float] | None = None):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.funcion = funcion
+
+    def inc(self, cantidad: float = 1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def dec(self, cantidad: float = 1, **etiquetas):
+        self.inc(-cantidad, **etiquetas)
+
+    def fijar(self, valor: float, **etiquetas):
+        with self._lock:
+            self._valores[self._clave(etiquetas)] = valor
+
+    @contextmanager
+    def en_curso(self, **etiquetas) -> Iterator[None]:
+        """Suma 1 mientras dura el bloque."""
+        self.inc(**etiquetas)
+        try:
+            yield
+        finally:
+            self.dec(**etiquetas)
+
+    def exponer(self) -> list[str]:
+        if self.funcion is not None:
+            try:
+                self.fijar(self.funcion())
+            except Exception:
+                pass # la fuente aún no existe (p. ej. antes del arranque de la API)
+        return super().exponer()
+
+
+class _Medicion:
+    """
+    Resultado de una medición: 'ok' salvo que se llame a 'fallo()' o el bloque lance.
+    En 'etiquetas' se pueden añadir las que solo se conocen al final (p. ej. el código HTTP).
+    """
+    def __init__(self):
+        self.resultado = "ok"
+        self.etiquetas: dict = {}
+
+    def fallo(self):
+        self.resultado = "error"
+
+
+class Histograma(_Metrica):
+    """Distribución de latencias por etiquetas, con sus buckets acumulados, suma y cuenta."""
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple[str, ...] = (), buckets: tuple[float, ...] = BUCKETS_LATENCIA):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observar(self, valor: float, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            cuentas, suma = self._valores.get(clave, ([0] * len(self.buckets), 0.0))
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    cuentas[i] += 1
+            self._valores[clave] = (cuentas, suma + valor)
+
+    @contextmanager
+    def medir(self, **etiquetas) -> Iterator[_Medicion]:
+        """
+        Mide la duración del bloque. Requiere la etiqueta 'resultado' entre las del histograma:
+        vale 'error' si el bloque lanza o llama a 'medicion.fallo()', y 'ok' en otro caso.
+        """
+        medicion = _Medicion()
+        inicio = time.perf_counter()
+        try:
+            yield medicion
+        except BaseException:
+            medicion.fallo()
+            raise
+        finally:
+            self.observar(time.perf_counter() - inicio, **{**etiquetas, **medicion.etiquetas, "resultado": medicion.resultado})
+
+    def totales(self) -> dict[tuple, tuple[int, float]]:
+        """(cuenta, suma) por combinación de etiquetas; p. ej. para restar dos instantes en un benchmark."""
+        with self._lock:
+            return {clave: (cuentas[-1], suma) for clave, (cuentas, suma) in self._valores.items()}
+
+    def exponer(self) -> list[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        with self._lock:
+            valores = [(clave, (list(cuentas), suma)) for clave, (cuentas, suma) in self._valores.items()]
+        for clave, (cuentas, suma) in sorted(valores):
+            for limite, cuenta in zip(self.buckets, cuentas):
+                le = 'le="' + _numero(limite) + '"'
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, clave, le)} {cuenta}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, clave)} {_numero(round(suma, 6))}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, clave)} {cuentas[-1]}")
+        return lineas
+
+
+REGISTRO: list[_Metrica] = []
+
+
+def exponer_metricas() -> str:
+    """Todas las métricas registradas en formato de texto de Prometheus (version 0.0.4)."""
+    lineas: list[str] = []
+    for metrica in REGISTRO:
+        lineas.extend(metrica.exponer())
+    return "\n".join(lineas) + "\n"
+
+
+# --- Métricas del robot y de la API ---
+
+# Latencia por etapa: login, busqueda, tabla, descarga_xml/pdf (clic), descarga_directa_xml/pdf,
+# parseo_xml, pdf_texto, ocr, procesar_pdf_local
+ETAPAS = Histograma("endesa_etapa_segundos", "Duración de cada etapa del robot.", ("etapa", "resultado"))
+PETICIONES_HTTP = Histograma("endesa_http_peticion_segundos", "Duración de las peticiones a la API.", ("ruta", "metodo", "codigo", "resultado"))
+FILAS_TABLA = Contador("endesa_filas_tabla_total", "Filas leídas de la tabla de resultados del portal.")
+NAVEGADORES_ABIERTOS = Indicador("endesa_navegadores_abiertos", "Navegadores Playwright lanzados y aún no cerrados.")
+NAVEGADORES_LIBRES = Indicador("endesa_pool_navegadores_libres", "Navegadores del pool disponibles para préstamo.")
+TAREAS_EN_COLA = Indicador("endesa_tareas_en_cola", "Tareas de /jobs esperando un worker.")
+DOCUMENTOS_EN_PROCESO = Indicador("endesa_documentos_en_proceso", "Filas descargadas cuyo parseo u OCR está en curso.")
+DESCARGAS_EN_CURSO = Indicador("endesa_descargas_directas_en_curso", "Descargas directas de documentos en curso.")
+OCR_EN_CURSO = Indicador("endesa_ocr_en_curso", "Llamadas al OCR en curso o esperando turno.")
+
+
+def medir_etapa(etapa: str | Callable[..., str], es_fallo: Callable[[object], bool] = lambda resultado: False):
+    """
+    Decorador que mide cada llamada de la función (síncrona o asíncrona) en ETAPAS.
+    'etapa' puede ser una función de los argumentos de la llamada (p. ej. según doc_type).
+    Cuenta como 'error' si la función lanza o si 'es_fallo(resultado)' es cierto
+    (para las funciones que devuelven False/None en lugar de lanzar).
+    """
+    def decorador(funcion):
+        def _etapa(args, kwargs) -> str:
+            return etapa(*args, **kwargs) if callable(etapa) else etapa
+
+        if asyncio.iscoroutinefunction(funcion):
+            @functools.wraps(funcion)
+            async def envoltura(*args, **kwargs):
+                with ETAPAS.medir(etapa=_etapa(args, kwargs)) as medicion:
+                    resultado = await funcion(*args, **kwargs)
+                    if es_fallo(resultado):
+                        medicion.fallo()
+                    return resultado
+        else:
+            @functools.wraps(funcion)
+            def envoltura(*args, **kwargs):
+                with ETAPAS.medir(etapa=_etapa(args, kwargs)) as medicion:
+                    resultado = funcion(*args, **kwargs)
+                    if es_fallo(resultado):
+                        medicion.fallo()
+                    return resultado
+        return envoltura
+    return decorador
@@ -32,6 +32,10 @@ class FacturaEndesaCliente(BaseModel):
     
     # === 3. Datos DETALLADOS extraídos del XML/HTML ===
     
+    # Vía por la que se obtuvieron los datos detallados:
+    # XML | PDF_TEXTO (capa de texto del PDF) | PDF_OCR | PDF_OCR_CACHE
+    origen_datos: Optional[str] = None
+
     # Campos generales
     mes_facturado: Optional[str] = None
     tarifa: Optional[str] = None
@@ -96,4 +100,32 @@ class FacturaEndesaCliente(BaseModel):
     
     # === 4. Eliminación de campos no utilizados en el modelo (opcional) ===
     # data_base64: str | None = None
-    # archivo_nombre: str | None = None
\ No newline at end of file
+    # archivo_nombre: str | None = None
+
+class EstadoTarea(BaseModel):
+    """
+    Estado de una tarea de extracción asíncrona (API /jobs).
+    'progreso' indica para cada CUPS: pendiente, en_curso, completado o error.
+    """
+    id: str
+    estado: str # pendiente | en_curso | completada | fallida
+    creada: str
+    iniciada: Optional[str] = None
+    finalizada: Optional[str] = None
+    total_cups: int = 0
+    cups_terminados: int = 0
+    progreso: dict[str, str] = {}
+    num_facturas: Optional[int] = None
+    error: Optional[str] = None
+
+class EstadoSincronizacion(BaseModel):
+    """
+    CUPS registrado para la sincronización incremental (API /sync).
+    'marca' es la fecha de emisión más reciente vista (ISO), o None si aún no hay facturas.
+    """
+    cups: str
+    marca: Optional[str] = None
+    desde_inicial: str
+    registrado: str
+    ultima_sync: Optional[str] = None
+    ultimo_error: Optional[str] = None
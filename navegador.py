@@ -1,33 +1,98 @@
-from playwright.async_api import async_playwright, Playwright, Browser, Page, BrowserContext
+from playwright.async_api import async_playwright, Playwright, Browser, Page, BrowserContext, Route
+from urllib.parse import urlparse
 import asyncio
 import os
+import time
+from logs import escribir_log
+from metricas import NAVEGADORES_ABIERTOS
 
 # Directorio raíz donde Playwright guardará temporalmente los archivos.
 TEMP_DOWNLOAD_ROOT = "temp_endesa_downloads" 
 
+# --- MODO LIGERO ---
+# Bloquea imágenes, vídeo/audio, fuentes y rastreadores de terceros, y sustituye la espera
+# 'networkidle' por la espera del selector concreto que necesita el robot.
+MODO_LIGERO = os.environ.get("ENDESA_MODO_LIGERO", "0").lower() in ("1", "true", "si", "sí")
+TIPOS_RECURSO_BLOQUEADOS = {"image", "media", "font"}
+DOMINIOS_RASTREADORES = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googleadservices.com",
+    "facebook.net", "facebook.com", "hotjar.com", "nr-data.net", "newrelic.com",
+    "bat.bing.com", "clarity.ms", "linkedin.com", "adobedtm.com", "omtrdc.net", "demdex.net",
+)
+# Dominios que nunca se bloquean (separados por comas), p. ej. si el portal necesita una fuente
+DOMINIOS_PERMITIDOS = tuple(
+    d.strip().lower() for d in os.environ.get("ENDESA_LIGERO_PERMITIDOS", "").split(",") if d.strip()
+)
+
+
+def _coincide_dominio(host: str, dominios: tuple[str, ...]) -> bool:
+    return any(host == d or host.endswith("." + d) for d in dominios)
+
 class NavegadorAsync:
     """
     Clase que encapsula la inicialización, uso y cierre de una sesión 
     de Playwright Asíncrona.
     """
-    def __init__(self):
+    def __init__(self, modo_ligero: bool = MODO_LIGERO, dominios_permitidos: tuple[str, ...] = DOMINIOS_PERMITIDOS):
+        self.modo_ligero = modo_ligero
+        self.dominios_permitidos = dominios_permitidos
+        # Métricas del modo ligero y de los tiempos de carga (ms) por navegación
+        self.peticiones_bloqueadas = 0
+        self.tiempos_carga: list[float] = []
         self.playwright: Playwright | None = None
         self.browser: Browser | None = None
         self.page: Page | None = None
         self.context: BrowserContext | None = None
+        # Contextos adicionales creados para los workers paralelos (comparten navegador)
+        self.contextos_extra: list[BrowserContext] = []
         
         # Aseguramos que el directorio exista
         os.makedirs(TEMP_DOWNLOAD_ROOT, exist_ok=True)
 
-    async def iniciar(self):
-        """Inicializa la sesión de Playwright y lanza el navegador."""
+    async def iniciar(self, storage_state: dict | None = None):
+        """
+        Inicializa la sesión de Playwright y lanza el navegador.
+        Si se indica 'storage_state', el contexto principal arranca con esas cookies.
+        """
         self.playwright = await async_playwright().start()
         
         # Mantenemos headless=True para el servidor
         self.browser = await self.playwright.chromium.launch(headless=True) 
+        NAVEGADORES_ABIERTOS.inc()
         
+        self.context = await self._nuevo_contexto(storage_state)
+        self.page = await self.context.new_page()
+        
+        return self 
+
+    async def _nuevo_contexto(self, storage_state: dict | None = None) -> BrowserContext:
+        """Crea un contexto con las opciones comunes y, en modo ligero, el filtro de peticiones."""
+        contexto = await self.browser.new_context(
+            storage_state=storage_state,
+            **self._opciones_contexto()
+        )
+        if self.modo_ligero:
+            await contexto.route("**/*", self._filtrar_peticion)
+        return contexto
+
+    def _bloquear(self, url: str, tipo_recurso: str) -> bool:
+        """Decide si una petición se descarta en modo ligero."""
+        host = (urlparse(url).hostname or "").lower()
+        if _coincide_dominio(host, self.dominios_permitidos):
+            return False
+        return tipo_recurso in TIPOS_RECURSO_BLOQUEADOS or _coincide_dominio(host, DOMINIOS_RASTREADORES)
+
+    async def _filtrar_peticion(self, route: Route):
+        if self._bloquear(route.request.url, route.request.resource_type):
+            self.peticiones_bloqueadas += 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+    def _opciones_contexto(self) -> dict:
+        """Opciones comunes a todos los contextos creados sobre este navegador."""
         # --- CAMBIOS PARA EVITAR BLOQUEOS Y MEJORAR ESTABILIDAD ---
-        self.context = await self.browser.new_context(
+        return dict(
             # 1. User Agent real (Chrome en Windows 10)
             user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
             # 2. Resolución de pantalla estándar
@@ -38,23 +103,67 @@ class NavegadorAsync:
             },
             accept_downloads=True
         )
-        self.page = await self.context.new_page()
-        
-        return self 
 
-    async def goto_url(self, url: str, timeout_ms: int = 60000) -> Page:
+    async def nueva_pagina(self, storage_state: dict | None = None) -> Page:
+        """
+        Crea un contexto adicional en el mismo navegador, opcionalmente reutilizando
+        el estado de sesión (cookies + localStorage) exportado tras el login.
+        Devuelve la página del nuevo contexto.
+        """
+        if not self.browser:
+            raise RuntimeError("El navegador no ha sido inicializado.")
+        contexto = await self._nuevo_contexto(storage_state)
+        self.contextos_extra.append(contexto)
+        return await contexto.new_page()
+
+    async def goto_url(self, url: str, timeout_ms: int = 60000, selector: str | None = None) -> Page:
         """Navega a la URL especificada."""
-        await self.page.goto(
-            url, 
-            wait_until="networkidle", # Cambiado de domcontentloaded a networkidle
-            timeout=timeout_ms
-        ) 
-        return self.page
+        return await self.ir_a(self.page, url, timeout_ms, selector)
+
+    async def ir_a(self, page: Page, url: str, timeout_ms: int = 60000, selector: str | None = None) -> Page:
+        """
+        Navega con 'page' a la URL. En modo ligero, si se indica 'selector', espera solo
+        al DOM y a ese selector en lugar de a 'networkidle'. Registra el tiempo de carga.
+        """
+        inicio = time.perf_counter()
+        if self.modo_ligero and selector:
+            await page.goto(url, wait_until="domcontentloaded", timeout=timeout_ms)
+            await page.wait_for_selector(selector, timeout=timeout_ms)
+        else:
+            await page.goto(
+                url, 
+                wait_until="networkidle", # Cambiado de domcontentloaded a networkidle
+                timeout=timeout_ms
+            ) 
+        ms = (time.perf_counter() - inicio) * 1000
+        self.tiempos_carga.append(ms)
+        escribir_log(f"[NAVEGADOR] Carga de {urlparse(url).path} en {ms:.0f} ms (modo ligero: {'sí' if self.modo_ligero else 'no'}, bloqueadas: {self.peticiones_bloqueadas})")
+        return page
+
+    async def cerrar_contextos_extra(self):
+        """Cierra los contextos adicionales manteniendo vivo el navegador y el contexto principal."""
+        for contexto in self.contextos_extra:
+            try:
+                await contexto.close()
+            except Exception:
+                pass
+        self.contextos_extra = []
+
+    def esta_sano(self) -> bool:
+        """Indica si el navegador sigue conectado y con la página principal abierta."""
+        return bool(
+            self.browser and self.browser.is_connected()
+            and self.page and not self.page.is_closed()
+        )
 
     async def cerrar(self):
         """Cierra el navegador y detiene el contexto."""
+        # Los contextos extra se cierran junto con el navegador
+        self.contextos_extra = []
         if self.browser:
+            NAVEGADORES_ABIERTOS.dec()
             await self.browser.close()
+            self.browser = None
         if self.playwright:
             await self.playwright.stop()
             
@@ -62,4 +171,39 @@ class NavegadorAsync:
         """Devuelve el objeto Page actual."""
         if not self.page:
             raise RuntimeError("El navegador no ha sido inicializado.")
-        return self.page
\ No newline at end of file
+        return self.page
+
+
+async def medir_carga(url: str, repeticiones: int = 3, selector: str | None = None) -> dict[str, float]:
+    """
+    Carga 'url' varias veces con y sin modo ligero (un navegador nuevo cada vez)
+    y devuelve el tiempo medio en ms de cada modo.
+    """
+    resultados = {}
+    for modo_ligero in (False, True):
+        tiempos = []
+        for _ in range(repeticiones):
+            robot = NavegadorAsync(modo_ligero=modo_ligero)
+            try:
+                await robot.iniciar()
+                await robot.goto_url(url, selector=selector)
+                tiempos.append(robot.tiempos_carga[-1])
+            finally:
+                await robot.cerrar()
+        resultados["ligero" if modo_ligero else "completo"] = sum(tiempos) / len(tiempos)
+    return resultados
+
+
+# Uso: python navegador.py URL [REPETICIONES] [SELECTOR]
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2:
+        print("Uso: python navegador.py URL [REPETICIONES] [SELECTOR]")
+        sys.exit(1)
+    medias = asyncio.run(medir_carga(
+        sys.argv[1],
+        int(sys.argv[2]) if len(sys.argv) > 2 else 3,
+        sys.argv[3] if len(sys.argv) > 3 else None,
+    ))
+    for modo, ms in medias.items():
+        print(f"{modo}: {ms:.0f} ms")
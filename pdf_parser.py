@@ -1,11 +1,81 @@
 import os
 import json
+import asyncio
+import hashlib
+import random
 from logs import escribir_log
-from openai import OpenAI
+from metricas import medir_etapa
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
 from datetime import datetime
 from modelos_datos import FacturaEndesaCliente
+from cache_ocr import CacheOCR
+from manifiesto_facturas import calcular_sha256
 
+# --- CONFIGURACIÓN DEL OCR ---
+MODELO_OCR = os.environ.get("ENDESA_OCR_MODELO", "gpt-4o")
+PROMPT_PATH = "prompt_cliente.txt"
+# Llamadas de OCR simultáneas como máximo y reintentos ante límites de uso / errores transitorios
+MAX_OCR_CONCURRENTES = max(1, int(os.environ.get("ENDESA_OCR_CONCURRENTES", "4")))
+MAX_REINTENTOS_OCR = max(0, int(os.environ.get("ENDESA_OCR_REINTENTOS", "4")))
+ERRORES_REINTENTABLES = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+# Caché persistente de respuestas del OCR por hash del PDF
+CACHE_OCR = CacheOCR()
+
+
+CAMPOS_NO_OCR = ("origen_datos",)
+
+
+def _esquema_estricto() -> dict:
+    """Esquema de FacturaEndesaCliente compatible con el Strict Mode de OpenAI."""
+    esquema_pydantic = FacturaEndesaCliente.model_json_schema()
+    # SOLUCIÓN AL ERROR: 
+    # 1. Forzar additionalProperties a False
+    # 2. Poner TODOS los campos de 'properties' dentro de 'required'
+    esquema_pydantic["additionalProperties"] = False
+    # Campos que rellena el propio robot, no el modelo
+    for campo in CAMPOS_NO_OCR:
+        esquema_pydantic["properties"].pop(campo, None)
+    esquema_pydantic["required"] = list(esquema_pydantic["properties"].keys())
+    return esquema_pydantic
+
+# Se calcula una sola vez al importar el módulo
+ESQUEMA_OCR = _esquema_estricto()
+
+
+def version_ocr(prompt_text: str) -> str:
+    """Huella de modelo + prompt + esquema: forma parte de la clave de la caché del OCR."""
+    huella = json.dumps([MODELO_OCR, prompt_text, ESQUEMA_OCR], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(huella.encode("utf-8")).hexdigest()[:16]
+
+
+def _parametros_respuesta(file_id: str, prompt_text: str) -> dict:
+    """Argumentos de 'responses.create' (comunes al cliente síncrono y al asíncrono)."""
+    return dict(
+        model=MODELO_OCR,
+        input=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "input_file", "file_id": file_id},
+                    {"type": "input_text", "text": prompt_text}
+                ]
+            }
+        ],
+        text={
+            "format": {
+                "type": "json_schema",
+                "name": "extraccion_factura_electrica",
+                "strict": True,
+                "schema": ESQUEMA_OCR
+            }
+        }
+    )
+
+
+@medir_etapa("procesar_pdf_local", es_fallo=lambda exito: not exito)
 def procesar_pdf_local(factura_obj: FacturaEndesaCliente, ruta_pdf: str) -> bool:
+    """Versión síncrona (un cliente por llamada). El robot usa MotorOCR."""
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         print("[ERROR] No se encontró la variable de entorno OPENAI_API_KEY")
@@ -15,104 +85,30 @@ def procesar_pdf_local(factura_obj: FacturaEndesaCliente, ruta_pdf: str) -> bool
     file_id = None
 
     try:
-        # 1. Preparar esquema dinámico compatible con Strict Mode
-        esquema_pydantic = FacturaEndesaCliente.model_json_schema()
-        
-        # SOLUCIÓN AL ERROR: 
-        # 1. Forzar additionalProperties a False
-        # 2. Poner TODOS los campos de 'properties' dentro de 'required'
-        esquema_pydantic["additionalProperties"] = False
-        esquema_pydantic["required"] = list(esquema_pydantic["properties"].keys())
-
-        # 2. Cargar prompt y subir archivo (se asume que existen)
-        with open("prompt_cliente.txt", "r", encoding="utf-8") as f:
+        # 1. Cargar prompt y subir archivo (se asume que existen)
+        with open(PROMPT_PATH, "r", encoding="utf-8") as f:
             prompt_text = f.read()
 
+        # PDF ya procesado con el mismo modelo/prompt/esquema: sin llamada a la API
+        sha256, version = calcular_sha256(ruta_pdf), version_ocr(prompt_text)
+        datos_cache = CACHE_OCR.obtener(sha256, version)
+        if datos_cache is not None:
+            _fusionar_datos_ocr(factura_obj, datos_cache)
+            factura_obj.origen_datos = "PDF_OCR_CACHE"
+            return True
+
         with open(ruta_pdf, "rb") as f:
             file_upload = client.files.create(file=f, purpose="assistants")
             file_id = file_upload.id
 
-        # 3. Llamada a la API
-        response = client.responses.create(
-            model="gpt-4o",
-            input=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "input_file", "file_id": file_id},
-                        {"type": "input_text", "text": prompt_text}
-                    ]
-                }
-            ],
-            text={
-                "format": {
-                    "type": "json_schema",
-                    "name": "extraccion_factura_electrica",
-                    "strict": True,
-                    "schema": esquema_pydantic
-                }
-            }
-        )
+        # 2. Llamada a la API
+        response = client.responses.create(**_parametros_respuesta(file_id, prompt_text))
 
-        # 4. Mezcla inteligente de datos
+        # 3. Mezcla inteligente de datos
         datos_extraidos = json.loads(response.output_text)
-
-        for campo, valor_ocr in datos_extraidos.items():
-            # Saltamos si el OCR no devolvió nada útil
-            if valor_ocr is None or str(valor_ocr).lower() == "null" or valor_ocr == "":
-                # escribir_log(
-                #         f"\t->[!] Valor no extraido {factura_obj.numero_factura} \n\t\t\t\t\t\t\t| Campo: '{campo}' | "
-                #         f"Valor: '{valor_ocr}'"
-                #     )
-                continue
-
-            # Obtenemos el valor que tiene el objeto actualmente
-            valor_actual = getattr(factura_obj, campo)
-            
-            # Obtenemos el valor por defecto definido en el modelo Pydantic para ese campo
-            valor_por_defecto = FacturaEndesaCliente.model_fields[campo].default
-
-            # CASO A: El objeto tiene el valor por defecto (no ha sido registrado aún)
-            if valor_actual == valor_por_defecto:
-                setattr(factura_obj, campo, valor_ocr)
-                # escribir_log(
-                #         f"\t->[OK] Valor incluido {factura_obj.numero_factura} \n\t\t\t\t\t\t\t| Campo: '{campo}' | "
-                #         f"Valor Incluido: '{valor_ocr}'"
-                #     )
-            
-            # CASO B: El objeto YA tiene un valor distinto al por defecto
-            else:
-                # Comparamos si el valor extraído coincide con el que ya teníamos
-                if valor_actual != valor_ocr:
-                    # escribir_log(
-                    #     f"\t->[!] Discrepancia en Factura {factura_obj.numero_factura} \n\t\t\t\t\t\t\t| Campo: '{campo}' | "
-                    #     f"Valor en Objeto: '{valor_actual}' VS Valor OCR: '{valor_ocr}'"
-                    # )
-                    # Opcional: Aquí podrías decidir si sobreescribir o no. 
-                    # Por ahora, mantenemos el valor del objeto y solo avisamos.
-                    pass
-        
-        # --- NUEVA LÓGICA: ACTUALIZACIÓN DEL MES FACTURADO ---
-        if factura_obj.fecha_fin_periodo and factura_obj.fecha_fin_periodo != "N/A":
-            try:
-                nombres_meses = {
-                    1: "ENERO", 2: "FEBRERO", 3: "MARZO", 4: "ABRIL",
-                    5: "MAYO", 6: "JUNIO", 7: "JULIO", 8: "AGOSTO",
-                    9: "SEPTIEMBRE", 10: "OCTUBRE", 11: "NOVIEMBRE", 12: "DICIEMBRE"
-                }
-                
-                # Normalizamos formatos de fecha (DD-MM-YYYY o DD/MM/YYYY)
-                f_fin_str = factura_obj.fecha_fin_periodo.replace("/", "-")
-                dt_fin = datetime.strptime(f_fin_str, '%d-%m-%Y')
-                
-                # Asignar nombre del mes basado en la fecha de fin de periodo
-                factura_obj.mes_facturado = nombres_meses.get(dt_fin.month, "DESCONOCIDO")
-                # escribir_log(f"\t-> [INFO] Mes facturado asignado: {factura_obj.mes_facturado}")
-                
-            except Exception as e_fecha:
-                escribir_log(f"[ERROR] No se pudo procesar la fecha para el mes facturado: {e_fecha}")
-        # -----------------------------------------------------
-        
+        CACHE_OCR.guardar(sha256, version, datos_extraidos)
+        _fusionar_datos_ocr(factura_obj, datos_extraidos)
+        factura_obj.origen_datos = "PDF_OCR"
         return True
 
     except Exception as e:
@@ -120,4 +116,211 @@ def procesar_pdf_local(factura_obj: FacturaEndesaCliente, ruta_pdf: str) -> bool
         return False
     finally:
         if file_id:
-            client.files.delete(file_id)
\ No newline at end of file
+            client.files.delete(file_id)
+
+
+def _fusionar_datos_ocr(factura_obj: FacturaEndesaCliente, datos_extraidos: dict):
+    """Completa la factura con los campos devueltos por el OCR y asigna el mes facturado."""
+    for campo, valor_ocr in datos_extraidos.items():
+        # Saltamos si el OCR no devolvió nada útil
+        if valor_ocr is None or str(valor_ocr).lower() == "null" or valor_ocr == "":
+            # escribir_log(
+            #         f"\t->[!] Valor no extraido {factura_obj.numero_factura} \n\t\t\t\t\t\t\t| Campo: '{campo}' | "
+            #         f"Valor: '{valor_ocr}'"
+            #     )
+            continue
+
+        # Obtenemos el valor que tiene el objeto actualmente
+        valor_actual = getattr(factura_obj, campo)
+        
+        # Obtenemos el valor por defecto definido en el modelo Pydantic para ese campo
+        valor_por_defecto = FacturaEndesaCliente.model_fields[campo].default
+
+        # CASO A: El objeto tiene el valor por defecto (no ha sido registrado aún)
+        if valor_actual == valor_por_defecto:
+            setattr(factura_obj, campo, valor_ocr)
+            # escribir_log(
+            #         f"\t->[OK] Valor incluido {factura_obj.numero_factura} \n\t\t\t\t\t\t\t| Campo: '{campo}' | "
+            #         f"Valor Incluido: '{valor_ocr}'"
+            #     )
+        
+        # CASO B: El objeto YA tiene un valor distinto al por defecto
+        else:
+            # Comparamos si el valor extraído coincide con el que ya teníamos
+            if valor_actual != valor_ocr:
+                # escribir_log(
+                #     f"\t->[!] Discrepancia en Factura {factura_obj.numero_factura} \n\t\t\t\t\t\t\t| Campo: '{campo}' | "
+                #     f"Valor en Objeto: '{valor_actual}' VS Valor OCR: '{valor_ocr}'"
+                # )
+                # Opcional: Aquí podrías decidir si sobreescribir o no. 
+                # Por ahora, mantenemos el valor del objeto y solo avisamos.
+                pass
+    
+    # --- NUEVA LÓGICA: ACTUALIZACIÓN DEL MES FACTURADO ---
+    asignar_mes_facturado(factura_obj)
+
+
+def asignar_mes_facturado(factura_obj: FacturaEndesaCliente):
+    """Asigna el mes facturado (nombre en mayúsculas) a partir de la fecha de fin de periodo."""
+    if factura_obj.fecha_fin_periodo and factura_obj.fecha_fin_periodo != "N/A":
+        try:
+            nombres_meses = {
+                1: "ENERO", 2: "FEBRERO", 3: "MARZO", 4: "ABRIL",
+                5: "MAYO", 6: "JUNIO", 7: "JULIO", 8: "AGOSTO",
+                9: "SEPTIEMBRE", 10: "OCTUBRE", 11: "NOVIEMBRE", 12: "DICIEMBRE"
+            }
+            
+            # Normalizamos formatos de fecha (DD-MM-YYYY o DD/MM/YYYY)
+            f_fin_str = factura_obj.fecha_fin_periodo.replace("/", "-")
+            dt_fin = datetime.strptime(f_fin_str, '%d-%m-%Y')
+            
+            # Asignar nombre del mes basado en la fecha de fin de periodo
+            factura_obj.mes_facturado = nombres_meses.get(dt_fin.month, "DESCONOCIDO")
+            # escribir_log(f"\t-> [INFO] Mes facturado asignado: {factura_obj.mes_facturado}")
+            
+        except Exception as e_fecha:
+            escribir_log(f"[ERROR] No se pudo procesar la fecha para el mes facturado: {e_fecha}")
+
+
+def _leer_con_hash(ruta_pdf: str) -> tuple[bytes, str]:
+    """Contenido del PDF (se sube tal cual a la API) y su SHA-256 (clave de la caché)."""
+    with open(ruta_pdf, "rb") as f:
+        contenido = f.read()
+    return contenido, hashlib.sha256(contenido).hexdigest()
+
+
+class MotorOCR:
+    """
+    Motor de OCR asíncrono, creado una vez y compartido por todo el robot.
+    Mantiene un único AsyncOpenAI (con su pool de conexiones HTTP), el prompt en memoria
+    y el esquema precalculado, limita las llamadas simultáneas con un semáforo y
+    reintenta con espera exponencial ante límites de uso (429) o errores transitorios.
+    'base_url' permite apuntarlo a un servidor local de pruebas (también vía OPENAI_BASE_URL).
+    Con 'cache' las respuestas se reutilizan por hash del PDF sin volver a llamar a la API.
+    """
+    def __init__(self, api_key: str | None = None, base_url: str | None = None,
+                 max_concurrentes: int = MAX_OCR_CONCURRENTES, max_reintentos: int = MAX_REINTENTOS_OCR,
+                 espera_base: float = 1.0, prompt_path: str = PROMPT_PATH, cache: CacheOCR | None = None):
+        self.api_key = api_key
+        self.cache = cache
+        self.base_url = base_url
+        self.max_concurrentes = max_concurrentes
+        self.max_reintentos = max_reintentos
+        self.espera_base = espera_base
+        self.prompt_path = prompt_path
+        self._prompt: str | None = None
+        self._cliente: AsyncOpenAI | None = None
+        # El semáforo se crea dentro del event loop en el primer uso
+        self._semaforo: asyncio.Semaphore | None = None
+
+    def _obtener_cliente(self) -> AsyncOpenAI:
+        if self._cliente is None:
+            # Los reintentos los gestiona el motor (max_retries=0 en el SDK)
+            self._cliente = AsyncOpenAI(
+                api_key=self.api_key or os.getenv("OPENAI_API_KEY"),
+                base_url=self.base_url,
+                max_retries=0,
+            )
+        return self._cliente
+
+    def _obtener_prompt(self) -> str:
+        if self._prompt is None:
+            with open(self.prompt_path, "r", encoding="utf-8") as f:
+                self._prompt = f.read()
+        return self._prompt
+
+    def _obtener_semaforo(self) -> asyncio.Semaphore:
+        if self._semaforo is None:
+            self._semaforo = asyncio.Semaphore(self.max_concurrentes)
+        return self._semaforo
+
+    async def _con_reintentos(self, descripcion: str, llamada):
+        """Ejecuta 'llamada()' reintentando los errores transitorios con backoff exponencial."""
+        for intento in range(self.max_reintentos + 1):
+            try:
+                return await llamada()
+            except ERRORES_REINTENTABLES as e:
+                if intento == self.max_reintentos:
+                    raise
+                espera = self.espera_base * (2 ** intento) + random.uniform(0, self.espera_base)
+                # Si el servidor indica cuánto esperar (Retry-After), lo respetamos
+                respuesta = getattr(e, "response", None)
+                retry_after = respuesta.headers.get("retry-after") if respuesta is not None else None
+                if retry_after:
+                    try:
+                        espera = max(espera, float(retry_after))
+                    except ValueError:
+                        pass
+                escribir_log(f"    -> [OCR] {descripcion}: {type(e).__name__}. Reintento {intento + 1}/{self.max_reintentos} en {espera:.1f}s")
+                await asyncio.sleep(espera)
+
+    @medir_etapa("ocr", es_fallo=lambda exito: not exito)
+    async def procesar(self, factura_obj: FacturaEndesaCliente, ruta_pdf: str) -> bool:
+        """Equivalente asíncrono de procesar_pdf_local. Devuelve True si el OCR rellenó la factura."""
+        try:
+            # Lectura, hash y caché SQLite en hilos: no bloquean el event loop
+            prompt_text = self._prompt or await asyncio.to_thread(self._obtener_prompt)
+            contenido, sha256 = await asyncio.to_thread(_leer_con_hash, ruta_pdf)
+            version = version_ocr(prompt_text)
+
+            # PDF ya procesado con el mismo modelo/prompt/esquema: sin llamada a la API
+            if self.cache is not None:
+                datos_cache = await asyncio.to_thread(self.cache.obtener, sha256, version)
+                if datos_cache is not None:
+                    escribir_log(f"    -> [CACHE OCR] Resultado reutilizado para factura {factura_obj.numero_factura}")
+                    _fusionar_datos_ocr(factura_obj, datos_cache)
+                    factura_obj.origen_datos = "PDF_OCR_CACHE"
+                    return True
+        except Exception as e:
+            escribir_log(f"[ERROR] Fallo en MotorOCR.procesar ({ruta_pdf}): {str(e)}")
+            return False
+
+        if not (self.api_key or os.getenv("OPENAI_API_KEY")):
+            escribir_log("[ERROR] No se encontró la variable de entorno OPENAI_API_KEY")
+            return False
+
+        async with self._obtener_semaforo():
+            cliente = self._obtener_cliente()
+            file_id = None
+            try:
+                nombre = os.path.basename(ruta_pdf)
+
+                file_upload = await self._con_reintentos(
+                    "Subida", lambda: cliente.files.create(file=(nombre, contenido), purpose="assistants")
+                )
+                file_id = file_upload.id
+
+                response = await self._con_reintentos(
+                    "Extracción", lambda: cliente.responses.create(**_parametros_respuesta(file_id, prompt_text))
+                )
+                datos_extraidos = json.loads(response.output_text)
+                if self.cache is not None:
+                    await asyncio.to_thread(self.cache.guardar, sha256, version, datos_extraidos)
+                _fusionar_datos_ocr(factura_obj, datos_extraidos)
+                factura_obj.origen_datos = "PDF_OCR"
+                return True
+
+            except Exception as e:
+                escribir_log(f"[ERROR] Fallo en MotorOCR.procesar ({ruta_pdf}): {str(e)}")
+                return False
+            finally:
+                if file_id:
+                    try:
+                        await cliente.files.delete(file_id)
+                    except Exception as e:
+                        escribir_log(f"    -> [OCR] No se pudo borrar el archivo {file_id}: {e}")
+
+    async def procesar_lote(self, documentos: list[tuple[FacturaEndesaCliente, str]]) -> list[bool]:
+        """Lanza el OCR de varios PDF a la vez (limitado por el semáforo). Resultados en el mismo orden."""
+        return list(await asyncio.gather(*(self.procesar(f, ruta) for f, ruta in documentos)))
+
+    async def cerrar(self):
+        """Cierra las conexiones HTTP del cliente (apagado de la API)."""
+        if self._cliente is not None:
+            await self._cliente.close()
+            self._cliente = None
+        self._semaforo = None
+
+
+# Motor compartido por todo el proceso
+MOTOR_OCR = MotorOCR(cache=CACHE_OCR)
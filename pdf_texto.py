@@ -0,0 +1,200 @@
+import re
+import unicodedata
+from modelos_datos import FacturaEndesaCliente
+from pdf_parser import asignar_mes_facturado
+from logs import escribir_log
+
+# pypdf es opcional: sin él se pasa directamente al OCR
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+# --- PLANTILLA DE FACTURA ENDESA (capa de texto del PDF) ---
+# Las etiquetas se buscan sobre el texto sin tildes y sin distinguir mayúsculas.
+# El importe de cada concepto es el último número con formato español (1.234,56) de su línea.
+
+IMPORTE = r"-?\d{1,3}(?:\.\d{3})*,\d{2}(?!\d)"
+IMPORTE_PATTERN = re.compile(IMPORTE)
+NUMERO_PATTERN = re.compile(r"\d{1,3}(?:\.\d{3})*(?:,\d+)?|\d+(?:,\d+)?")
+FECHA = r"(\d{2}[/-]\d{2}[/-]\d{4})"
+
+def _periodo(prefijo: str, i: int) -> str:
+    return prefijo + rf"\s*P(?:eriodo\s*)?{i}\b"
+
+CONCEPTOS_POR_PERIODO = {
+    'potencia_p{}': r"(?:Pot\.|Potencia)(?:\s*facturada)?",
+    'importe_consumo_p{}': r"(?:Consumo|Energia activa)",
+    'energia_precio_indexado_p{}': r"Energia precio indexado",
+    'importe_exceso_potencia_p{}': r"Exceso\s*(?:de\s*)?Pot(?:\.|encia)",
+}
+
+CONCEPTOS_UNICOS = {
+    'importe_impuesto_electrico': r"Impuesto (?:sobre la )?Electricidad",
+    'importe_alquiler_equipos': r"Alquiler (?:del contador|de equipos de medida)",
+    'importe_bono_social': r"(?:Financiacion )?Bono Social",
+    'importe_reactiva': r"Energia reactiva",
+    'importe_base_imponible': r"Base imponible",
+    'importe_facturado': r"Total (?:importe )?factura",
+    'importe_total_final': r"(?:Importe )?Total a pagar",
+}
+
+TARIFA_PATTERN = re.compile(r"Tarifa(?: de acceso)?\s*:?\s*([0-9.,]+\s?TD|[0-9.]+[A-Z]{1,3})", re.IGNORECASE)
+DIRECCION_PATTERN = re.compile(r"Direccion de suministro\s*:?\s*(.+)", re.IGNORECASE)
+DIAS_PATTERN = re.compile(r"(\d{1,3})\s*dias\b", re.IGNORECASE)
+VENCIMIENTO_PATTERN = re.compile(r"Fecha (?:limite de pago|de vencimiento)\s*:?\s*" + FECHA, re.IGNORECASE)
+COBRO_PATTERN = re.compile(r"Fecha de cargo(?: en (?:cuenta|banco))?\s*:?\s*" + FECHA, re.IGNORECASE)
+
+# Sin estos datos (o si no cuadran) la factura se envía al OCR
+TOLERANCIA_IMPORTES = 0.02
+
+
+def _sin_tildes(texto: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c))
+
+
+def _a_float(texto: str) -> float:
+    return float(texto.replace(".", "").replace(",", "."))
+
+
+def extraer_texto_pdf(ruta_pdf: str) -> str:
+    """Texto de todas las páginas del PDF ("" si no tiene capa de texto o no hay pypdf)."""
+    if PdfReader is None:
+        return ""
+    lector = PdfReader(ruta_pdf)
+    return "\n".join(pagina.extract_text() or "" for pagina in lector.pages)
+
+
+class _PlantillaFactura:
+    """Busca los conceptos de la plantilla línea a línea sobre el texto normalizado."""
+    def __init__(self, texto: str):
+        self.lineas = [l.strip() for l in _sin_tildes(texto).splitlines() if l.strip()]
+
+    def importe(self, etiqueta: str) -> float | None:
+        patron = re.compile(r"^" + etiqueta, re.IGNORECASE)
+        for linea in self.lineas:
+            if patron.search(linea):
+                importes = IMPORTE_PATTERN.findall(linea)
+                if importes:
+                    return _a_float(importes[-1])
+        return None
+
+    def kwh(self, etiqueta: str) -> float | None:
+        patron = re.compile(r"^" + etiqueta + r".*?(" + NUMERO_PATTERN.pattern + r")\s*kWh", re.IGNORECASE)
+        for linea in self.lineas:
+            m = patron.search(linea)
+            if m:
+                return _a_float(m.group(1))
+        return None
+
+    def buscar(self, patron: re.Pattern) -> str | None:
+        for linea in self.lineas:
+            m = patron.search(linea)
+            if m:
+                return m.group(1).strip()
+        return None
+
+
+def _rellenar(factura: FacturaEndesaCliente, plantilla: _PlantillaFactura):
+    """Aplica la plantilla a 'factura' (mismos totales calculados que el parser XML)."""
+    totales = {'potencia_p{}': 0.0, 'importe_consumo_p{}': 0.0, 'energia_precio_indexado_p{}': 0.0, 'importe_exceso_potencia_p{}': 0.0}
+    for campo, etiqueta in CONCEPTOS_POR_PERIODO.items():
+        for i in range(1, 7):
+            valor = plantilla.importe(_periodo(etiqueta, i)) or 0.0
+            setattr(factura, campo.format(i), valor)
+            totales[campo] += valor
+    factura.importe_de_potencia = round(totales['potencia_p{}'], 2)
+    factura.importe_consumo = round(totales['importe_consumo_p{}'] + totales['energia_precio_indexado_p{}'], 2)
+    factura.importe_exceso_potencia = round(totales['importe_exceso_potencia_p{}'], 2)
+
+    for campo, etiqueta in CONCEPTOS_UNICOS.items():
+        valor = plantilla.importe(etiqueta)
+        if valor is not None:
+            setattr(factura, campo, valor)
+    if not factura.importe_total_final:
+        factura.importe_total_final = factura.importe_facturado
+
+    total_kw = 0.0
+    for i in range(1, 7):
+        consumo = plantilla.kwh(_periodo(CONCEPTOS_POR_PERIODO['importe_consumo_p{}'], i)) or 0.0
+        setattr(factura, f'consumo_kw_p{i}', consumo)
+        total_kw += consumo
+    factura.kw_totales = round(total_kw, 2)
+
+    tarifa = plantilla.buscar(TARIFA_PATTERN)
+    if tarifa:
+        factura.tarifa = tarifa.replace(" ", "")
+    direccion = plantilla.buscar(DIRECCION_PATTERN)
+    if direccion:
+        factura.direccion_suministro = direccion
+    linea_alquiler = plantilla.buscar(re.compile(r"^(" + CONCEPTOS_UNICOS['importe_alquiler_equipos'] + r".*)", re.IGNORECASE))
+    if linea_alquiler:
+        dias = DIAS_PATTERN.search(linea_alquiler)
+        if dias:
+            factura.num_dias = int(dias.group(1))
+    vencimiento = plantilla.buscar(VENCIMIENTO_PATTERN)
+    if vencimiento:
+        factura.fecha_de_vencimiento = vencimiento.replace("-", "/")
+    cobro = plantilla.buscar(COBRO_PATTERN)
+    if cobro:
+        factura.fecha_de_cobro_en_banco = cobro.replace("-", "/")
+    asignar_mes_facturado(factura)
+
+
+def _validar(factura: FacturaEndesaCliente) -> list[str]:
+    """Motivos por los que el resultado no es fiable (lista vacía = válido)."""
+    motivos = []
+    if not factura.tarifa or factura.tarifa == 'N/A':
+        motivos.append("sin tarifa")
+    if not factura.importe_base_imponible:
+        motivos.append("sin base imponible")
+    if not factura.importe_facturado:
+        motivos.append("sin total factura")
+    if not factura.importe_de_potencia and not factura.importe_consumo:
+        motivos.append("sin términos de potencia ni de consumo")
+    if factura.importe_consumo and not factura.kw_totales:
+        motivos.append("sin consumos en kWh")
+    if motivos:
+        return motivos
+
+    terminos = factura.importe_de_potencia + factura.importe_consumo + factura.importe_exceso_potencia
+    if terminos > factura.importe_base_imponible + TOLERANCIA_IMPORTES:
+        motivos.append(f"términos ({terminos:.2f}) mayores que la base imponible ({factura.importe_base_imponible:.2f})")
+    if factura.importe_facturado + TOLERANCIA_IMPORTES < factura.importe_base_imponible:
+        motivos.append("total factura menor que la base imponible")
+    if factura.importe_total_tabla and abs(factura.importe_total_final - factura.importe_total_tabla) > TOLERANCIA_IMPORTES:
+        motivos.append(f"total ({factura.importe_total_final:.2f}) distinto del de la tabla ({factura.importe_total_tabla:.2f})")
+    return motivos
+
+
+def procesar_pdf_texto(factura: FacturaEndesaCliente, ruta_pdf: str) -> bool:
+    """
+    Extracción local desde la capa de texto del PDF, previa al OCR.
+    Solo modifica 'factura' si se encuentran todos los datos obligatorios y los importes cuadran;
+    en caso contrario devuelve False y la factura queda intacta para el OCR.
+    """
+    try:
+        texto = extraer_texto_pdf(ruta_pdf)
+    except Exception as e:
+        escribir_log(f"    -> [PDF TEXTO] No se pudo leer la capa de texto de {ruta_pdf}: {e}")
+        return False
+    if not texto.strip():
+        return False
+
+    borrador = factura.model_copy()
+    try:
+        _rellenar(borrador, _PlantillaFactura(texto))
+    except Exception as e:
+        escribir_log(f"    -> [PDF TEXTO] Fallo al aplicar la plantilla a la factura {factura.numero_factura}: {e}")
+        return False
+
+    motivos = _validar(borrador)
+    if motivos:
+        escribir_log(f"    -> [PDF TEXTO] Factura {factura.numero_factura} incompleta ({'; '.join(motivos)}). Se usará OCR.")
+        return False
+
+    for campo in FacturaEndesaCliente.model_fields:
+        setattr(factura, campo, getattr(borrador, campo))
+    factura.origen_datos = "PDF_TEXTO"
+    escribir_log(f"    -> [OK] [PDF TEXTO] Datos extraídos de la capa de texto para factura {factura.numero_factura} ({factura.cups})")
+    return True
@@ -0,0 +1,82 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from modelos_datos import FacturaEndesaCliente
+from xml_parser import procesar_xml_local
+from pdf_texto import procesar_pdf_texto
+from pdf_parser import MOTOR_OCR
+from logs import escribir_log
+from metricas import ETAPAS, OCR_EN_CURSO, medir_etapa
+
+# --- ETAPAS DE PROCESADO FUERA DEL EVENT LOOP ---
+# El navegador solo extrae filas y descarga; el parseo local (XML y capa de texto del PDF, CPU)
+# va a un pool de procesos y el OCR al motor asíncrono compartido (pdf_parser.MOTOR_OCR).
+
+# Procesos para el parseo local (0 = usar un hilo en lugar de procesos)
+MAX_PROCESOS_XML = max(0, int(os.environ.get("ENDESA_PROCESOS_XML", str(os.cpu_count() or 2))))
+
+_pool_procesos: ProcessPoolExecutor | None = None
+
+
+def _obtener_pool_procesos() -> ProcessPoolExecutor:
+    global _pool_procesos
+    if _pool_procesos is None:
+        _pool_procesos = ProcessPoolExecutor(max_workers=MAX_PROCESOS_XML)
+    return _pool_procesos
+
+
+def _procesar_aislado(parser, factura: FacturaEndesaCliente, filepath: str) -> tuple[bool, FacturaEndesaCliente]:
+    """Se ejecuta en el proceso hijo: devuelve la factura rellenada (la original no se comparte)."""
+    exito = parser(factura, filepath)
+    return exito, factura
+
+
+async def _parsear_en_proceso(parser, factura: FacturaEndesaCliente, filepath: str) -> bool:
+    """Ejecuta 'parser(factura, filepath)' en el pool de procesos y copia el resultado en 'factura'."""
+    global _pool_procesos
+    if MAX_PROCESOS_XML == 0:
+        return await asyncio.to_thread(parser, factura, filepath)
+
+    loop = asyncio.get_running_loop()
+    try:
+        exito, parseada = await loop.run_in_executor(_obtener_pool_procesos(), _procesar_aislado, parser, factura, filepath)
+    except BrokenProcessPool:
+        # Un proceso hijo murió: se descarta el pool (se recrea en la siguiente llamada)
+        escribir_log(f"    -> [ADVERTENCIA] Pool de procesos roto. Se recrea y se parsea en un hilo.")
+        _pool_procesos = None
+        return await asyncio.to_thread(parser, factura, filepath)
+
+    for campo in FacturaEndesaCliente.model_fields:
+        setattr(factura, campo, getattr(parseada, campo))
+    return exito
+
+
+@medir_etapa("parseo_xml", es_fallo=lambda exito: not exito)
+async def parsear_xml(factura: FacturaEndesaCliente, filepath: str) -> bool:
+    """Equivalente asíncrono de procesar_xml_local: parsea en el pool de procesos y rellena 'factura'."""
+    return await _parsear_en_proceso(procesar_xml_local, factura, filepath)
+
+
+async def extraer_pdf(factura: FacturaEndesaCliente, filepath: str) -> bool:
+    """
+    Extracción del PDF en dos etapas: primero la capa de texto (local, milisegundos) y,
+    solo si faltan datos obligatorios o los importes no cuadran, el OCR con el LLM.
+    La vía usada queda en 'factura.origen_datos'.
+    """
+    with ETAPAS.medir(etapa="pdf_texto") as medicion:
+        exito_texto = await _parsear_en_proceso(procesar_pdf_texto, factura, filepath)
+        if not exito_texto:
+            medicion.fallo()
+    if exito_texto:
+        return True
+    with OCR_EN_CURSO.en_curso():
+        return await MOTOR_OCR.procesar(factura, filepath)
+
+
+def cerrar_pool_procesos():
+    """Libera los procesos del parseo XML (apagado de la API)."""
+    global _pool_procesos
+    if _pool_procesos is not None:
+        _pool_procesos.shutdown(cancel_futures=True)
+        _pool_procesos = None
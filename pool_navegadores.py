@@ -0,0 +1,107 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
+from navegador import NavegadorAsync
+from logs import escribir_log
+
+# Número de navegadores precalentados que mantiene la API (0 = sin pool, un navegador por petición)
+POOL_SIZE = max(0, int(os.environ.get("ENDESA_POOL_NAVEGADORES", "1")))
+# Segundos que una petición espera un navegador libre antes de arrancar uno temporal propio
+POOL_ESPERA_S = max(0.0, float(os.environ.get("ENDESA_POOL_ESPERA_S", "30")))
+
+
+class PoolNavegadores:
+    """
+    Pool de navegadores Playwright ya lanzados y con la sesión del portal iniciada.
+    Las peticiones toman uno prestado con 'prestar()' y lo devuelven al terminar.
+    Los navegadores caídos o que terminan con error se reciclan (se cierran y se crean de nuevo).
+    """
+    def __init__(self, tamano: int, preparar: Callable[[NavegadorAsync], Awaitable], espera_s: float = POOL_ESPERA_S):
+        self.tamano = tamano
+        self.espera_s = espera_s
+        # Función que deja el navegador arrancado y autenticado (robotEndesa.asegurar_sesion)
+        self._preparar = preparar
+        self._libres: asyncio.Queue[NavegadorAsync] = asyncio.Queue()
+        self._todos: set[NavegadorAsync] = set()
+        self._tareas: set[asyncio.Task] = set()
+
+    def libres(self) -> int:
+        """Navegadores listos esperando préstamo."""
+        return self._libres.qsize()
+
+    async def iniciar(self):
+        """Lanza en segundo plano el calentamiento de todos los navegadores del pool."""
+        escribir_log(f"[POOL] Calentando {self.tamano} navegador(es)...")
+        for _ in range(self.tamano):
+            self._lanzar_calentamiento()
+
+    def _lanzar_calentamiento(self):
+        tarea = asyncio.create_task(self._calentar())
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._tareas.discard)
+
+    async def _calentar(self):
+        """Arranca un navegador nuevo, intenta dejarlo autenticado y lo pone a disposición."""
+        robot = NavegadorAsync()
+        self._todos.add(robot)
+        try:
+            await self._preparar(robot)
+            escribir_log(f"[POOL] Navegador listo con sesión iniciada.")
+        except Exception as e:
+            # Se entrega igualmente: la petición que lo tome volverá a intentar el login
+            escribir_log(f"[POOL] No se pudo precalentar la sesión: {e}")
+        await self._libres.put(robot)
+
+    async def _reciclar(self, robot: NavegadorAsync):
+        """Cierra un navegador defectuoso y lanza uno nuevo en su lugar."""
+        self._todos.discard(robot)
+        try:
+            await robot.cerrar()
+        except Exception as e:
+            escribir_log(f"[POOL] Error al cerrar navegador defectuoso: {e}")
+        self._lanzar_calentamiento()
+
+    @asynccontextmanager
+    async def prestar(self) -> AsyncIterator[NavegadorAsync | None]:
+        """
+        Presta un navegador del pool durante el bloque 'async with'.
+        Con el pool desactivado (tamaño 0), o si no queda ninguno libre en 'espera_s' segundos,
+        devuelve None y el robot usará un navegador propio que cierra al terminar.
+        """
+        if self.tamano == 0:
+            yield None
+            return
+
+        try:
+            robot = await asyncio.wait_for(self._libres.get(), timeout=self.espera_s)
+        except asyncio.TimeoutError:
+            escribir_log(f"[POOL] Ningún navegador libre tras {self.espera_s:.0f}s. Se usa uno temporal para esta petición.")
+            yield None
+            return
+        if not robot.esta_sano():
+            # No esperamos al reemplazo: esta petición usa un navegador propio
+            escribir_log(f"[POOL] Navegador no disponible. Reciclando y usando uno propio para esta petición.")
+            await self._reciclar(robot)
+            yield None
+            return
+
+        try:
+            yield robot
+        except BaseException:
+            await self._reciclar(robot)
+            raise
+        else:
+            await self._libres.put(robot)
+
+    async def cerrar(self):
+        """Cierra todos los navegadores del pool (apagado de la API)."""
+        for tarea in list(self._tareas):
+            tarea.cancel()
+        for robot in list(self._todos):
+            try:
+                await robot.cerrar()
+            except Exception:
+                pass
+        self._todos.clear()
+        escribir_log(f"[POOL] Navegadores cerrados.")
@@ -0,0 +1,331 @@
+import argparse
+import asyncio
+import random
+import secrets
+import socket
+import threading
+import time
+from datetime import date, datetime, timedelta
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
+import uvicorn
+from generador_facturae import generar_facturae
+
+# --- PORTAL FALSO DE ENDESA (pruebas y benchmark sin credenciales reales) ---
+# Reproduce las páginas y selectores de los que depende robotEndesa.py: el formulario
+# de login con ACCEDER, el banner '#truste-consent-button', el panel de filtros, la tabla
+# paginada 'table#example1' y los botones de descarga XML y PDF. Sirve facturas generadas
+# (generador_facturae.py) con una latencia configurable por petición.
+# Para usarlo con el robot: ENDESA_URL_BASE=http://127.0.0.1:<puerto>
+
+GRUPO_PORTAL = "GRUPO HERMANOS MARTIN"
+FILAS_POR_PAGINA = 10
+FORMATO_FECHA = '%d/%m/%Y'
+
+
+class _DatosPortal:
+    """Catálogo de CUPS y facturas mensuales (con su XML y PDF) generados con una semilla fija."""
+    def __init__(self, num_cups: int, meses: int, semilla: int):
+        rng = random.Random(semilla)
+        hoy = date.today()
+        self.cups = [f"ES0031{i:012d}{rng.choice('ABCDEFGHJK')}{rng.choice('LMNPQRSTVW')}" for i in range(1, num_cups + 1)]
+        self.facturas: list[dict] = []
+        self.xml: dict[str, bytes] = {}
+        for n, cups in enumerate(self.cups, start=1):
+            periodos = rng.choice((2, 3, 6))
+            indexada = rng.random() < 0.3
+            for m in range(meses, 0, -1):
+                # Periodo = mes natural; la factura se emite unos días después del fin
+                fin = (hoy.replace(day=1) - timedelta(days=1))
+                for _ in range(m - 1):
+                    fin = fin.replace(day=1) - timedelta(days=1)
+                inicio = fin.replace(day=1)
+                emision = fin + timedelta(days=rng.randint(2, 9))
+                numero = f"P{n:05d}{fin:%Y%m}"
+                xml = generar_facturae(cups, numero, emision, inicio, fin, random.Random(f"{semilla}-{numero}"), periodos=periodos, indexada=indexada)
+                total = xml.split(b"<fe:InvoiceTotal>")[1].split(b"<")[0].decode()
+                self.xml[numero] = xml
+                self.facturas.append({
+                    "fecha_emision": emision, "numero": numero, "inicio": inicio, "fin": fin,
+                    "importe": f"{total} €", "contrato": f"C{n:08d}", "cups": cups, "secuencial": "1",
+                    "estado": "Pagada", "fraccionamiento": "No", "tipo": "Ordinaria", "pdf": f"PDF{numero}",
+                })
+        self.facturas.sort(key=lambda f: f["fecha_emision"], reverse=True)
+
+    def buscar(self, grupo: str, cups: str, desde: date | None, hasta: date | None, limite: int) -> list[dict]:
+        if grupo != GRUPO_PORTAL:
+            return []
+        filas = [
+            f for f in self.facturas
+            if (not cups or f["cups"].startswith(cups))
+            and (desde is None or f["fecha_emision"] >= desde)
+            and (hasta is None or f["fecha_emision"] <= hasta)
+        ]
+        return filas[:limite]
+
+
+def _pdf_minimo(numero: str) -> bytes:
+    """PDF válido de una página (el robot solo lo usa si falta el XML)."""
+    texto = f"BT /F1 12 Tf 72 720 Td (Factura {numero}) Tj ET".encode()
+    objetos = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length " + str(len(texto)).encode() + b" >>\nstream\n" + texto + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    salida = b"%PDF-1.4\n"
+    posiciones = []
+    for i, objeto in enumerate(objetos, start=1):
+        posiciones.append(len(salida))
+        salida += f"{i} 0 obj\n".encode() + objeto + b"\nendobj\n"
+    xref = len(salida)
+    salida += f"xref\n0 {len(objetos) + 1}\n0000000000 65535 f \n".encode()
+    salida += b"".join(f"{p:010d} 00000 n \n".encode() for p in posiciones)
+    salida += f"trailer\n<< /Size {len(objetos) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return salida
+
+
+PAGINA_LOGIN = """<!DOCTYPE html><html lang="es"><head><meta charset="utf-8"><title>Endesa - Acceso</title></head><body>
+<form class="slds-form" onsubmit="return false">
+  <input name="Username" type="text" placeholder="Usuario">
+  <input name="password" type="password" placeholder="Contraseña">
+  <button type="button" onclick="acceder()">ACCEDER</button>
+  <div id="mensaje"></div>
+</form>
+<script>
+async function acceder() {
+  const r = await fetch('/miempresa/api/login', {method: 'POST', headers: {'Content-Type': 'application/json'},
+    body: JSON.stringify({usuario: document.querySelector('input[name=Username]').value,
+                          clave: document.querySelector('input[name=password]').value})});
+  if (r.ok) { location.href = '/miempresa/s/'; }
+  else { document.getElementById('mensaje').outerHTML = '<div class="login-error">Credenciales incorrectas</div>'; }
+}
+</script></body></html>"""
+
+PAGINA_INICIO = """<!DOCTYPE html><html lang="es"><head><meta charset="utf-8"><title>Endesa - Mi empresa</title></head><body>
+<div id="banner-cookies"><p>Usamos cookies.</p><button id="truste-consent-button" onclick="this.parentNode.remove()">Aceptar</button></div>
+<h1>Bienvenido</h1><a href="/miempresa/s/asistente-busqueda?tab=f">Buscar facturas</a>
+</body></html>"""
+
+PAGINA_BUSQUEDA = """<!DOCTYPE html><html lang="es"><head><meta charset="utf-8"><title>Endesa - Asistente de búsqueda</title></head><body>
+<div class="filter-padd-container">
+  <button name="periodo" onclick="abrirFiltro('grupo')">Grupo empresarial</button>
+  <button name="periodo" onclick="abrirFiltro('cups')">CUPS20/CUPS22</button>
+  <div id="panel-filtro" style="display:none"><input type="text" placeholder="Buscar" oninput="mostrarOpciones()"><div id="opciones"></div></div>
+  <fieldset><legend>Fecha de consumo</legend>
+    <label for="consumo-desde">Desde</label><input id="consumo-desde" type="text">
+    <label for="consumo-hasta">Hasta</label><input id="consumo-hasta" type="text">
+  </fieldset>
+  <fieldset><legend>Fecha de emisión</legend>
+    <label for="emision-desde">Desde</label><input id="emision-desde" type="text">
+    <label for="emision-hasta">Hasta</label><input id="emision-hasta" type="text">
+  </fieldset>
+  <label for="limite">Limite</label><input id="limite" type="number" min="1" max="500" value="50">
+  <button class="slds-button slds-button_brand" onclick="buscar(1)">Buscar</button>
+</div>
+<div id="resultados"></div>
+<script>
+const CATALOGO = __CATALOGO__;
+const filtros = {grupo: '', cups: ''};
+let filtroActivo = null;
+const celda = (v) => { const td = document.createElement('td'); td.textContent = v; return td; };
+function abrirFiltro(tipo) {
+  filtroActivo = tipo;
+  const panel = document.getElementById('panel-filtro');
+  panel.style.display = 'block';
+  panel.querySelector('input').value = '';
+  document.getElementById('opciones').innerHTML = '';
+}
+function mostrarOpciones() {
+  const texto = document.querySelector('#panel-filtro input').value.toUpperCase();
+  const contenedor = document.getElementById('opciones');
+  contenedor.innerHTML = '';
+  if (!texto) return;
+  for (const valor of CATALOGO[filtroActivo].filter((v) => v.includes(texto)).slice(0, 20)) {
+    const opcion = document.createElement('span');
+    opcion.setAttribute('role', 'option');
+    opcion.textContent = valor;
+    opcion.onclick = () => { filtros[filtroActivo] = valor; document.getElementById('panel-filtro').style.display = 'none'; contenedor.innerHTML = ''; };
+    contenedor.appendChild(opcion);
+  }
+}
+function filaCargando() {
+  const tr = document.createElement('tr');
+  for (let i = 0; i < 14; i++) tr.appendChild(celda('Cargando...'));
+  return tr;
+}
+function descargar(tipo, id) {
+  const a = document.createElement('a');
+  a.href = '/miempresa/descargas/' + tipo + '/' + encodeURIComponent(id);
+  a.download = '';
+  document.body.appendChild(a); a.click(); a.remove();
+}
+async function buscar(pagina) {
+  let contenedor = document.querySelector('div.style-table.contenedorGeneral');
+  if (!contenedor) {
+    document.getElementById('resultados').innerHTML =
+      '<div class="style-table contenedorGeneral"><table id="example1"><thead><tr>' +
+      ['Fecha emisión', 'Nº factura', 'Inicio', 'Fin', 'Importe', 'Contrato', 'CUPS', 'Secuencial', 'Estado',
+       'Fraccionamiento', 'Tipo', 'XML', 'HTML', 'PDF'].map((t) => '<th>' + t + '</th>').join('') +
+      '</tr></thead><tbody></tbody></table><div class="pagination"><span class="pagination-flex-central"></span>' +
+      '<button class="pagination-flex-siguiente" disabled>Siguiente</button></div></div>';
+    document.querySelector('button.pagination-flex-siguiente').onclick = () => buscar(window.paginaActual + 1);
+  }
+  const tbody = document.querySelector('table#example1 tbody');
+  const siguiente = document.querySelector('button.pagination-flex-siguiente');
+  tbody.replaceChildren(filaCargando());
+  siguiente.disabled = true;
+  const params = new URLSearchParams({grupo: filtros.grupo, cups: filtros.cups,
+    desde: document.getElementById('emision-desde').value, hasta: document.getElementById('emision-hasta').value,
+    limite: document.getElementById('limite').value, pagina: pagina});
+  const datos = await (await fetch('/miempresa/api/facturas?' + params)).json();
+  window.paginaActual = datos.pagina;
+  tbody.replaceChildren();
+  if (!datos.filas.length) {
+    const td = celda('No hay resultados'); td.colSpan = 14;
+    const tr = document.createElement('tr'); tr.appendChild(td); tbody.appendChild(tr);
+  }
+  for (const f of datos.filas) {
+    const tr = document.createElement('tr');
+    for (const v of [f.fecha_emision, f.numero, f.inicio, f.fin, f.importe, f.contrato, f.cups, f.secuencial,
+                     f.estado, f.fraccionamiento, f.tipo]) tr.appendChild(celda(v));
+    const xml = document.createElement('td'); xml.innerHTML = '<button>@</button>';
+    xml.querySelector('button').onclick = () => descargar('xml', f.numero);
+    const html = document.createElement('td'); html.innerHTML = '<button>HTML</button>';
+    const pdf = document.createElement('td'); pdf.innerHTML = '<button>PDF</button>';
+    pdf.querySelector('button').value = f.pdf;
+    pdf.querySelector('button').onclick = (e) => descargar('pdf', e.target.value);
+    tr.append(xml, html, pdf);
+    tbody.appendChild(tr);
+  }
+  document.querySelector('span.pagination-flex-central').textContent = 'Página ' + datos.pagina + ' de ' + datos.paginas;
+  siguiente.disabled = datos.pagina >= datos.paginas;
+}
+</script></body></html>"""
+
+
+def _fecha(texto: str) -> date | None:
+    try:
+        return datetime.strptime(texto, FORMATO_FECHA).date()
+    except ValueError:
+        return None
+
+
+def crear_portal(num_cups: int = 20, meses: int = 12, latencia_ms: float = 0, filas_por_pagina: int = FILAS_POR_PAGINA, semilla: int = 1) -> FastAPI:
+    """
+    Aplicación del portal falso con 'num_cups' suministros y 'meses' facturas por suministro.
+    Cada petición espera 'latencia_ms' antes de responder (simula la red y Salesforce).
+    'app.state.datos' expone el catálogo generado y 'app.state.peticiones' el recuento por ruta.
+    """
+    datos = _DatosPortal(num_cups, meses, semilla)
+    sesiones: set[str] = set()
+    app = FastAPI(title="Portal falso de Endesa")
+    app.state.datos = datos
+    app.state.peticiones = {}
+    pagina_busqueda = PAGINA_BUSQUEDA.replace(
+        "__CATALOGO__", JSONResponse({"grupo": [GRUPO_PORTAL], "cups": datos.cups}).body.decode()
+    )
+
+    @app.middleware("http")
+    async def latencia(request: Request, call_next):
+        ruta = request.url.path.rsplit("/", 1)[0] if "/descargas/" in request.url.path else request.url.path
+        app.state.peticiones[ruta] = app.state.peticiones.get(ruta, 0) + 1
+        if latencia_ms:
+            await asyncio.sleep(latencia_ms / 1000)
+        return await call_next(request)
+
+    def _autenticado(request: Request) -> bool:
+        return request.cookies.get("sid") in sesiones
+
+    def _al_login() -> RedirectResponse:
+        return RedirectResponse("/miempresa/s/login/?language=es", status_code=302)
+
+    @app.get("/miempresa/s/login/")
+    def login():
+        return HTMLResponse(PAGINA_LOGIN)
+
+    @app.post("/miempresa/api/login")
+    async def api_login(request: Request):
+        cuerpo = await request.json()
+        if not cuerpo.get("usuario") or not cuerpo.get("clave"):
+            return JSONResponse({"error": "credenciales"}, status_code=401)
+        sid = secrets.token_hex(16)
+        sesiones.add(sid)
+        respuesta = JSONResponse({"ok": True})
+        respuesta.set_cookie("sid", sid, httponly=True)
+        return respuesta
+
+    @app.get("/miempresa/s/")
+    def inicio(request: Request):
+        return HTMLResponse(PAGINA_INICIO) if _autenticado(request) else _al_login()
+
+    @app.get("/miempresa/s/asistente-busqueda")
+    def busqueda(request: Request):
+        return HTMLResponse(pagina_busqueda) if _autenticado(request) else _al_login()
+
+    @app.get("/miempresa/api/facturas")
+    def api_facturas(request: Request, grupo: str = "", cups: str = "", desde: str = "", hasta: str = "", limite: int = 50, pagina: int = 1):
+        if not _autenticado(request):
+            return JSONResponse({"error": "sesion"}, status_code=401)
+        filas = datos.buscar(grupo, cups.upper(), _fecha(desde), _fecha(hasta), max(1, limite))
+        paginas = max(1, -(-len(filas) // filas_por_pagina))
+        pagina = min(max(1, pagina), paginas)
+        visibles = filas[(pagina - 1) * filas_por_pagina: pagina * filas_por_pagina]
+        return {
+            "pagina": pagina, "paginas": paginas, "total": len(filas),
+            "filas": [
+                {**f, **{c: f[c].strftime(FORMATO_FECHA) for c in ("fecha_emision", "inicio", "fin")}}
+                for f in visibles
+            ],
+        }
+
+    @app.get("/miempresa/descargas/xml/{numero}")
+    def descargar_xml(request: Request, numero: str):
+        if not _autenticado(request):
+            return _al_login()
+        if numero not in datos.xml:
+            return Response(status_code=404)
+        return Response(datos.xml[numero], media_type="application/xml",
+                        headers={"Content-Disposition": f'attachment; filename="{numero}.xml"'})
+
+    @app.get("/miempresa/descargas/pdf/{valor}")
+    def descargar_pdf(request: Request, valor: str):
+        if not _autenticado(request):
+            return _al_login()
+        numero = valor.removeprefix("PDF")
+        if numero not in datos.xml:
+            return Response(status_code=404)
+        return Response(_pdf_minimo(numero), media_type="application/pdf",
+                        headers={"Content-Disposition": f'attachment; filename="{numero}.pdf"'})
+
+    return app
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def iniciar_en_hilo(app: FastAPI, puerto: int | None = None) -> tuple[str, uvicorn.Server]:
+    """Arranca el portal en un hilo de fondo. Devuelve su URL base y el servidor (server.should_exit = True lo detiene)."""
+    puerto = puerto or _puerto_libre()
+    servidor = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=puerto, log_level="warning"))
+    threading.Thread(target=servidor.run, name="portal-falso", daemon=True).start()
+    while not servidor.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{puerto}", servidor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Portal falso de Endesa para pruebas y benchmark del robot.")
+    parser.add_argument("--puerto", type=int, default=8800)
+    parser.add_argument("--cups", type=int, default=20, help="Número de suministros del grupo.")
+    parser.add_argument("--meses", type=int, default=12, help="Facturas mensuales por suministro.")
+    parser.add_argument("--latencia-ms", type=float, default=0, help="Espera añadida a cada petición.")
+    parser.add_argument("--filas-por-pagina", type=int, default=FILAS_POR_PAGINA)
+    args = parser.parse_args()
+    portal = crear_portal(args.cups, args.meses, args.latencia_ms, args.filas_por_pagina)
+    print(f"Portal falso en http://127.0.0.1:{args.puerto} (ENDESA_URL_BASE). CUPS: {', '.join(portal.state.datos.cups[:3])}...")
+    uvicorn.run(portal, host="127.0.0.1", port=args.puerto, log_level="warning")
@@ -0,0 +1,141 @@
+import asyncio
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+from manifiesto_facturas import calcular_sha256
+
+# --- ENVÍO DE ARCHIVOS LOCALES EN BINARIO ---
+# Respuesta HTTP para un archivo del disco: se envía por bloques (sin cargarlo en memoria),
+# con Content-Length, ETag fuerte (SHA-256 del contenido), Last-Modified, GET condicional
+# (If-None-Match / If-Modified-Since -> 304) y una petición Range de un solo tramo (206).
+# Toda la E/S de disco (stat, hash, lectura) se hace en hilos, fuera del event loop.
+
+TAMANO_BLOQUE = 64 * 1024
+HUELLAS_MAX = 4096
+
+# ruta -> (mtime_ns, tamaño, etag): el hash solo se recalcula si el archivo cambia
+_huellas: dict[str, tuple[int, int, str]] = {}
+
+
+class _RangoNoSatisfacible(Exception):
+    pass
+
+
+def _metadatos(ruta: str) -> tuple[os.stat_result, str]:
+    """stat del archivo y su ETag (entre comillas, fuerte)."""
+    estado = os.stat(ruta)
+    huella = _huellas.get(ruta)
+    if huella and huella[:2] == (estado.st_mtime_ns, estado.st_size):
+        return estado, huella[2]
+    etag = f'"{calcular_sha256(ruta)}"'
+    if len(_huellas) >= HUELLAS_MAX:
+        _huellas.clear()
+    _huellas[ruta] = (estado.st_mtime_ns, estado.st_size, etag)
+    return estado, etag
+
+
+def _coincide_etag(cabecera: str, etag: str) -> bool:
+    """Comparación débil de If-None-Match (acepta '*' y una lista de etiquetas, con o sin W/)."""
+    if cabecera.strip() == "*":
+        return True
+    return etag in (e.strip().removeprefix("W/") for e in cabecera.split(","))
+
+
+def _no_modificado_desde(cabecera: str, mtime: float) -> bool:
+    try:
+        return int(mtime) <= parsedate_to_datetime(cabecera).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def _rango(cabecera: str, tamano: int) -> tuple[int, int] | None:
+    """
+    Tramo (inicio, fin incluido) de una cabecera 'bytes=a-b', 'bytes=a-' o 'bytes=-n'.
+    None si la cabecera no se entiende o pide varios tramos (se responde el archivo completo).
+    """
+    unidad, _, valor = cabecera.partition("=")
+    if unidad.strip().lower() != "bytes" or "," in valor:
+        return None
+    inicio_txt, guion, fin_txt = valor.strip().partition("-")
+    if not guion:
+        return None
+    try:
+        if not inicio_txt:
+            sufijo = int(fin_txt)
+            if sufijo <= 0 or tamano == 0:
+                raise _RangoNoSatisfacible()
+            return max(0, tamano - sufijo), tamano - 1
+        inicio = int(inicio_txt)
+        fin = int(fin_txt) if fin_txt else tamano - 1
+    except ValueError:
+        return None
+    if inicio >= tamano:
+        raise _RangoNoSatisfacible()
+    if fin < inicio:
+        return None
+    return inicio, min(fin, tamano - 1)
+
+
+async def _leer_tramo(ruta: str, inicio: int, longitud: int):
+    f = await asyncio.to_thread(open, ruta, "rb")
+    try:
+        await asyncio.to_thread(f.seek, inicio)
+        pendiente = longitud
+        while pendiente > 0:
+            bloque = await asyncio.to_thread(f.read, min(TAMANO_BLOQUE, pendiente))
+            if not bloque:
+                break
+            pendiente -= len(bloque)
+            yield bloque
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+async def responder_archivo(request: Request, ruta: str, media_type: str, nombre: str | None = None) -> Response:
+    """
+    Respuesta para 'ruta' según las cabeceras de 'request' (200, 206, 304 o 416).
+    'nombre' se envía en Content-Disposition. Lanza FileNotFoundError si el archivo no existe.
+    """
+    estado, etag = await asyncio.to_thread(_metadatos, ruta)
+    tamano = estado.st_size
+    cabeceras = {
+        "ETag": etag,
+        "Last-Modified": formatdate(estado.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache", # se puede guardar, pero revalidando con el ETag
+    }
+    if nombre:
+        cabeceras["Content-Disposition"] = f'inline; filename="{nombre}"'
+
+    # GET condicional: If-None-Match manda sobre If-Modified-Since
+    si_no_coincide = request.headers.get("if-none-match")
+    if si_no_coincide is not None:
+        no_modificado = _coincide_etag(si_no_coincide, etag)
+    else:
+        si_modificado = request.headers.get("if-modified-since")
+        no_modificado = si_modificado is not None and _no_modificado_desde(si_modificado, estado.st_mtime)
+    if no_modificado and request.method in ("GET", "HEAD"):
+        cabeceras.pop("Content-Disposition", None)
+        return Response(status_code=304, headers=cabeceras)
+
+    tramo = None
+    cabecera_rango = request.headers.get("range")
+    # If-Range: el tramo solo vale si el archivo sigue siendo el mismo (si no, se envía entero)
+    si_rango = request.headers.get("if-range")
+    if cabecera_rango and (si_rango is None or si_rango.strip() in (etag, cabeceras["Last-Modified"])):
+        try:
+            tramo = _rango(cabecera_rango, tamano)
+        except _RangoNoSatisfacible:
+            return Response(status_code=416, headers={**cabeceras, "Content-Range": f"bytes */{tamano}"})
+
+    inicio, fin = tramo or (0, tamano - 1)
+    longitud = max(0, fin - inicio + 1)
+    cabeceras["Content-Length"] = str(longitud)
+    codigo = 200
+    if tramo:
+        codigo = 206
+        cabeceras["Content-Range"] = f"bytes {inicio}-{fin}/{tamano}"
+    if request.method == "HEAD":
+        return Response(status_code=codigo, headers=cabeceras, media_type=media_type)
+    return StreamingResponse(_leer_tramo(ruta, inicio, longitud), status_code=codigo, headers=cabeceras, media_type=media_type)
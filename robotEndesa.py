@@ -1,20 +1,34 @@
 from navegador import NavegadorAsync, TEMP_DOWNLOAD_ROOT # Importamos la clase base y la ruta de descarga
+from pool_navegadores import PoolNavegadores
 import asyncio
 import re
 import csv # Necesario para exportar los logs
 import base64 # Necesario para la codificación Base64
 import os # Necesario para manejar rutas de archivos
+import json # Necesario para persistir el estado de la sesión
+from contextlib import nullcontext
+from typing import AsyncIterator, Awaitable, Callable
 from playwright.async_api import Page, TimeoutError, Locator # Importamos Page, TimeoutError, Locator
 from modelos_datos import FacturaEndesaCliente # Importamos la clase modelo de datos (AHORA ES PYDANTIC)
-# IMPORTACIÓN DEL PARSER de documentos
-from xml_parser import procesar_xml_local
-from pdf_parser import procesar_pdf_local
+# IMPORTACIÓN DEL PARSER de documentos (ejecutado fuera del event loop)
+from pipeline_documentos import parsear_xml, extraer_pdf
+# Descargas directas con la sesión del contexto (respaldo: clic en el botón)
+from descargas import MotorDescargas
+# Manifiesto de facturas ya descargadas/parseadas (evita repetir descargas)
+from manifiesto_facturas import ManifiestoFacturas
+# Histórico SQLite de facturas y rangos ya consultados
+from almacen_facturas import AlmacenFacturas, clave_cups, parsear_fecha, ordenar_por_emision, FORMATO_FECHA_API
+from exportacion import EXPORTADOR
+from datetime import date, timedelta
 # IMPORTACIÓN DE LA FUNCIÓN DE LOGGING
-from logs import escribir_log
+from logs import escribir_log, contexto_log
+from metricas import medir_etapa, DOCUMENTOS_EN_PROCESO, FILAS_TABLA
 
 # --- CONSTANTES DE ENDESA ---
-URL_LOGIN = "https://endesa-atenea.my.site.com/miempresa/s/login/?language=es" 
-URL_BUSQUEDA_FACTURAS = "https://endesa-atenea.my.site.com/miempresa/s/asistente-busqueda?tab=f"
+# La base se puede cambiar para apuntar a un portal de pruebas (ver portal_falso.py)
+URL_BASE = os.environ.get("ENDESA_URL_BASE", "https://endesa-atenea.my.site.com").rstrip("/")
+URL_LOGIN = f"{URL_BASE}/miempresa/s/login/?language=es" 
+URL_BUSQUEDA_FACTURAS = f"{URL_BASE}/miempresa/s/asistente-busqueda?tab=f"
 
 # Credenciales REALES proporcionadas por el usuario
 USER = os.environ.get("ENDESA_USER", "no_user")
@@ -26,9 +40,31 @@ GRUPO_EMPRESARIAL = "GRUPO HERMANOS MARTIN" # Constante para el filtro siempre a
 TABLE_LIMIT = 50 
 MAX_LOGIN_ATTEMPTS = 5 # NÚMERO MÁXIMO DE INTENTOS DE LOGIN
 
+class ResultadosTruncados(Exception):
+    """La búsqueda devolvió tantas filas como el límite: puede haber facturas sin mostrar."""
+    def __init__(self, filas: int):
+        super().__init__(f"TABLA_EN_LIMITE: {filas} filas (límite alcanzado)")
+        self.filas = filas
+
+# BÚSQUEDA POR GRUPO: a partir de este número de CUPS pendientes se hace una búsqueda por
+# ventana de fechas con solo el filtro del grupo, en lugar de una búsqueda por CUPS
+UMBRAL_BUSQUEDA_GRUPO = max(1, int(os.environ.get("ENDESA_UMBRAL_GRUPO", "20")))
+VENTANA_GRUPO_DIAS = max(1, int(os.environ.get("ENDESA_VENTANA_GRUPO_DIAS", "31")))
+TABLE_LIMIT_GRUPO = int(os.environ.get("ENDESA_LIMITE_GRUPO", "500")) # valor del slider "Limite" en modo grupo
+
+# PARALELISMO: número de páginas (contextos) que procesan CUPS a la vez tras un único login
+NUM_WORKERS_PARALELOS = max(1, int(os.environ.get("ENDESA_PARALELISMO", "1")))
+
 # Selector que aparece SÓLO después de un login exitoso (El botón de cookies)
 SUCCESS_INDICATOR_SELECTOR = '#truste-consent-button' 
 
+# --- PERSISTENCIA DE LA SESIÓN ---
+# Estado de Playwright (cookies + localStorage) reutilizado entre llamadas a la API.
+# Fuera de 'temp_endesa_downloads' para que /clear_files no fuerce un nuevo login.
+SESSION_STATE_FILE = os.path.join("sesion", "storage_state.json")
+SESSION_PROBE_TIMEOUT = 15000 # ms para considerar que la sesión sigue viva
+_estado_sesion_memoria: dict | None = None
+
 # --- CONSTANTE DE LOGGING Y CARPETAS DE DESCARGA ---
 LOG_FILE_NAME_TEMPLATE = "csv/facturas_endesa_log_{cups}.csv"
 
@@ -43,6 +79,22 @@ for folder in DOWNLOAD_FOLDERS.values():
 
 escribir_log(f"[INFO] Carpetas de descarga configuradas en: {TEMP_DOWNLOAD_ROOT}")
 
+# Manifiesto dentro de la carpeta de descargas: /clear_files lo elimina junto con los archivos
+MANIFIESTO = ManifiestoFacturas(os.path.join(TEMP_DOWNLOAD_ROOT, "manifiesto_facturas.json"))
+
+# Histórico local: las consultas solo van al portal para los rangos de fechas no cubiertos
+ALMACEN = AlmacenFacturas()
+
+# Motor de descargas directas compartido (aprende las URLs de las descargas por clic)
+DESCARGAS = MotorDescargas()
+
+# Campos que se leen de la tabla del portal en cada ejecución (pueden cambiar, p. ej. el estado)
+CAMPOS_TABLA = [
+    'fecha_emision', 'numero_factura', 'fecha_inicio_periodo', 'fecha_fin_periodo',
+    'importe_total_tabla', 'contrato', 'cups', 'secuencial', 'estado_factura',
+    'fraccionamiento', 'tipo_factura', 'descarga_selector',
+]
+
 
 # --- FUNCIONES DE UTILIDAD PARA EXTRACCIÓN Y LOGGING (INALTERADAS) ---
 
@@ -66,6 +118,67 @@ async def _extraer_texto_de_td(td: Locator) -> str:
     except Exception:
         return ""
 
+# Lectura de la tabla completa en un único viaje al navegador (ver _snapshot_tabla).
+# Replica _extraer_texto_de_td para cada celda, atravesando los shadow roots como los locators.
+SNAPSHOT_TABLA_JS = """
+(selectorFilas) => {
+    const buscar = (raiz, selector) => {
+        const directo = raiz.querySelector(selector);
+        if (directo) return directo;
+        for (const el of raiz.querySelectorAll('*')) {
+            if (el.shadowRoot) {
+                const encontrado = buscar(el.shadowRoot, selector);
+                if (encontrado) return encontrado;
+            }
+        }
+        return null;
+    };
+    return Array.from(document.querySelectorAll(selectorFilas)).map((tr) => {
+        const tds = Array.from(tr.querySelectorAll(':scope > td'));
+        const celdas = tds.map((td) => {
+            const lightning = buscar(td, 'lightning-formatted-date-time, button, a');
+            if (lightning) return (lightning.innerText || '').trim();
+            const texto = td.innerText || '';
+            return texto.includes('No hay resultados') ? '' : texto.trim();
+        });
+        const boton = tds.length > 13 ? buscar(tds[13], 'button') : null;
+        return { celdas: celdas, pdf_value: boton ? (boton.getAttribute('value') || '') : '' };
+    });
+}
+"""
+
+@medir_etapa("tabla")
+async def _snapshot_tabla(page: Page) -> list[dict]:
+    """
+    Lee en un solo 'page.evaluate' el texto de todas las celdas y el valor del botón de
+    descarga PDF de cada fila visible: [{'celdas': [...], 'pdf_value': str}, ...].
+    """
+    return await page.evaluate(SNAPSHOT_TABLA_JS, 'table#example1 tbody tr')
+
+async def _leer_fila_locator(row: Locator) -> tuple[list[str], str]:
+    """Lectura celda a celda con locators (respaldo si la instantánea no ve la tabla)."""
+    tds = row.locator('td')
+    pdf_value = await tds.nth(13).locator('button').get_attribute("value") or ""
+    celdas = [await _extraer_texto_de_td(tds.nth(i)) for i in range(11)]
+    return celdas, pdf_value
+
+def _factura_desde_celdas(celdas: list[str], pdf_value: str) -> FacturaEndesaCliente:
+    """Crea la factura (solo metadata de la tabla) a partir del texto de las celdas de una fila."""
+    return FacturaEndesaCliente(
+        fecha_emision=celdas[0],
+        numero_factura=celdas[1],
+        fecha_inicio_periodo=celdas[2],
+        fecha_fin_periodo=celdas[3],
+        importe_total_tabla=_clean_and_convert_float(celdas[4]),
+        contrato=celdas[5],
+        cups=celdas[6],
+        secuencial=celdas[7],
+        estado_factura=celdas[8],
+        fraccionamiento=celdas[9],
+        tipo_factura=celdas[10],
+        descarga_selector=pdf_value, 
+    )
+
 def _exportar_log_csv(facturas: list[FacturaEndesaCliente], filepath: str):
     """
     Exporta TODA la metadata y datos detallados de las facturas 
@@ -123,6 +236,7 @@ async def _wait_for_data_load(page: Page, timeout: int = 20000):
 
 # --- LÓGICA DE DESCARGA LOCAL Y EXTRACCIÓN (INALTERADA) ---
 
+@medir_etapa(lambda page, row_locator, factura, doc_type: f"descarga_{doc_type.lower()}", es_fallo=lambda ruta: ruta is None)
 async def _descargar_archivo_fila(page: Page, row_locator: Locator, factura: FacturaEndesaCliente, doc_type: str) -> str | None:
     """
     Intenta descargar un tipo de archivo (PDF, XML) haciendo clic en el botón de la fila
@@ -154,6 +268,8 @@ async def _descargar_archivo_fila(page: Page, row_locator: Locator, factura: Fac
             
         download = await download_info.value
         await download.save_as(save_path)
+        # La URL capturada permite descargar las filas siguientes sin clic
+        DESCARGAS.aprender(doc_type, download.url, factura)
         
         escribir_log(f"    -> [OK] [DESCARGA {doc_type}] Guardado en: {save_path}")
         
@@ -166,52 +282,27 @@ async def _descargar_archivo_fila(page: Page, row_locator: Locator, factura: Fac
         escribir_log(f"   -> [ERROR {doc_type}] Fallo inesperado en la descarga: {e}")
         return None
 
-async def _extraer_pagina_actual(page: Page) -> list[FacturaEndesaCliente]:
+def _rutas_destino(factura: FacturaEndesaCliente) -> dict[str, str]:
+    """Ruta local de cada documento de la factura (misma convención que la descarga por clic)."""
+    return {
+        'XML': os.path.join(DOWNLOAD_FOLDERS['XML'], f"{factura.cups}_{factura.numero_factura}.xml"),
+        'PDF': os.path.join(DOWNLOAD_FOLDERS['PDF'], f"{factura.cups}_{factura.numero_factura}.pdf"),
+    }
+
+async def _procesar_documentos(factura: FacturaEndesaCliente, xml_save_path: str | None, pdf_save_path: str | None) -> FacturaEndesaCliente:
     """
-    Extrae los datos de todas las filas visibles en la página actual de la tabla de resultados.
-    Esta función también activa la descarga local e INTEGRA EL PARSEO XML.
+    Etapa de procesado de una fila ya descargada: parseo XML (pool de procesos) o, si no
+    hay XML, extracción del PDF (capa de texto y, si hace falta, OCR). Corre en segundo plano mientras el navegador
+    sigue con las filas siguientes. Nunca lanza: los fallos quedan marcados en la factura.
     """
-    facturas_pagina: list[FacturaEndesaCliente] = []
-    rows = page.locator('table#example1 tbody tr')
-    row_count = await rows.count()
-    if row_count == 0:
-        return facturas_pagina
-    
-    for i in range(row_count):
-        escribir_log(f"[ROW {i+1}] {'='*40}",mostrar_tiempo=False)
-        row = rows.nth(i)
-        tds = row.locator('td')
+    with contexto_log(cups=factura.cups, numero_factura=factura.numero_factura), DOCUMENTOS_EN_PROCESO.en_curso():
         try:
-            # Extracción de metadata
-            pdf_value = await tds.nth(13).locator('button').get_attribute("value") or ""
-            
-            # 1. Crear instancia de Factura (solo metadata)
-            factura = FacturaEndesaCliente(
-                fecha_emision=await _extraer_texto_de_td(tds.nth(0)),
-                numero_factura=await _extraer_texto_de_td(tds.nth(1)),
-                fecha_inicio_periodo=await _extraer_texto_de_td(tds.nth(2)),
-                fecha_fin_periodo=await _extraer_texto_de_td(tds.nth(3)),
-                importe_total_tabla=_clean_and_convert_float(await _extraer_texto_de_td(tds.nth(4))),
-                contrato=await _extraer_texto_de_td(tds.nth(5)),
-                cups=await _extraer_texto_de_td(tds.nth(6)),
-                secuencial=await _extraer_texto_de_td(tds.nth(7)),
-                estado_factura=await _extraer_texto_de_td(tds.nth(8)),
-                fraccionamiento=await _extraer_texto_de_td(tds.nth(9)),
-                tipo_factura=await _extraer_texto_de_td(tds.nth(10)),
-                descarga_selector=pdf_value, 
-            )    
-            escribir_log(f"    [OK] Datos extariados para fila {i+1}: Factura {factura.numero_factura} ({factura.cups})")
-
-            # 2. Descargar localmente los 2 archivos
-            escribir_log(f"[FILES]")
-            
-            xml_save_path = await _descargar_archivo_fila(page, row, factura, 'XML')
-            pdf_save_path = await _descargar_archivo_fila(page, row, factura, 'PDF')
-            
             # 3. INTEGRACIÓN DEL PARSEO XML: Si el XML se descargó, lo procesamos.
+            exito_parseo = False
             if xml_save_path:
-                escribir_log(f"[XML PROCESSING]")
-                exito_xml = procesar_xml_local(factura, xml_save_path)
+                escribir_log(f"[XML PROCESSING] Factura {factura.numero_factura}")
+                exito_xml = await parsear_xml(factura, xml_save_path)
+                exito_parseo = exito_xml
                 if not exito_xml:
                     escribir_log(f"    -> [ERROR XML] Fallo al extraer datos del XML para factura {factura.numero_factura} ({factura.cups})")
                     factura.error_RPA = True
@@ -220,30 +311,138 @@ async def _extraer_pagina_actual(page: Page) -> list[FacturaEndesaCliente]:
                 escribir_log(f"    -> [ADVERTENCIA XML] No se descargó el XML, omitiendo parseo para factura {factura.numero_factura} ({factura.cups})")
 
             if not xml_save_path and pdf_save_path:
-                
-                escribir_log(f"[PDF OCR]")
-                exito_pdf = procesar_pdf_local(factura, pdf_save_path)
+            
+                escribir_log(f"[PDF PROCESSING] Factura {factura.numero_factura}")
+                exito_pdf = await extraer_pdf(factura, pdf_save_path)
+                exito_parseo = exito_pdf
                 if not exito_pdf:
                     escribir_log(f"    -> [ERROR PDF] Fallo al extraer datos del PDF para factura {factura.numero_factura} ({factura.cups})")
                     factura.error_RPA = True
-                    factura.direccion_suministro += "ERROR_PARSEO: El archivo PDF no contenía datos válidos o estaba incompleto."
-            else:
+                    factura.direccion_suministro = (factura.direccion_suministro or "") + "ERROR_PARSEO: El archivo PDF no contenía datos válidos o estaba incompleto."
+            elif not xml_save_path:
                 factura.error_RPA = True
                 factura.direccion_suministro = "ERROR_DESCARGA: No se pudo descargar ningún archivo (XML/PDF) para esta factura."
+        
+            # 4. Solo las facturas parseadas con éxito entran en el manifiesto
+            if exito_parseo:
+                # Hash de los documentos y entrada del manifiesto en un hilo (fuera del event loop)
+                await asyncio.to_thread(MANIFIESTO.registrar, factura, {'XML': xml_save_path, 'PDF': pdf_save_path})
+
+        except Exception as e:
+            escribir_log(f"[DEBUG_EXTRACTION] Fallo al procesar documentos de la factura {factura.numero_factura}: {e}")
+            factura.error_RPA = True
+            factura.direccion_suministro = f"ERROR_PARSEO: {str(e)[:100]}"
+
+    return factura
+
+async def _extraer_pagina_actual(page: Page, forzar_refresco: bool = False, filtro_cups: set[str] | None = None) -> list[FacturaEndesaCliente | asyncio.Task]:
+    """
+    Extrae los datos de todas las filas visibles en la página actual de la tabla de resultados
+    y descarga sus documentos. El parseo de cada fila se lanza como tarea en segundo plano
+    (ver _procesar_documentos): la lista devuelve, en orden de fila, facturas ya completas
+    o tareas pendientes que 'leer_tabla_facturas' resuelve al final del CUPS.
+    Las facturas ya presentes en el MANIFIESTO se sirven desde él sin descargar
+    (salvo 'forzar_refresco'); solo se actualizan los campos de la tabla.
+    Si el motor DESCARGAS sabe resolver la URL de los documentos, se descargan a la vez
+    sin clics; si no, o si falla, se usa el clic en el botón de la fila.
+    Con 'filtro_cups' (búsqueda por grupo) las filas de otros CUPS se omiten sin descargar.
+    """
+    facturas_pagina: list[FacturaEndesaCliente | asyncio.Task | None] = []
+    # Filas con descarga directa en curso: (posición en facturas_pagina, fila, factura, tarea)
+    directas: list[tuple[int, Locator, FacturaEndesaCliente, asyncio.Task]] = []
+    rows = page.locator('table#example1 tbody tr')
+
+    # Instantánea de toda la página en un viaje; los locators solo se usan para los clics de descarga
+    filas = await _snapshot_tabla(page)
+    row_count = len(filas)
+    if row_count == 0:
+        # La instantánea no ve la tabla (p. ej. dentro de un shadow root): lectura celda a celda
+        filas = None
+        row_count = await rows.count()
+        if row_count == 0:
+            return facturas_pagina
+    
+    for i in range(row_count):
+        escribir_log(f"[ROW {i+1}] {'='*40}",mostrar_tiempo=False)
+        row = rows.nth(i)
+        try:
+            # Extracción de metadata
+            if filas is not None:
+                celdas, pdf_value = filas[i]['celdas'], filas[i]['pdf_value']
+                if len(celdas) < 14:
+                    escribir_log(f"    -> Fila {i+1} sin datos de factura. Omitiendo.")
+                    continue
+            else:
+                celdas, pdf_value = await _leer_fila_locator(row)
             
+            # 1. Crear instancia de Factura (solo metadata)
+            factura = _factura_desde_celdas(celdas, pdf_value)
+            if filtro_cups is not None and clave_cups(factura.cups) not in filtro_cups:
+                continue
+            escribir_log(f"    [OK] Datos extariados para fila {i+1}: Factura {factura.numero_factura} ({factura.cups})")
+
+            # 1b. Factura ya procesada en una llamada anterior: sin clics de descarga ni parseo
+            if not forzar_refresco:
+                # En un hilo: la primera consulta carga el JSON y cada una comprueba los documentos en disco
+                factura_cache = await asyncio.to_thread(MANIFIESTO.obtener, factura.cups, factura.numero_factura)
+                if factura_cache:
+                    facturas_pagina.append(factura_cache.model_copy(
+                        update={campo: getattr(factura, campo) for campo in CAMPOS_TABLA}
+                    ))
+                    escribir_log(f"    -> [MANIFIESTO] Factura {factura.numero_factura} ya procesada. Se omite la descarga.")
+                    continue
 
-            facturas_pagina.append(factura)
+            # 2. Descargar localmente los 2 archivos
+            escribir_log(f"[FILES]")
+
+            # 2a. Vía directa: descargas simultáneas sin clics; se recogen al final de la página
+            if DESCARGAS.puede_descargar_directo(factura):
+                directas.append((len(facturas_pagina), row, factura, asyncio.create_task(
+                    DESCARGAS.descargar_fila(page.context.request, factura, _rutas_destino(factura))
+                )))
+                facturas_pagina.append(None) # se sustituye por la tarea de parseo
+                continue
+            
+            # 2b. Vía por clic (también enseña al motor la URL de descarga)
+            xml_save_path = await _descargar_archivo_fila(page, row, factura, 'XML')
+            pdf_save_path = await _descargar_archivo_fila(page, row, factura, 'PDF')
+            
+            # 3-4. Parseo en segundo plano: el navegador pasa ya a la siguiente fila
+            facturas_pagina.append(asyncio.create_task(
+                _procesar_documentos(factura, xml_save_path, pdf_save_path)
+            ))
             
         except Exception as e:
             escribir_log(f"[DEBUG_EXTRACTION] Fallo al procesar fila {i}: {e}")
             continue
 
+    try:
+        # Descargas directas de la página: los documentos que fallaron se piden por clic
+        # antes de cambiar de página (las filas siguen visibles)
+        for posicion, row, factura, tarea in directas:
+            rutas = await tarea
+            for doc_type in ('XML', 'PDF'):
+                if rutas.get(doc_type) is None:
+                    rutas[doc_type] = await _descargar_archivo_fila(page, row, factura, doc_type)
+            facturas_pagina[posicion] = asyncio.create_task(
+                _procesar_documentos(factura, rutas['XML'], rutas['PDF'])
+            )
+    finally:
+        for _, _, _, tarea in directas:
+            tarea.cancel() # no-op para las ya terminadas
+
     return facturas_pagina
 
-async def leer_tabla_facturas(page: Page) -> list[FacturaEndesaCliente]:
-    """Bucle principal para leer TODAS las páginas de la tabla de resultados."""
-    facturas_totales: list[FacturaEndesaCliente] = []
-    page_num = 1
+async def leer_tabla_facturas(
+    page: Page, forzar_refresco: bool = False, filtro_cups: set[str] | None = None, limite: int | None = None
+) -> list[FacturaEndesaCliente]:
+    """
+    Bucle principal para leer TODAS las páginas de la tabla de resultados.
+    Al terminar espera a que acabe el procesado de documentos lanzado en segundo plano.
+    Con 'limite', si la tabla tiene al menos ese número de filas lanza ResultadosTruncados
+    antes de descargar nada (ver _comprobar_limite).
+    """
+    facturas_totales: list[FacturaEndesaCliente | asyncio.Task] = []
     
     tabla_selector = 'div.style-table.contenedorGeneral table#example1'
     try:
@@ -251,7 +450,81 @@ async def leer_tabla_facturas(page: Page) -> list[FacturaEndesaCliente]:
     except TimeoutError:
         raise Exception("TABLA_NO_CARGADA: El portal no mostró la tabla de facturas.")
     
+    try:
+        filas_vistas = await _recorrer_paginas(page, facturas_totales, forzar_refresco, filtro_cups, limite)
+    except BaseException:
+        # Si la navegación falla no dejamos parseos huérfanos en segundo plano
+        for pendiente in facturas_totales:
+            if isinstance(pendiente, asyncio.Task):
+                pendiente.cancel()
+        raise
+
+    # Unión de las etapas: esperamos los parseos pendientes manteniendo el orden de las filas
+    resultados = [
+        await pendiente if isinstance(pendiente, asyncio.Task) else pendiente
+        for pendiente in facturas_totales
+    ]
+
+    # Persistimos de una vez las facturas nuevas registradas en el manifiesto
+    await asyncio.to_thread(MANIFIESTO.guardar)
+    return resultados
+
+def _total_paginas(texto: str | None) -> int | None:
+    """Número de páginas del indicador de paginación ('Página 1 de 7'), si se reconoce."""
+    coincidencia = re.search(r"de\s+(\d+)", texto or "")
+    return int(coincidencia.group(1)) if coincidencia else None
+
+async def _pulsar_buscar(page: Page):
+    await page.click('button.slds-button_brand:has-text("Buscar")')
+
+async def _comprobar_limite(page: Page, filas_primera: int, limite: int) -> bool:
+    """
+    Comprueba, con la primera página ya cargada y antes de descargar nada, si la tabla llega
+    a 'limite' filas; en ese caso lanza ResultadosTruncados. Si el indicador de paginación no
+    basta para descartarlo se cuentan las filas del resto de páginas y, si no se llega al
+    límite, se repite la búsqueda para volver a la primera página (y devuelve True).
+    """
+    next_button = page.locator('button.pagination-flex-siguiente')
+    if filas_primera >= limite:
+        raise ResultadosTruncados(filas_primera)
+    if await next_button.is_disabled():
+        return False
+    try:
+        paginas = _total_paginas(await page.locator('span.pagination-flex-central').text_content(timeout=2000))
+    except TimeoutError:
+        paginas = None
+    if paginas and paginas * filas_primera < limite:
+        return False
+
+    filas = filas_primera
+    while not await next_button.is_disabled():
+        await next_button.click(timeout=10000)
+        await page.wait_for_timeout(500)
+        try:
+            await _wait_for_data_load(page, timeout=10000)
+        except TimeoutError:
+            pass
+        filas += await page.locator('table#example1 tbody tr').count()
+        if filas >= limite:
+            raise ResultadosTruncados(filas)
+
+    escribir_log(f"[TABLA] {filas} filas (< límite {limite}). Volviendo a la primera página.")
+    await _pulsar_buscar(page)
+    await page.wait_for_timeout(500)
+    return True
+
+async def _recorrer_paginas(
+    page: Page, facturas_totales: list, forzar_refresco: bool,
+    filtro_cups: set[str] | None = None, limite: int | None = None
+) -> int:
+    """
+    Recorre la paginación de la tabla acumulando filas (o parseos pendientes) en 'facturas_totales'.
+    Con 'limite' comprueba el truncado al cargar la primera página, antes de extraer ninguna fila.
+    Devuelve el número de filas vistas en la tabla (incluidas las descartadas por 'filtro_cups').
+    """
     next_button_selector = 'button.pagination-flex-siguiente'
+    page_num = 1
+    filas_vistas = 0
     
     while True:
         try:
@@ -259,7 +532,15 @@ async def leer_tabla_facturas(page: Page) -> list[FacturaEndesaCliente]:
         except TimeoutError:
             escribir_log("Advertencia: Los datos dinámicos no cargaron en el tiempo esperado. Extrayendo datos incompletos.")
             
-        facturas_pagina = await _extraer_pagina_actual(page)
+        filas_pagina = await page.locator('table#example1 tbody tr').count()
+        if limite and page_num == 1:
+            repetida = await _comprobar_limite(page, filas_pagina, limite)
+            limite = None
+            if repetida:
+                continue # nueva búsqueda: se vuelve a esperar la carga de la primera página
+        filas_vistas += filas_pagina
+        FILAS_TABLA.inc(filas_pagina)
+        facturas_pagina = await _extraer_pagina_actual(page, forzar_refresco, filtro_cups)
         
         facturas_totales.extend(facturas_pagina)
         
@@ -276,12 +557,12 @@ async def leer_tabla_facturas(page: Page) -> list[FacturaEndesaCliente]:
         except TimeoutError:
             escribir_log("Error: Fallo al hacer clic en 'SIGUIENTE' (Timeout). Finalizando bucle.")
             break
-            
-    return list(facturas_totales)
+    return filas_vistas
 
 
 # --- FUNCIONES AUXILIARES DE FLUJO (INALTERADAS) ---
 
+@medir_etapa("login", es_fallo=lambda ok: not ok)
 async def _iniciar_sesion(page: Page, username: str, password: str) -> bool:
     """Función interna para manejar la lógica de autenticación en Endesa."""
     
@@ -327,8 +608,87 @@ async def _aceptar_cookies(page: Page):
     except Exception as e:
         escribir_log(f"Error al intentar aceptar las cookies: {e}")
 
-async def realizar_busqueda_facturas(page: Page, grupo_empresarial: str, cups: str, fecha_desde: str, fecha_hasta: str):
-    """Aplica los filtros de búsqueda de forma silenciosa."""
+def _cargar_estado_sesion() -> dict | None:
+    """Devuelve el último estado de sesión conocido (memoria y, si no, disco)."""
+    global _estado_sesion_memoria
+    if _estado_sesion_memoria is not None:
+        return _estado_sesion_memoria
+    try:
+        with open(SESSION_STATE_FILE, "r", encoding="utf-8") as f:
+            _estado_sesion_memoria = json.load(f)
+        escribir_log(f"[SESION] Estado de sesión cargado desde {SESSION_STATE_FILE}.")
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        escribir_log(f"[SESION] No se pudo leer el estado de sesión guardado: {e}")
+        return None
+    return _estado_sesion_memoria
+
+def _guardar_estado_sesion(estado: dict):
+    """Guarda el estado de sesión en memoria y en disco (escritura atómica)."""
+    global _estado_sesion_memoria
+    _estado_sesion_memoria = estado
+    try:
+        os.makedirs(os.path.dirname(SESSION_STATE_FILE), exist_ok=True)
+        tmp_path = SESSION_STATE_FILE + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(estado, f)
+        os.replace(tmp_path, SESSION_STATE_FILE)
+    except Exception as e:
+        escribir_log(f"[SESION] No se pudo guardar el estado de sesión: {e}")
+
+async def _aplicar_estado_sesion(page: Page, estado: dict):
+    """Sustituye las cookies del contexto de la página por las del estado indicado."""
+    await page.context.clear_cookies()
+    await page.context.add_cookies(estado.get("cookies", []))
+
+async def _sesion_activa(page: Page) -> bool:
+    """
+    Sonda barata: abre el buscador de facturas y comprueba que aparece el panel
+    de filtros. Si el portal redirige al login, la sesión ha caducado.
+    """
+    try:
+        await page.goto(URL_BUSQUEDA_FACTURAS, wait_until="domcontentloaded", timeout=SESSION_PROBE_TIMEOUT)
+        if "/login" in page.url:
+            return False
+        await page.wait_for_selector('div.filter-padd-container', timeout=SESSION_PROBE_TIMEOUT)
+        return True
+    except Exception:
+        return False
+
+async def _renovar_sesion(robot: NavegadorAsync) -> dict | None:
+    """
+    Realiza el login completo en un contexto limpio del navegador (con reintentos),
+    acepta las cookies y guarda el nuevo estado de sesión. Devuelve None si falla.
+    """
+    for attempt in range(1, MAX_LOGIN_ATTEMPTS + 1):
+        escribir_log(f"[LOGIN] Intento {attempt}/{MAX_LOGIN_ATTEMPTS}...",pretexto="\n\t")
+        pagina_login = await robot.nueva_pagina()
+        try:
+            await robot.ir_a(pagina_login, URL_LOGIN, 60000, selector='form.slds-form')
+            if await _iniciar_sesion(pagina_login, USER, PASSWORD):
+                escribir_log(f"[LOGIN] Sesión establecida correctamente.")
+                await _aceptar_cookies(pagina_login)
+                estado = await pagina_login.context.storage_state()
+                _guardar_estado_sesion(estado)
+                return estado
+        except Exception as e:
+            escribir_log(f"[ADVERTENCIA] Error durante el intento de login {attempt}: {e}")
+        finally:
+            await pagina_login.context.close()
+
+        escribir_log(f"[ADVERTENCIA] Intento de login {attempt} fallido. Cerrando contexto.")
+        if attempt < MAX_LOGIN_ATTEMPTS:
+            await asyncio.sleep(5)
+    return None
+
+@medir_etapa("busqueda")
+async def realizar_busqueda_facturas(page: Page, grupo_empresarial: str, cups: str | None, fecha_desde: str, fecha_hasta: str, limite: int = TABLE_LIMIT) -> int:
+    """
+    Aplica los filtros de búsqueda de forma silenciosa.
+    Con 'cups' None solo se filtra por grupo empresarial y fechas (búsqueda por grupo).
+    Devuelve el límite de filas que aplicó el portal (puede recortar el pedido al máximo del control).
+    """
     # Eliminamos el log de "INICIO DE BÚSQUEDA" porque ya lo hace la función orquestadora
     
     await page.goto(URL_BUSQUEDA_FACTURAS, wait_until="domcontentloaded")
@@ -340,9 +700,10 @@ async def realizar_busqueda_facturas(page: Page, grupo_empresarial: str, cups: s
     await page.fill('input[placeholder="Buscar"]', grupo_empresarial)
     await page.click(f'span[role="option"] >> text="{grupo_empresarial}"')
 
-    await page.click('button[name="periodo"]:has-text("CUPS20/CUPS22")')
-    await page.fill('input[placeholder="Buscar"]', cups)
-    await page.click(f'span[role="option"] >> text="{cups}"')
+    if cups:
+        await page.click('button[name="periodo"]:has-text("CUPS20/CUPS22")')
+        await page.fill('input[placeholder="Buscar"]', cups)
+        await page.click(f'span[role="option"] >> text="{cups}"')
     
     selector_fecha_desde = page.get_by_label("Desde", exact=True).nth(1)
     selector_fecha_hasta = page.get_by_label("Hasta", exact=True).nth(1)
@@ -350,104 +711,565 @@ async def realizar_busqueda_facturas(page: Page, grupo_empresarial: str, cups: s
     await selector_fecha_hasta.fill(fecha_hasta)
 
     slider_input = page.get_by_label("Limite")
-    await slider_input.fill(str(TABLE_LIMIT)) 
+    await slider_input.fill(str(limite)) 
+    # El control puede tener un máximo menor que el pedido: el truncado se mide con el valor real
+    try:
+        limite_efectivo = int(float(await slider_input.input_value())) or limite
+    except ValueError:
+        limite_efectivo = limite
+    if limite_efectivo != limite:
+        escribir_log(f"    [ADVERTENCIA] El portal limitó la búsqueda a {limite_efectivo} filas (pedidas {limite}).")
     
-    await page.click('button.slds-button_brand:has-text("Buscar")')
+    await _pulsar_buscar(page)
     
     tabla_selector = 'div.style-table.contenedorGeneral table#example1'
     await page.wait_for_selector(tabla_selector, timeout=60000)
     # Solo un log final de confirmación
-    escribir_log(f"    [OK] Filtros Aplicados con éxito para {cups}, desde {fecha_desde} hasta {fecha_hasta}.")
+    escribir_log(f"    [OK] Filtros Aplicados con éxito para {cups or grupo_empresarial}, desde {fecha_desde} hasta {fecha_hasta}.")
+    return limite_efectivo
 
 
 # --------------------------------------------------------------------------------
 # --- FUNCIÓN PRINCIPAL PARA LA API (Acepta Parámetros) ---
 # --------------------------------------------------------------------------------
 
-async def ejecutar_robot_api(lista_cups: list, fecha_desde: str, fecha_hasta: str) -> list[FacturaEndesaCliente]:
+async def _buscar_y_extraer_cups(
+    page: Page, cups_actual: str | None, fecha_desde: str, fecha_hasta: str,
+    forzar_refresco: bool = False, filtro_cups: set[str] | None = None
+) -> list[FacturaEndesaCliente]:
     """
-    Orquesta el proceso batch: realiza un único login y procesa secuencialmente 
-    una lista de CUPS acumulando los resultados.
+    Búsqueda + extracción de un único CUPS (o de todo el grupo si 'cups_actual' es None,
+    conservando solo las filas de 'filtro_cups'). Lanza excepción si el portal falla
+    y ResultadosTruncados si la tabla llega al límite y el rango se puede dividir.
     """
-    robot = NavegadorAsync()
-    facturas_totales = []
-    login_successful = False
+    etiqueta = cups_actual or f"el grupo {GRUPO_EMPRESARIAL}"
+    limite = TABLE_LIMIT if cups_actual else TABLE_LIMIT_GRUPO
+    # Búsqueda y Extracción para el CUPS actual
+    escribir_log(f"[BUSQUEDA]")
+    limite = await realizar_busqueda_facturas(page, GRUPO_EMPRESARIAL, cups_actual, fecha_desde, fecha_hasta, limite=limite)
     
+    escribir_log(f"[EXTRACCIÓN]")
+    # Solo se avisa del límite si el rango aún se puede dividir (más de un día)
+    divisible = _dividir_rango(fecha_desde, fecha_hasta) is not None
     try:
-        # 1. Fase de Autenticación Única
-        escribir_log(f"    [INICIO] Iniciando proceso RPA para {len(lista_cups)} CUPS. \n ",pretexto="\n",mostrar_tiempo=False)
-        escribir_log(f"{'='*40} ",mostrar_tiempo=False)
-        for attempt in range(1, MAX_LOGIN_ATTEMPTS + 1):
-            escribir_log(f"[LOGIN] Intento {attempt}/{MAX_LOGIN_ATTEMPTS}...",pretexto="\n\t")
-            await robot.iniciar()
-            await robot.goto_url(URL_LOGIN)
-            
-            login_successful = await _iniciar_sesion(robot.get_page(), USER, PASSWORD)
-            
-            if login_successful:
-                escribir_log(f"[LOGIN] Sesión establecida correctamente.")
-                break
-            
-            escribir_log(f"[ADVERTENCIA] Intento de login {attempt} fallido. Cerrando contexto.")
-            await robot.cerrar()
-            
-            if attempt < MAX_LOGIN_ATTEMPTS:
-                await asyncio.sleep(5)
-            else:
-                raise Exception(f"Fallo crítico: No se pudo acceder al portal tras {MAX_LOGIN_ATTEMPTS} intentos.")
+        facturas_cups = await leer_tabla_facturas(page, forzar_refresco, filtro_cups, limite if divisible else None)
+    except ResultadosTruncados:
+        escribir_log(f"[LIMITE] La búsqueda de {etiqueta} ({fecha_desde} - {fecha_hasta}) alcanzó el límite de {limite} filas. Se dividirá el rango.")
+        raise
+    if not divisible and len(facturas_cups) >= limite:
+        escribir_log(f"[ADVERTENCIA] La búsqueda de {etiqueta} ({fecha_desde}) alcanzó el límite de {limite} filas en un solo día. Puede haber facturas sin mostrar.")
+    
+    if facturas_cups:
+        escribir_log(f"{'='*80}",mostrar_tiempo=False)
+        escribir_log(f"[OK] {len(facturas_cups)} facturas procesadas con éxito para {etiqueta}.")
+        escribir_log(f"{'='*80}",mostrar_tiempo=False)
+        return facturas_cups
+    
+    escribir_log(f"{'='*80}",mostrar_tiempo=False)
+    escribir_log(f"[INFO] No se encontraron facturas registradas para {etiqueta} en este rango.")
+    escribir_log(f"{'='*80}",mostrar_tiempo=False)
+    return []
 
-        page = robot.get_page()
-        await _aceptar_cookies(page)
-        
-        # 2. Bucle Iterativo de CUPS
-        for index, cups_actual in enumerate(lista_cups, start=1):
-            escribir_log(f"{'='*40}",pretexto="\n",mostrar_tiempo=False)
-            escribir_log(f"PROCESANDO [{index}/{len(lista_cups)}]: CUPS {cups_actual}")
-            escribir_log(f"{'='*80}",mostrar_tiempo=False)
-            
-            try:
-                # Búsqueda y Extracción para el CUPS actual
-                escribir_log(f"[BUSQUEDA]")
-                await realizar_busqueda_facturas(page, GRUPO_EMPRESARIAL, cups_actual, fecha_desde, fecha_hasta)
-                
-                escribir_log(f"[EXTRACCIÓN]")
-                facturas_cups = await leer_tabla_facturas(page)
-                
-                if facturas_cups:
-                    for f in facturas_cups:
-                        f.error_RPA = False  # Añadiremos este campo al modelo
-                    facturas_totales.extend(facturas_cups)
-
-                    # Generamos el CSV individual de este CUPS como respaldo
-                    log_path = LOG_FILE_NAME_TEMPLATE.format(cups=cups_actual)
-                    _exportar_log_csv(facturas_cups, log_path)
-                    escribir_log(f"{'='*80}",mostrar_tiempo=False)
-                    escribir_log(f"[OK] {len(facturas_cups)} facturas procesadas con éxito para {cups_actual}.")
-                    escribir_log(f"{'='*80}",mostrar_tiempo=False)
-                
-                else:
-                    escribir_log(f"{'='*80}",mostrar_tiempo=False)
-                    escribir_log(f"[INFO] No se encontraron facturas registradas para {cups_actual} en este rango.")
-                    escribir_log(f"{'='*80}",mostrar_tiempo=False)
-                    registro_vacio = FacturaEndesaCliente(cups=cups_actual, error_RPA=False, mes_facturado="SIN_FACTURAS",numero_factura="N/A")
-                    facturas_totales.append(registro_vacio)
+async def _procesar_cups(
+    page: Page, cups_actual: str | None, index: int, total: int, fecha_desde: str, fecha_hasta: str,
+    renovar_sesion: Callable[[Page], Awaitable[bool]] | None = None, forzar_refresco: bool = False,
+    filtro_cups: set[str] | None = None
+) -> list[FacturaEndesaCliente]:
+    """
+    Procesa un único CUPS (en un rango de fechas) sobre la página indicada.
+    Con 'cups_actual' None procesa una ventana de la búsqueda por grupo (ver 'filtro_cups').
+    Si falla y la sonda detecta que la sesión ha caducado, la renueva y reintenta una vez.
+    Los fallos se devuelven como un registro con error_RPA=True para que el resto del lote
+    continúe; solo lanza ResultadosTruncados, para que el llamante divida el rango.
+    """
+    etiqueta = cups_actual or f"GRUPO {GRUPO_EMPRESARIAL}"
+    escribir_log(f"{'='*40}",pretexto="\n",mostrar_tiempo=False)
+    escribir_log(f"PROCESANDO [{index}/{total}]: CUPS {etiqueta} ({fecha_desde} - {fecha_hasta})")
+    escribir_log(f"{'='*80}",mostrar_tiempo=False)
+    
+    try:
+        return await _buscar_y_extraer_cups(page, cups_actual, fecha_desde, fecha_hasta, forzar_refresco, filtro_cups)
+    except ResultadosTruncados:
+        raise
+    except Exception as e:
+        error = e
 
+    if renovar_sesion and not await _sesion_activa(page):
+        escribir_log(f"[SESION] Sesión caducada durante el lote. Renovando antes de reintentar {etiqueta}...")
+        if await renovar_sesion(page):
+            try:
+                return await _buscar_y_extraer_cups(page, cups_actual, fecha_desde, fecha_hasta, forzar_refresco, filtro_cups)
+            except ResultadosTruncados:
+                raise
             except Exception as e:
-                # Captura el error específico del CUPS actual pero permite que el bucle siga con el siguiente
-                error_detalle = str(e)
-                escribir_log(f"{'='*80}",mostrar_tiempo=False)
-                escribir_log(f"[ERROR] Fallo al procesar CUPS {cups_actual}. Detalles del error: \n\t\t{error_detalle}")
-                escribir_log(f"{'='*80}",mostrar_tiempo=False)
-
-                registro_error = FacturaEndesaCliente(
-                    cups=cups_actual, 
-                    error_RPA=True,
-                    direccion_suministro=f"ERROR: {error_detalle[:100]}" # Guardamos parte del error
+                error = e
+
+    # Captura el error específico del CUPS actual pero permite que el lote siga con el siguiente
+    error_detalle = str(error)
+    escribir_log(f"{'='*80}",mostrar_tiempo=False)
+    escribir_log(f"[ERROR] Fallo al procesar CUPS {etiqueta}. Detalles del error: \n\t\t{error_detalle}")
+    escribir_log(f"{'='*80}",mostrar_tiempo=False)
+
+    registro_error = FacturaEndesaCliente(
+        cups=cups_actual or GRUPO_EMPRESARIAL, # en modo grupo se reasigna a cada CUPS afectado
+        error_RPA=True,
+        direccion_suministro=f"ERROR: {error_detalle[:100]}" # Guardamos parte del error
+    )
+    escribir_log(f"Continuando con el siguiente código de la lista...")
+    return [registro_error]
+
+async def asegurar_sesion(robot: NavegadorAsync) -> dict:
+    """
+    Deja la página principal de 'robot' autenticada y devuelve el estado de sesión usado.
+    Arranca el navegador si aún no lo está (los del pool ya vienen arrancados),
+    reutiliza la sesión guardada si la sonda la da por válida y si no hace login.
+    """
+    estado_sesion = _cargar_estado_sesion()
+    if not robot.browser:
+        await robot.iniciar(storage_state=estado_sesion)
+    elif estado_sesion:
+        await _aplicar_estado_sesion(robot.get_page(), estado_sesion)
+    page = robot.get_page()
+
+    if estado_sesion and await _sesion_activa(page):
+        escribir_log(f"[SESION] Sesión guardada válida. Se omite el login.")
+        return estado_sesion
+
+    if estado_sesion:
+        escribir_log(f"[SESION] Sesión guardada caducada. Iniciando login...")
+    estado_sesion = await _renovar_sesion(robot)
+    if not estado_sesion:
+        raise Exception(f"Fallo crítico: No se pudo acceder al portal tras {MAX_LOGIN_ATTEMPTS} intentos.")
+    await _aplicar_estado_sesion(page, estado_sesion)
+    return estado_sesion
+
+def _es_factura_real(factura: FacturaEndesaCliente) -> bool:
+    """False para los registros sintéticos de error o de 'SIN_FACTURAS'."""
+    return factura.numero_factura not in (None, "", "N/A")
+
+def _planificar_trabajos(lista_cups: list, fecha_desde: str, fecha_hasta: str, usar_almacen: bool) -> list[tuple[int, str, str, str]]:
+    """
+    Devuelve los trabajos (posición del CUPS, CUPS, desde, hasta) que hay que buscar en el portal.
+    Con el almacén activo, solo los sub-rangos que aún no están cubiertos para cada CUPS.
+    """
+    trabajos = []
+    for posicion, cups_actual in enumerate(lista_cups):
+        if not usar_almacen:
+            trabajos.append((posicion, cups_actual, fecha_desde, fecha_hasta))
+            continue
+        for desde, hasta in ALMACEN.rangos_pendientes(cups_actual, parsear_fecha(fecha_desde), parsear_fecha(fecha_hasta)):
+            trabajos.append((posicion, cups_actual, desde.strftime(FORMATO_FECHA_API), hasta.strftime(FORMATO_FECHA_API)))
+    return trabajos
+
+async def _preparar_paginas(robot: NavegadorAsync, num_workers: int) -> tuple[list[Page], Callable[[Page], Awaitable[bool]]]:
+    """
+    Login único y creación de 'num_workers' páginas que comparten la sesión autenticada.
+    Devuelve las páginas y la función de renovación de sesión a mitad de lote.
+    """
+    # 1. Fase de Autenticación Única (reutilizando la sesión guardada si sigue viva)
+    estado_sesion = await asegurar_sesion(robot)
+    page = robot.get_page()
+
+    # Renovación a mitad de lote: un único worker hace login y el resto reutiliza su estado
+    lock_sesion = asyncio.Lock()
+    sesion_vigente = {"estado": estado_sesion}
+    estado_por_pagina: dict[Page, dict] = {page: estado_sesion}
+
+    async def _renovar_sesion_pagina(pagina: Page) -> bool:
+        async with lock_sesion:
+            if estado_por_pagina.get(pagina) is not sesion_vigente["estado"]:
+                # Otro worker ya renovó la sesión: probamos su estado antes de otro login
+                await _aplicar_estado_sesion(pagina, sesion_vigente["estado"])
+                estado_por_pagina[pagina] = sesion_vigente["estado"]
+                if await _sesion_activa(pagina):
+                    return True
+            nuevo_estado = await _renovar_sesion(robot)
+            if not nuevo_estado:
+                return False
+            sesion_vigente["estado"] = nuevo_estado
+            await _aplicar_estado_sesion(pagina, nuevo_estado)
+            estado_por_pagina[pagina] = nuevo_estado
+            return True
+
+    # 2. Preparación de las páginas de trabajo (una por worker)
+    paginas = [page]
+    if num_workers > 1:
+        # Reutilizamos cookies/localStorage del login para no repetirlo en cada contexto
+        for _ in range(num_workers - 1):
+            pagina_extra = await robot.nueva_pagina(estado_sesion)
+            estado_por_pagina[pagina_extra] = estado_sesion
+            paginas.append(pagina_extra)
+        escribir_log(f"[PARALELO] {num_workers} páginas procesando CUPS en paralelo.")
+    return paginas, _renovar_sesion_pagina
+
+def _dividir_rango(fecha_desde: str, fecha_hasta: str) -> list[tuple[str, str]] | None:
+    """Divide [desde, hasta] en dos mitades disjuntas, o None si es de un solo día (o no es válido)."""
+    desde, hasta = parsear_fecha(fecha_desde), parsear_fecha(fecha_hasta)
+    if not desde or not hasta or desde >= hasta:
+        return None
+    mitad = desde + (hasta - desde) // 2
+    return [
+        (desde.strftime(FORMATO_FECHA_API), mitad.strftime(FORMATO_FECHA_API)),
+        ((mitad + timedelta(days=1)).strftime(FORMATO_FECHA_API), hasta.strftime(FORMATO_FECHA_API)),
+    ]
+
+async def _repartir_cola(paginas: list[Page], elementos: list, procesar: Callable[[Page, object, Callable[[object], None]], Awaitable[None]]):
+    """
+    Reparte 'elementos' entre un worker por página. 'procesar(pagina, elemento, encolar)'
+    puede añadir nuevos elementos con 'encolar' (p. ej. las mitades de un rango truncado),
+    que cualquier página libre toma en paralelo. Termina cuando la cola queda vacía.
+    """
+    cola: asyncio.Queue = asyncio.Queue()
+    for elemento in elementos:
+        cola.put_nowait(elemento)
+
+    async def _worker(pagina_worker: Page):
+        while True:
+            elemento = await cola.get()
+            try:
+                if elemento is None:
+                    return
+                await procesar(pagina_worker, elemento, cola.put_nowait)
+            finally:
+                cola.task_done()
+
+    workers = [asyncio.create_task(_worker(p)) for p in paginas]
+    espera = asyncio.ensure_future(cola.join())
+    try:
+        await asyncio.wait([espera, *workers], return_when=asyncio.FIRST_COMPLETED)
+        for worker in workers:
+            if worker.done() and worker.exception():
+                raise worker.exception()
+        for _ in workers:
+            cola.put_nowait(None)
+        await asyncio.gather(*workers)
+    finally:
+        espera.cancel()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(espera, *workers, return_exceptions=True)
+
+async def _ejecutar_trabajos(
+    robot: NavegadorAsync, trabajos: list[tuple[int, str, str, str]],
+    paralelismo: int, forzar_refresco: bool,
+    al_terminar_cups: Callable[[int, list[tuple[tuple[int, str, str, str], list[FacturaEndesaCliente]]]], None],
+    progreso: Callable[[str, str], None] | None = None
+):
+    """
+    Fase de navegador (búsqueda por CUPS): login único y reparto de los trabajos entre
+    'paralelismo' páginas que comparten la sesión autenticada.
+    Si una búsqueda llega a TABLE_LIMIT, su rango se divide en dos trabajos nuevos
+    (recursivamente) que se reparten entre las páginas libres.
+    En cuanto terminan todos los trabajos de un CUPS se invoca
+    'al_terminar_cups(posicion, [(trabajo, facturas), ...])', sin esperar al resto del lote.
+    'progreso(cups, "en_curso")' se invoca al empezar cada CUPS.
+    """
+    # Con un solo trabajo dejamos una segunda página para las mitades de un posible rango truncado
+    paginas, _renovar_sesion_pagina = await _preparar_paginas(robot, max(1, min(paralelismo, max(len(trabajos), 2))))
+
+    # Trabajos que le quedan a cada CUPS (por posición) y resultados acumulados
+    restantes: dict[int, int] = {}
+    for posicion, *_ in trabajos:
+        restantes[posicion] = restantes.get(posicion, 0) + 1
+    resultados_cups: dict[int, list] = {posicion: [] for posicion in restantes}
+    iniciados: set[int] = set()
+    contador = {"total": len(trabajos), "index": 0}
+
+    async def _procesar_trabajo(pagina_worker: Page, trabajo: tuple[int, str, str, str], encolar: Callable):
+        posicion, cups_actual, desde, hasta = trabajo
+        if progreso and posicion not in iniciados:
+            progreso(cups_actual, "en_curso")
+        iniciados.add(posicion)
+        contador["index"] += 1
+        try:
+            with contexto_log(cups=cups_actual):
+                facturas = await _procesar_cups(
+                    pagina_worker, cups_actual, contador["index"], contador["total"], desde, hasta,
+                    renovar_sesion=_renovar_sesion_pagina, forzar_refresco=forzar_refresco
                 )
-                facturas_totales.append(registro_error)
+        except ResultadosTruncados:
+            # El trabajo se sustituye por sus dos mitades
+            for sub_desde, sub_hasta in _dividir_rango(desde, hasta):
+                restantes[posicion] += 1
+                contador["total"] += 1
+                encolar((posicion, cups_actual, sub_desde, sub_hasta))
+            restantes[posicion] -= 1
+            return
+        resultados_cups[posicion].append((trabajo, facturas))
+        restantes[posicion] -= 1
+        if restantes[posicion] == 0:
+            al_terminar_cups(posicion, resultados_cups.pop(posicion))
 
-                escribir_log(f"Continuando con el siguiente código de la lista...")
-                continue
+    await _repartir_cola(paginas, list(trabajos), _procesar_trabajo)
+
+def _ventanas_grupo(trabajos: list[tuple[int, str, str, str]]) -> list[tuple[date, date, list[int]]]:
+    """
+    Divide el rango total de los trabajos en ventanas de VENTANA_GRUPO_DIAS días.
+    Devuelve (desde, hasta, índices de los trabajos que solapan) solo para las ventanas con trabajo.
+    """
+    rangos = [(parsear_fecha(t[2]), parsear_fecha(t[3])) for t in trabajos]
+    inicio, fin = min(d for d, _ in rangos), max(h for _, h in rangos)
+    ventanas = []
+    cursor = inicio
+    while cursor <= fin:
+        v_hasta = min(cursor + timedelta(days=VENTANA_GRUPO_DIAS - 1), fin)
+        solapados = [i for i, (d, h) in enumerate(rangos) if d <= v_hasta and h >= cursor]
+        if solapados:
+            ventanas.append((cursor, v_hasta, solapados))
+        cursor = v_hasta + timedelta(days=1)
+    return ventanas
+
+def _solapados(trabajos: list[tuple[int, str, str, str]], candidatos: list[int], desde: date, hasta: date) -> list[int]:
+    """Índices de 'candidatos' cuyo rango de fechas solapa con [desde, hasta]."""
+    return [i for i in candidatos if parsear_fecha(trabajos[i][2]) <= hasta and parsear_fecha(trabajos[i][3]) >= desde]
+
+async def _ejecutar_trabajos_grupo(
+    robot: NavegadorAsync, trabajos: list[tuple[int, str, str, str]],
+    paralelismo: int, forzar_refresco: bool,
+    al_terminar_cups: Callable[[int, list[tuple[tuple[int, str, str, str], list[FacturaEndesaCliente]]]], None],
+    progreso: Callable[[str, str], None] | None = None
+):
+    """
+    Fase de navegador (búsqueda por grupo): una búsqueda por ventana de fechas con solo el
+    filtro del grupo empresarial. Las filas se reparten por la columna CUPS entre los
+    trabajos pedidos (las de otros CUPS no se descargan) y, por fecha de emisión, entre
+    sus rangos. Las ventanas que llegan al límite de la tabla (TABLE_LIMIT_GRUPO, o el máximo
+    que acepte el control del portal si es menor) se dividen en dos.
+    Mismo contrato de 'al_terminar_cups' y 'progreso' que _ejecutar_trabajos.
+    """
+    ventanas = _ventanas_grupo(trabajos)
+    escribir_log(f"[GRUPO] Búsqueda por grupo: {len(ventanas)} ventana(s) para {len(trabajos)} trabajo(s).")
+    paginas, _renovar_sesion_pagina = await _preparar_paginas(robot, max(1, min(paralelismo, max(len(ventanas), 2))))
+
+    # Ventanas pendientes por trabajo, trabajos pendientes por CUPS y resultados acumulados
+    ventanas_restantes = [0] * len(trabajos)
+    for _, _, solapados in ventanas:
+        for i in solapados:
+            ventanas_restantes[i] += 1
+    resultados_trabajo: list[dict[str, FacturaEndesaCliente]] = [{} for _ in trabajos]
+    errores_trabajo: list[list[FacturaEndesaCliente]] = [[] for _ in trabajos]
+    trabajos_restantes: dict[int, int] = {}
+    for posicion, *_ in trabajos:
+        trabajos_restantes[posicion] = trabajos_restantes.get(posicion, 0) + 1
+    en_curso: set[int] = set()
+    contador = {"total": len(ventanas), "index": 0}
+
+    def _repartir(solapados: list[int], facturas: list[FacturaEndesaCliente]):
+        errores = [f for f in facturas if not _es_factura_real(f) and f.error_RPA]
+        for i in solapados:
+            posicion, cups_actual, t_desde, t_hasta = trabajos[i]
+            d, h = parsear_fecha(t_desde), parsear_fecha(t_hasta)
+            for f in facturas:
+                if not _es_factura_real(f) or clave_cups(f.cups) != clave_cups(cups_actual):
+                    continue
+                emision = parsear_fecha(f.fecha_emision)
+                if emision is None or d <= emision <= h:
+                    resultados_trabajo[i][f.numero_factura] = f
+            # Un fallo de la ventana deja incompletos todos sus trabajos
+            errores_trabajo[i].extend(e.model_copy(update={'cups': cups_actual}) for e in errores)
+
+            ventanas_restantes[i] -= 1
+            if ventanas_restantes[i] == 0:
+                trabajos_restantes[posicion] -= 1
+                if trabajos_restantes[posicion] == 0:
+                    al_terminar_cups(posicion, [
+                        (trabajos[j], list(resultados_trabajo[j].values()) + errores_trabajo[j])
+                        for j in range(len(trabajos)) if trabajos[j][0] == posicion
+                    ])
+
+    async def _procesar_ventana(pagina_worker: Page, ventana: tuple[date, date, list[int]], encolar: Callable):
+        v_desde, v_hasta, solapados = ventana
+        if progreso:
+            for i in solapados:
+                if trabajos[i][0] not in en_curso:
+                    en_curso.add(trabajos[i][0])
+                    progreso(trabajos[i][1], "en_curso")
+        contador["index"] += 1
+        desde_str, hasta_str = v_desde.strftime(FORMATO_FECHA_API), v_hasta.strftime(FORMATO_FECHA_API)
+        try:
+            facturas = await _procesar_cups(
+                pagina_worker, None, contador["index"], contador["total"], desde_str, hasta_str,
+                renovar_sesion=_renovar_sesion_pagina, forzar_refresco=forzar_refresco,
+                filtro_cups={clave_cups(trabajos[i][1]) for i in solapados}
+            )
+        except ResultadosTruncados:
+            # La ventana se sustituye por sus mitades (cada trabajo espera a las que solapa)
+            for sub_desde, sub_hasta in _dividir_rango(desde_str, hasta_str):
+                d, h = parsear_fecha(sub_desde), parsear_fecha(sub_hasta)
+                sub_solapados = _solapados(trabajos, solapados, d, h)
+                if sub_solapados:
+                    for i in sub_solapados:
+                        ventanas_restantes[i] += 1
+                    contador["total"] += 1
+                    encolar((d, h, sub_solapados))
+            for i in solapados:
+                ventanas_restantes[i] -= 1
+            return
+        _repartir(solapados, facturas)
+
+    await _repartir_cola(paginas, ventanas, _procesar_ventana)
+
+async def _ejecutar_trabajos_con_navegador(
+    trabajos: list[tuple[int, str, str, str]], paralelismo: int,
+    forzar_refresco: bool, pool: PoolNavegadores | None,
+    al_terminar_cups: Callable[[int, list], None],
+    progreso: Callable[[str, str], None] | None = None
+):
+    """
+    Ejecuta los trabajos con un navegador del pool (si hay) o con uno propio que se cierra al final.
+    Con UMBRAL_BUSQUEDA_GRUPO o más CUPS pendientes se usa la búsqueda por grupo.
+    """
+    num_cups = len({t[0] for t in trabajos})
+    fechas_validas = all(parsear_fecha(t[2]) and parsear_fecha(t[3]) for t in trabajos)
+    ejecutar = _ejecutar_trabajos_grupo if num_cups >= UMBRAL_BUSQUEDA_GRUPO and fechas_validas else _ejecutar_trabajos
+    escribir_log(f"[BUSQUEDA] Modo {'por grupo' if ejecutar is _ejecutar_trabajos_grupo else 'por CUPS'} para {num_cups} CUPS.")
+    async with (pool.prestar() if pool else nullcontext()) as robot_prestado:
+        robot = robot_prestado or NavegadorAsync()
+        try:
+            await ejecutar(robot, trabajos, paralelismo, forzar_refresco, al_terminar_cups, progreso)
+        finally:
+            if robot_prestado:
+                # Navegador del pool: solo liberamos las páginas extra de los workers
+                await robot.cerrar_contextos_extra()
+            elif robot.browser:
+                # El cierre del navegador ocurre una sola vez al terminar todos los CUPS o por error fatal
+                await robot.cerrar()
+                escribir_log("[SISTEMA] Navegador cerrado y recursos liberados.\n\n")
+
+async def _combinar_cups(
+    cups_actual: str, resultados_trabajos: list[tuple[tuple[int, str, str, str], list[FacturaEndesaCliente]]],
+    desde: date | None, hasta: date | None, usar_almacen: bool
+) -> list[FacturaEndesaCliente]:
+    """
+    Resultado final de un CUPS: guarda lo extraído en el almacén, marca los rangos cubiertos
+    y lo combina con lo ya almacenado. Devuelve al menos un registro (error o 'SIN_FACTURAS').
+    Las operaciones del almacén (SQLite), el dataset Parquet y el CSV de respaldo se ejecutan en hilos.
+    """
+    extraidas: list[FacturaEndesaCliente] = []
+    for (_, _, t_desde, t_hasta), resultado in resultados_trabajos:
+        extraidas.extend(resultado)
+        if usar_almacen:
+            await asyncio.to_thread(ALMACEN.guardar_facturas, resultado)
+            # Un rango solo queda cubierto si su búsqueda terminó sin errores
+            if not any(f.error_RPA for f in resultado):
+                await asyncio.to_thread(ALMACEN.marcar_cubierto, cups_actual, parsear_fecha(t_desde), parsear_fecha(t_hasta))
+
+    # Los rangos divididos por el límite de la tabla pueden repetir facturas: una por número
+    facturas_cups = list({f.numero_factura: f for f in extraidas if _es_factura_real(f)}.values())
+    # Dataset Parquet consolidado (solo lo procesado ahora, no lo que viene del almacén)
+    if EXPORTADOR.activo:
+        await asyncio.to_thread(EXPORTADOR.anadir, facturas_cups)
+    if usar_almacen:
+        nuevas = {f.numero_factura for f in facturas_cups}
+        almacenadas = await asyncio.to_thread(ALMACEN.consultar, cups_actual, desde, hasta)
+        facturas_cups = ordenar_por_emision(
+            facturas_cups + [f for f in almacenadas if f.numero_factura not in nuevas]
+        )
+    errores_cups = [f for f in extraidas if not _es_factura_real(f) and f.error_RPA]
+
+    if facturas_cups:
+        # Generamos el CSV individual de este CUPS como respaldo
+        log_path = LOG_FILE_NAME_TEMPLATE.format(cups=cups_actual)
+        await asyncio.to_thread(_exportar_log_csv, facturas_cups, log_path)
+    elif not errores_cups:
+        registro_vacio = FacturaEndesaCliente(cups=cups_actual, error_RPA=False, mes_facturado="SIN_FACTURAS",numero_factura="N/A")
+        facturas_cups = [registro_vacio]
+    return facturas_cups + errores_cups
+
+async def iterar_robot_api(
+    lista_cups: list, fecha_desde: str, fecha_hasta: str,
+    paralelismo: int = NUM_WORKERS_PARALELOS, pool: PoolNavegadores | None = None,
+    forzar_refresco: bool = False, usar_almacen: bool = True,
+    progreso: Callable[[str, str], None] | None = None
+) -> AsyncIterator[tuple[int, str, list[FacturaEndesaCliente]]]:
+    """
+    Núcleo del robot como generador asíncrono: produce (posición, cups, facturas)
+    para cada CUPS en cuanto termina, en orden de finalización.
+    1. Consulta el ALMACEN y calcula, por CUPS, los sub-rangos de fechas aún no cubiertos.
+       Los CUPS ya cubiertos se producen de inmediato sin abrir el navegador.
+    2. Si queda algo pendiente abre el navegador, hace un único login y reparte
+       esos trabajos entre 'paralelismo' páginas que comparten la sesión autenticada.
+    3. Guarda lo nuevo en el almacén y lo combina con lo ya almacenado.
+    Si se pasa 'pool', el navegador se toma prestado de él solo cuando hace falta.
+    Con 'forzar_refresco' se ignoran el manifiesto y el almacén y se vuelve a descargar todo.
+    'progreso(cups, estado)' permite seguir el avance por CUPS (lo usa la API de tareas).
+    """
+    desde, hasta = parsear_fecha(fecha_desde), parsear_fecha(fecha_hasta)
+    usar_almacen = usar_almacen and desde is not None and hasta is not None
+
+    # 1. Planificación contra el histórico local
+    trabajos = await asyncio.to_thread(
+        _planificar_trabajos, lista_cups, fecha_desde, fecha_hasta, usar_almacen and not forzar_refresco
+    )
+    posiciones_pendientes = {t[0] for t in trabajos}
+
+    for posicion, cups_actual in enumerate(lista_cups):
+        if posicion not in posiciones_pendientes:
+            # Los CUPS sin nada pendiente en el portal ya están completos
+            if progreso:
+                progreso(cups_actual, "completado")
+            yield posicion, cups_actual, await _combinar_cups(cups_actual, [], desde, hasta, usar_almacen)
+
+    if not trabajos:
+        escribir_log(f"[ALMACEN] Todos los rangos ya están cubiertos localmente. No se abre el navegador.")
+        return
+
+    # 2. Fase de navegador en segundo plano; cada CUPS terminado llega por la cola
+    escribir_log(f"[ALMACEN] {len(trabajos)} búsqueda(s) pendiente(s) en el portal para {len(posiciones_pendientes)} CUPS.")
+    terminados: asyncio.Queue = asyncio.Queue()
+    tarea_navegador = asyncio.create_task(_ejecutar_trabajos_con_navegador(
+        trabajos, paralelismo, forzar_refresco, pool,
+        al_terminar_cups=lambda posicion, resultados: terminados.put_nowait((posicion, resultados)),
+        progreso=progreso
+    ))
+    try:
+        for _ in range(len(posiciones_pendientes)):
+            espera = asyncio.ensure_future(terminados.get())
+            await asyncio.wait({espera, tarea_navegador}, return_when=asyncio.FIRST_COMPLETED)
+            if not espera.done():
+                # El navegador terminó (o falló) sin entregar más CUPS
+                espera.cancel()
+                await tarea_navegador
+                raise Exception("La fase de navegador terminó sin procesar todos los CUPS.")
+
+            # 3. Combinación con el almacén y entrega inmediata
+            posicion, resultados = espera.result()
+            cups_actual = lista_cups[posicion]
+            facturas_cups = await _combinar_cups(cups_actual, resultados, desde, hasta, usar_almacen)
+            if progreso:
+                progreso(cups_actual, "error" if any(f.error_RPA for f in facturas_cups) else "completado")
+            yield posicion, cups_actual, facturas_cups
+        await tarea_navegador
+    finally:
+        # Si el consumidor abandona el generador (p. ej. cliente desconectado) paramos el navegador
+        if not tarea_navegador.done():
+            tarea_navegador.cancel()
+            await asyncio.gather(tarea_navegador, return_exceptions=True)
+
+async def ejecutar_robot_api(
+    lista_cups: list, fecha_desde: str, fecha_hasta: str,
+    paralelismo: int = NUM_WORKERS_PARALELOS, pool: PoolNavegadores | None = None,
+    forzar_refresco: bool = False, usar_almacen: bool = True,
+    progreso: Callable[[str, str], None] | None = None
+) -> list[FacturaEndesaCliente]:
+    """
+    Orquesta el proceso batch completo sobre 'iterar_robot_api' y devuelve todas
+    las facturas juntas, en el mismo orden que 'lista_cups'.
+    """
+    resultados_por_cups: list[list[FacturaEndesaCliente]] = [[] for _ in lista_cups]
+    
+    try:
+        escribir_log(f"    [INICIO] Iniciando proceso RPA para {len(lista_cups)} CUPS. \n ",pretexto="\n",mostrar_tiempo=False)
+        escribir_log(f"{'='*40} ",mostrar_tiempo=False)
+
+        async for posicion, _, facturas_cups in iterar_robot_api(
+            lista_cups, fecha_desde, fecha_hasta, paralelismo=paralelismo, pool=pool,
+            forzar_refresco=forzar_refresco, usar_almacen=usar_almacen, progreso=progreso
+        ):
+            resultados_por_cups[posicion] = facturas_cups
+
+        # Reensamblado por CUPS en el orden de entrada
+        facturas_totales = [f for facturas_cups in resultados_por_cups for f in facturas_cups]
 
         escribir_log(f"{'='*80}",pretexto="\n\n",mostrar_tiempo=False)
         escribir_log(f"[OK][FIN] Proceso RPA completado para todos los CUPS.\n\t\tTotal facturas extraídas: {len(facturas_totales)}")
@@ -457,24 +1279,22 @@ async def ejecutar_robot_api(lista_cups: list, fecha_desde: str, fecha_hasta: st
     except Exception as e:
         escribir_log(f"🛑 FALLO CRÍTICO EN EL ROBOT: {e}")
         raise e
-    finally:
-        # El cierre del navegador ocurre una sola vez al terminar todos los CUPS o por error fatal
-        if hasattr(robot, 'browser') and robot.browser:
-            await robot.cerrar()
-            escribir_log("[SISTEMA] Navegador cerrado y recursos liberados.\n\n")
 
 # --------------------------------------------------------------------------------
 # --- NUEVA FUNCIÓN PARA LA SEGUNDA LLAMADA API (ACCESO A PDF LOCAL - SÍNCRONA) ---
 # --------------------------------------------------------------------------------
 
+def ruta_documento_local(cups: str, numero_factura: str, doc_type: str = 'PDF') -> str:
+    """Ruta en disco del documento (PDF/XML) descargado de una factura (exista o no)."""
+    return os.path.join(DOWNLOAD_FOLDERS[doc_type], f"{cups}_{numero_factura}.{doc_type.lower()}")
+
 def obtener_pdf_local_base64(cups: str, numero_factura: str) -> dict:
     """
     Lee un archivo PDF local. Si no existe, en lugar de dar error, 
     devuelve un mensaje informativo en el campo de base64.
     """
-    target_folder = DOWNLOAD_FOLDERS['PDF']
-    filename = f"{cups}_{numero_factura}.pdf"
-    file_path = os.path.join(target_folder, filename)
+    file_path = ruta_documento_local(cups, numero_factura, 'PDF')
+    filename = os.path.basename(file_path)
     
     # Preparamos la respuesta base
     respuesta = {
@@ -0,0 +1,182 @@
+import asyncio
+import os
+import sqlite3
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Iterator
+from datetime import date, datetime, timedelta
+from modelos_datos import FacturaEndesaCliente, EstadoSincronizacion
+from almacen_facturas import DB_PATH, clave_cups, parsear_fecha, FORMATO_FECHA_API
+from logs import escribir_log
+
+# Minutos entre sincronizaciones automáticas (0 = solo bajo demanda con POST /sync/run)
+SYNC_INTERVALO_MIN = max(0, int(os.environ.get("ENDESA_SYNC_INTERVALO_MIN", "1440")))
+# Días hacia atrás que se buscan la primera vez para un CUPS registrado sin marca
+SYNC_DIAS_INICIALES = max(1, int(os.environ.get("ENDESA_SYNC_DIAS_INICIALES", "365")))
+
+
+class RegistroSincronizacion:
+    """
+    CUPS registrados para la sincronización incremental, con su marca de agua:
+    la fecha de emisión más reciente vista para ese CUPS. Vive en la misma base
+    de datos que el almacén de facturas (tabla 'sincronizacion').
+    """
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._conectar() as con:
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS sincronizacion (
+                    cups TEXT PRIMARY KEY,
+                    marca TEXT,
+                    desde_inicial TEXT NOT NULL,
+                    registrado TEXT NOT NULL,
+                    ultima_sync TEXT,
+                    ultimo_error TEXT
+                )
+            """)
+
+    @contextmanager
+    def _conectar(self) -> Iterator[sqlite3.Connection]:
+        con = sqlite3.connect(self.db_path)
+        con.row_factory = sqlite3.Row
+        try:
+            with con: # commit / rollback
+                yield con
+        finally:
+            con.close()
+
+    def registrar(self, cups: str, desde: date | None = None):
+        """Da de alta un CUPS (sin tocar su marca si ya estaba registrado)."""
+        desde = desde or date.today() - timedelta(days=SYNC_DIAS_INICIALES)
+        with self._conectar() as con:
+            con.execute(
+                "INSERT OR IGNORE INTO sincronizacion (cups, desde_inicial, registrado) VALUES (?, ?, ?)",
+                (cups, desde.isoformat(), datetime.now().isoformat(timespec="seconds")),
+            )
+
+    def eliminar(self, cups: str) -> bool:
+        with self._conectar() as con:
+            return con.execute("DELETE FROM sincronizacion WHERE cups = ?", (cups,)).rowcount > 0
+
+    def listar(self) -> list[EstadoSincronizacion]:
+        with self._conectar() as con:
+            filas = con.execute("SELECT * FROM sincronizacion ORDER BY cups").fetchall()
+        return [EstadoSincronizacion(**dict(fila)) for fila in filas]
+
+    def inicio_pendiente(self, estado: EstadoSincronizacion) -> date:
+        """Primer día a buscar: el de la marca (incluido, pueden emitirse más facturas ese día) o el inicial."""
+        return date.fromisoformat(estado.marca or estado.desde_inicial)
+
+    def actualizar(self, cups: str, marca: date | None, error: str | None = None):
+        """Guarda el resultado de una sincronización. La marca nunca retrocede."""
+        with self._conectar() as con:
+            fila = con.execute("SELECT marca FROM sincronizacion WHERE cups = ?", (cups,)).fetchone()
+            if fila is None:
+                return # dado de baja mientras se sincronizaba
+            actual = date.fromisoformat(fila["marca"]) if fila["marca"] else None
+            if marca is None or (actual and actual > marca):
+                marca = actual
+            con.execute(
+                "UPDATE sincronizacion SET marca = ?, ultima_sync = ?, ultimo_error = ? WHERE cups = ?",
+                (marca.isoformat() if marca else None, datetime.now().isoformat(timespec="seconds"), error, cups),
+            )
+
+
+class PlanificadorSincronizacion:
+    """
+    Sincronización incremental en segundo plano de los CUPS registrados.
+    Cada 'intervalo_min' minutos (o al llamar a 'lanzar') busca para cada CUPS las facturas
+    desde su marca de agua hasta hoy con 'ejecutar' (robotEndesa.ejecutar_robot_api), que las
+    guarda en el almacén. Así las consultas de la API sobre esos CUPS se sirven del almacén.
+    Todos los CUPS van en un único lote desde la marca más antigua: el almacén ya recorta,
+    por CUPS, los rangos cubiertos en sincronizaciones anteriores.
+    Una marca solo avanza si su CUPS terminó sin errores.
+    """
+    def __init__(
+        self, ejecutar: Callable[..., Awaitable[list[FacturaEndesaCliente]]],
+        registro: RegistroSincronizacion | None = None,
+        intervalo_min: int = SYNC_INTERVALO_MIN, **parametros
+    ):
+        self._ejecutar = ejecutar
+        self.registro = registro or RegistroSincronizacion()
+        self.intervalo_min = intervalo_min
+        self._parametros = parametros # p. ej. pool=... (se pasan tal cual a 'ejecutar')
+        self._lock = asyncio.Lock()
+        self._despertar = asyncio.Event()
+        self._tarea: asyncio.Task | None = None
+        self.ultima_ejecucion: str | None = None
+        self.proxima_ejecucion: str | None = None
+
+    async def iniciar(self):
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def cerrar(self):
+        if self._tarea:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+    def lanzar(self):
+        """Adelanta la siguiente sincronización (no espera a que termine)."""
+        self._despertar.set()
+
+    def en_curso(self) -> bool:
+        return self._lock.locked()
+
+    async def _bucle(self):
+        while True:
+            # Con intervalo 0 solo se sincroniza bajo demanda
+            espera = self.intervalo_min * 60 if self.intervalo_min else None
+            self.proxima_ejecucion = (
+                (datetime.now() + timedelta(seconds=espera)).isoformat(timespec="seconds") if espera else None
+            )
+            try:
+                await asyncio.wait_for(self._despertar.wait(), timeout=espera)
+            except asyncio.TimeoutError:
+                pass
+            self._despertar.clear()
+            try:
+                await self.sincronizar()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                escribir_log(f"[SYNC] ERROR en la sincronización: {e}")
+
+    async def sincronizar(self) -> dict[str, int]:
+        """Una pasada sobre todos los CUPS registrados. Devuelve las facturas nuevas por CUPS."""
+        async with self._lock:
+            # SQLite en hilos: el lock lo comparte /sync/run y no debe bloquear el event loop
+            estados = await asyncio.to_thread(self.registro.listar)
+            if not estados:
+                return {}
+            self.ultima_ejecucion = datetime.now().isoformat(timespec="seconds")
+            hoy = date.today()
+            inicios = {e.cups: self.registro.inicio_pendiente(e) for e in estados}
+            desde = min(inicios.values())
+            escribir_log(f"[SYNC] Sincronizando {len(estados)} CUPS desde {desde.strftime(FORMATO_FECHA_API)}.")
+
+            facturas = await self._ejecutar(
+                lista_cups=[e.cups for e in estados],
+                fecha_desde=desde.strftime(FORMATO_FECHA_API),
+                fecha_hasta=hoy.strftime(FORMATO_FECHA_API),
+                **self._parametros
+            )
+
+            nuevas: dict[str, int] = {}
+            for estado in estados:
+                # Las facturas llevan el CUPS del portal (puede ser el CUPS22 del registrado)
+                propias = [f for f in facturas if clave_cups(f.cups) == clave_cups(estado.cups)]
+                errores = [f.direccion_suministro or "Error RPA" for f in propias if f.error_RPA]
+                emisiones = [
+                    parsear_fecha(f.fecha_emision) for f in propias
+                    if not f.error_RPA and f.numero_factura not in (None, "", "N/A")
+                ]
+                emisiones = [e for e in emisiones if e]
+                nuevas[estado.cups] = sum(1 for e in emisiones if e >= inicios[estado.cups])
+                if errores:
+                    # Sin avanzar la marca: la siguiente pasada vuelve a cubrir el hueco
+                    await asyncio.to_thread(self.registro.actualizar, estado.cups, None, error=errores[0])
+                else:
+                    await asyncio.to_thread(self.registro.actualizar, estado.cups, max(emisiones, default=None))
+            escribir_log(f"[SYNC] Sincronización terminada: {sum(nuevas.values())} factura(s) desde las marcas.")
+            return nuevas
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable
+from modelos_datos import FacturaEndesaCliente, EstadoTarea
+from logs import escribir_log, contexto_log
+
+# Número de tareas que se ejecutan a la vez y tiempo (s) que se conservan los resultados terminados
+TAREAS_WORKERS = max(1, int(os.environ.get("ENDESA_TAREAS_WORKERS", "1")))
+TAREAS_TTL = int(os.environ.get("ENDESA_TAREAS_TTL", "3600"))
+
+
+class Tarea:
+    """Una ejecución del robot encolada desde la API, con su progreso por CUPS y su resultado."""
+    def __init__(self, parametros: dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.parametros = parametros
+        self.estado = "pendiente"
+        self.creada = datetime.now().isoformat(timespec="seconds")
+        self.iniciada: str | None = None
+        self.finalizada: str | None = None
+        self.progreso: dict[str, str] = {cups: "pendiente" for cups in parametros["lista_cups"]}
+        self.resultado: list[FacturaEndesaCliente] | None = None
+        self.error: str | None = None
+        # Reloj monotónico del fin de la tarea, para la caducidad
+        self._fin_monotonic: float | None = None
+
+    def marcar_finalizada(self):
+        self.finalizada = datetime.now().isoformat(timespec="seconds")
+        self._fin_monotonic = time.monotonic()
+
+    def actualizar_progreso(self, cups: str, estado: str):
+        self.progreso[cups] = estado
+
+    def terminada(self) -> bool:
+        return self.estado in ("completada", "fallida")
+
+    def caducada(self, ttl: int) -> bool:
+        return self._fin_monotonic is not None and time.monotonic() - self._fin_monotonic > ttl
+
+    def a_estado(self) -> EstadoTarea:
+        return EstadoTarea(
+            id=self.id,
+            estado=self.estado,
+            creada=self.creada,
+            iniciada=self.iniciada,
+            finalizada=self.finalizada,
+            total_cups=len(self.progreso),
+            cups_terminados=sum(1 for e in self.progreso.values() if e in ("completado", "error")),
+            progreso=dict(self.progreso),
+            num_facturas=len(self.resultado) if self.resultado is not None else None,
+            error=self.error,
+        )
+
+
+class GestorTareas:
+    """
+    Cola de tareas de extracción ejecutadas en segundo plano por 'num_workers' workers.
+    'ejecutar' es la función del robot (robotEndesa.ejecutar_robot_api); recibe los
+    parámetros de la tarea más el callback 'progreso'. Los resultados terminados se
+    conservan 'ttl' segundos y después se eliminan.
+    """
+    def __init__(self, ejecutar: Callable[..., Awaitable[list[FacturaEndesaCliente]]], num_workers: int = TAREAS_WORKERS, ttl: int = TAREAS_TTL):
+        self._ejecutar = ejecutar
+        self.num_workers = num_workers
+        self.ttl = ttl
+        self._tareas: dict[str, Tarea] = {}
+        self._cola: asyncio.Queue[Tarea] = asyncio.Queue()
+        self._workers: list[asyncio.Task] = []
+
+    async def iniciar(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+
+    async def cerrar(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def encolar(self, **parametros) -> Tarea:
+        """Registra una nueva tarea y la pone en cola. Devuelve inmediatamente."""
+        self._purgar()
+        tarea = Tarea(parametros)
+        self._tareas[tarea.id] = tarea
+        self._cola.put_nowait(tarea)
+        escribir_log(f"[TAREAS] Tarea {tarea.id} encolada ({len(tarea.progreso)} CUPS). En cola: {self._cola.qsize()}")
+        return tarea
+
+    def en_cola(self) -> int:
+        """Tareas encoladas que aún no ha tomado ningún worker."""
+        return self._cola.qsize()
+
+    def obtener(self, tarea_id: str) -> Tarea | None:
+        self._purgar()
+        return self._tareas.get(tarea_id)
+
+    def _purgar(self):
+        """Elimina las tareas terminadas cuyo TTL ha expirado."""
+        for tarea_id in [t.id for t in self._tareas.values() if t.caducada(self.ttl)]:
+            del self._tareas[tarea_id]
+
+    async def _worker(self):
+        while True:
+            tarea = await self._cola.get()
+            tarea.estado = "en_curso"
+            tarea.iniciada = datetime.now().isoformat(timespec="seconds")
+            escribir_log(f"[TAREAS] Iniciando tarea {tarea.id}")
+            try:
+                with contexto_log(tarea=tarea.id):
+                    tarea.resultado = await self._ejecutar(**tarea.parametros, progreso=tarea.actualizar_progreso)
+                tarea.estado = "completada"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                tarea.estado = "fallida"
+                tarea.error = str(e)
+                escribir_log(f"[TAREAS] ERROR en tarea {tarea.id}: {e}")
+            finally:
+                tarea.marcar_finalizada()
+                self._cola.task_done()
+            escribir_log(f"[TAREAS] Tarea {tarea.id} {tarea.estado}.")
+            self._purgar()
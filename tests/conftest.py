@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+# Los módulos leen la configuración (ENDESA_*) y crean sus carpetas relativas al importarse:
+# las pruebas trabajan en un directorio temporal para no tocar logs/, datos/ ni las descargas reales.
+_TRABAJO = tempfile.mkdtemp(prefix="pruebas_endesa_")
+os.environ.setdefault("ENDESA_LOG_PATH", os.path.join(_TRABAJO, "logs", "log.txt"))
+os.environ.setdefault("ENDESA_DB_PATH", os.path.join(_TRABAJO, "datos", "facturas.db"))
+os.environ.setdefault("ENDESA_CACHE_OCR_PATH", os.path.join(_TRABAJO, "datos", "cache_ocr.db"))
+os.environ.setdefault("ENDESA_EXPORT_PARQUET", "0")
+os.chdir(_TRABAJO)
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
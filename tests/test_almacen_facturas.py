@@ -0,0 +1,60 @@
+from datetime import date, timedelta
+
+from almacen_facturas import AlmacenFacturas, clave_cups
+from modelos_datos import FacturaEndesaCliente
+
+CUPS_PEDIDO = "ES0031405000000001AB"
+CUPS_PORTAL = "es0031405000000001ab0F" # CUPS22 tal como lo muestra la tabla del portal
+
+
+def _factura(numero: str, emision: str, cups: str = CUPS_PORTAL) -> FacturaEndesaCliente:
+    return FacturaEndesaCliente(cups=cups, numero_factura=numero, fecha_emision=emision)
+
+
+def test_clave_cups():
+    assert clave_cups(CUPS_PORTAL) == CUPS_PEDIDO
+    assert clave_cups(f"  {CUPS_PEDIDO} ") == CUPS_PEDIDO
+    assert clave_cups(None) == ""
+
+
+def test_consulta_con_cups_del_portal_distinto_del_pedido(tmp_path):
+    almacen = AlmacenFacturas(str(tmp_path / "facturas.db"))
+    almacen.guardar_facturas([_factura("F1", "15/01/2024"), _factura("F2", "15/02/2024")])
+    almacen.marcar_cubierto(CUPS_PEDIDO, date(2024, 1, 1), date(2024, 2, 29))
+
+    facturas = almacen.consultar(CUPS_PEDIDO, date(2024, 1, 1), date(2024, 2, 29))
+    assert [f.numero_factura for f in facturas] == ["F2", "F1"]
+    # Se devuelven tal como vinieron del portal
+    assert {f.cups for f in facturas} == {CUPS_PORTAL}
+    assert almacen.rangos_pendientes(CUPS_PORTAL, date(2024, 1, 1), date(2024, 2, 29)) == []
+    assert [f.numero_factura for lote in almacen.iterar_lotes([CUPS_PEDIDO]) for f in lote] == ["F1", "F2"]
+
+
+def test_rangos_pendientes_y_fusion(tmp_path):
+    almacen = AlmacenFacturas(str(tmp_path / "facturas.db"))
+    almacen.marcar_cubierto(CUPS_PEDIDO, date(2024, 1, 1), date(2024, 1, 31))
+    almacen.marcar_cubierto(CUPS_PEDIDO, date(2024, 3, 1), date(2024, 3, 31))
+    assert almacen.rangos_pendientes(CUPS_PEDIDO, date(2024, 1, 1), date(2024, 4, 15)) == [
+        (date(2024, 2, 1), date(2024, 2, 29)), (date(2024, 4, 1), date(2024, 4, 15)),
+    ]
+    almacen.marcar_cubierto(CUPS_PEDIDO, date(2024, 2, 1), date(2024, 2, 29))
+    assert almacen.rangos_pendientes(CUPS_PEDIDO, date(2024, 1, 1), date(2024, 3, 31)) == []
+
+
+def test_no_se_marca_hoy(tmp_path):
+    almacen = AlmacenFacturas(str(tmp_path / "facturas.db"))
+    hoy = date.today()
+    almacen.marcar_cubierto(CUPS_PEDIDO, hoy - timedelta(days=10), hoy)
+    assert almacen.rangos_pendientes(CUPS_PEDIDO, hoy - timedelta(days=10), hoy) == [(hoy, hoy)]
+
+
+def test_migra_claves_antiguas(tmp_path):
+    ruta = str(tmp_path / "facturas.db")
+    almacen = AlmacenFacturas(ruta)
+    with almacen._conectar() as con:
+        con.execute(
+            "INSERT INTO facturas VALUES (?, ?, ?, NULL, NULL, ?, '2024-01-01T00:00:00')",
+            (CUPS_PORTAL, "F1", "2024-01-15", _factura("F1", "15/01/2024").model_dump_json()),
+        )
+    facturas = AlmacenFacturas(ruta).consultar(CUPS_PEDIDO, date(2024, 1, 1), date(2024, 1, 31))
+    assert [f.numero_factura for f in facturas] == ["F1"]
@@ -0,0 +1,67 @@
+import asyncio
+
+import descargas
+from descargas import MAX_FALLOS_DIRECTOS, MotorDescargas
+from modelos_datos import FacturaEndesaCliente
+
+URL_XML = "https://portal.test/documentos/xml?id=F0000001"
+
+
+class RespuestaFalsa:
+    def __init__(self, status: int, cuerpo: bytes):
+        self.status = status
+        self.ok = status < 400
+        self._cuerpo = cuerpo
+
+    async def body(self) -> bytes:
+        return self._cuerpo
+
+    async def dispose(self):
+        pass
+
+
+class RequestFalso:
+    """APIRequestContext mínimo: responde siempre con el mismo estado y cuerpo."""
+    def __init__(self, status: int = 200, cuerpo: bytes = b"<Facturae/>"):
+        self.status, self.cuerpo = status, cuerpo
+
+    async def get(self, url: str, timeout: float) -> RespuestaFalsa:
+        return RespuestaFalsa(self.status, self.cuerpo)
+
+
+def _factura(numero: str) -> FacturaEndesaCliente:
+    return FacturaEndesaCliente(cups="ES0031405000000001AB", numero_factura=numero)
+
+
+def test_enfriamiento_tras_fallos_seguidos(tmp_path, monkeypatch):
+    reloj = [1000.0]
+    monkeypatch.setattr(descargas.time, "monotonic", lambda: reloj[0])
+    monkeypatch.setattr(descargas, "ENFRIAMIENTO_DIRECTAS_S", 60)
+    motor = MotorDescargas()
+    motor.aprender("XML", URL_XML, _factura("F0000001"))
+    destino = str(tmp_path / "F.xml")
+
+    async def fallar():
+        for _ in range(MAX_FALLOS_DIRECTOS):
+            assert not await motor.descargar(RequestFalso(status=500), "XML", motor.resolver_url("XML", _factura("F0000002")), destino)
+    asyncio.run(fallar())
+
+    # Desactivada durante el enfriamiento, con la plantilla olvidada
+    assert motor.resolver_url("XML", _factura("F0000002")) is None
+    motor.aprender("XML", URL_XML.replace("F0000001", "F0000003"), _factura("F0000003"))
+    reloj[0] += 30
+    assert motor.resolver_url("XML", _factura("F0000004")) is None
+
+    # Pasado el enfriamiento se vuelve a intentar con la URL aprendida del último clic
+    reloj[0] += 31
+    url = motor.resolver_url("XML", _factura("F0000004"))
+    assert url == URL_XML.replace("F0000001", "F0000004")
+    assert asyncio.run(motor.descargar(RequestFalso(), "XML", url, destino))
+    assert (tmp_path / "F.xml").read_bytes() == b"<Facturae/>"
+
+
+def test_descarta_pagina_de_login(tmp_path):
+    motor = MotorDescargas()
+    ok = asyncio.run(motor.descargar(RequestFalso(cuerpo=b"<!DOCTYPE html><html>"), "PDF", "https://x/doc.pdf", str(tmp_path / "F.pdf")))
+    assert not ok
+    assert not (tmp_path / "F.pdf").exists()
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+import exportacion
+from exportacion import ExportadorParquet
+from modelos_datos import FacturaEndesaCliente
+
+CUPS_A = "ES0031405000000001AB"
+CUPS_B = "ES0031405000000002CD"
+
+
+def _factura(numero: str, emision: str, cups: str = CUPS_A, importe: float = 10.5) -> FacturaEndesaCliente:
+    return FacturaEndesaCliente(
+        cups=cups, numero_factura=numero, fecha_emision=emision, importe_facturado=importe, num_dias=31,
+    )
+
+
+def _ficheros(ruta) -> list[str]:
+    return sorted(f for f in os.listdir(ruta) if f.endswith(".parquet"))
+
+
+def test_columnas_tipadas_y_particiones(tmp_path):
+    exportador = ExportadorParquet(str(tmp_path), activo=True)
+    escritas = exportador.anadir([
+        _factura("F1", "15/01/2024"),
+        _factura("F2", "03/03/2024", cups=CUPS_B),
+        FacturaEndesaCliente(cups=CUPS_A, error_RPA=True), # los registros de error no se exportan
+    ])
+
+    assert escritas == 2
+    assert _ficheros(tmp_path / "mes=2024-01" / f"cups={CUPS_A}")
+    assert _ficheros(tmp_path / "mes=2024-03" / f"cups={CUPS_B}")
+
+    tabla = pq.read_table(str(tmp_path))
+    assert tabla.num_rows == 2
+    assert tabla.schema.field("importe_facturado").type == pa.float64()
+    assert tabla.schema.field("num_dias").type == pa.int64()
+    assert tabla.schema.field("fecha_emision").type == pa.date32()
+    assert tabla.schema.field("error_RPA").type == pa.bool_()
+    assert sorted(tabla.column("numero_factura").to_pylist()) == ["F1", "F2"]
+
+
+def test_compactacion_conserva_la_version_mas_reciente(tmp_path, monkeypatch):
+    monkeypatch.setattr(exportacion, "EXPORT_COMPACTAR", 3)
+    exportador = ExportadorParquet(str(tmp_path), activo=True)
+    particion = tmp_path / "mes=2024-01" / f"cups={CUPS_A}"
+
+    exportador.anadir([_factura("F1", "15/01/2024", importe=1.0), _factura("F2", "20/01/2024")])
+    exportador.anadir([_factura("F1", "15/01/2024", importe=2.0)])
+    assert len(_ficheros(particion)) == 2
+
+    exportador.anadir([_factura("F1", "15/01/2024", importe=3.0)]) # tercer fichero: se compacta
+    assert len(_ficheros(particion)) == 1
+    filas = {f["numero_factura"]: f for f in pq.read_table(str(particion)).to_pylist()}
+    assert set(filas) == {"F1", "F2"}
+    assert filas["F1"]["importe_facturado"] == 3.0
+
+
+def test_inactivo_no_escribe(tmp_path):
+    exportador = ExportadorParquet(str(tmp_path / "export"), activo=False)
+    assert exportador.anadir([_factura("F1", "15/01/2024")]) == 0
+    assert not (tmp_path / "export").exists()
@@ -0,0 +1,202 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import pdf_parser
+from cache_ocr import CacheOCR
+from modelos_datos import FacturaEndesaCliente
+from pdf_parser import MotorOCR
+
+DATOS_OCR = {"tarifa": "3.0TD", "importe_facturado": 123.45, "potencia_p1": 15.0, "fecha_emision": "15/01/2024"}
+
+
+class ServidorOpenAIFalso:
+    """
+    Stub local de la API de OpenAI (solo lo que usa MotorOCR: subir, borrar y /responses).
+    'fallos' es la lista de respuestas 429 que se devuelven antes de la buena; cada una con
+    su cabecera Retry-After (o None). Anota las peticiones y la concurrencia máxima de /responses.
+    """
+    def __init__(self, fallos: list[str | None] | None = None, demora: float = 0.0):
+        self.fallos = list(fallos or [])
+        self.demora = demora
+        self.peticiones: list[str] = []
+        self.en_curso = 0
+        self.max_en_curso = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _responder(self, codigo: int, cuerpo: dict, cabeceras: dict | None = None):
+                datos = json.dumps(cuerpo).encode()
+                self.send_response(codigo)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(datos)))
+                for clave, valor in (cabeceras or {}).items():
+                    self.send_header(clave, valor)
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stub._lock:
+                    stub.peticiones.append(f"POST {self.path}")
+                if self.path.endswith("/files"):
+                    return self._responder(200, {
+                        "id": "file-1", "object": "file", "bytes": 1, "created_at": 0,
+                        "filename": "factura.pdf", "purpose": "assistants", "status": "processed",
+                    })
+                with stub._lock:
+                    fallo = stub.fallos.pop(0) if stub.fallos else False
+                    stub.en_curso += 1
+                    stub.max_en_curso = max(stub.max_en_curso, stub.en_curso)
+                try:
+                    time.sleep(stub.demora)
+                finally:
+                    with stub._lock:
+                        stub.en_curso -= 1
+                if fallo is not False:
+                    cabeceras = {"Retry-After": fallo} if fallo is not None else {}
+                    return self._responder(429, {"error": {"message": "Rate limit", "type": "requests"}}, cabeceras)
+                self._responder(200, {
+                    "id": "resp-1", "object": "response", "created_at": 0, "model": "gpt-4o", "status": "completed",
+                    "output": [{
+                        "id": "msg-1", "type": "message", "role": "assistant", "status": "completed",
+                        "content": [{"type": "output_text", "text": json.dumps(DATOS_OCR), "annotations": []}],
+                    }],
+                })
+
+            def do_DELETE(self):
+                with stub._lock:
+                    stub.peticiones.append(f"DELETE {self.path}")
+                self._responder(200, {"id": "file-1", "object": "file", "deleted": True})
+
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", 0), Manejador)
+        self.base_url = f"http://127.0.0.1:{self._servidor.server_address[1]}/v1"
+        threading.Thread(target=self._servidor.serve_forever, daemon=True).start()
+
+    def cerrar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def llamadas(self, ruta: str) -> int:
+        return sum(1 for p in self.peticiones if p.endswith(ruta))
+
+
+@pytest.fixture
+def esperas(monkeypatch) -> list[float]:
+    """Esperas del backoff: se anotan sin dormir y sin el componente aleatorio."""
+    anotadas: list[float] = []
+    dormir = asyncio.sleep
+
+    async def sleep_anotado(segundos, *args, **kwargs):
+        anotadas.append(segundos)
+        await dormir(0)
+
+    monkeypatch.setattr(pdf_parser.asyncio, "sleep", sleep_anotado)
+    monkeypatch.setattr(pdf_parser.random, "uniform", lambda a, b: 0.0)
+    return anotadas
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    def crear(nombre: str = "factura.pdf", contenido: bytes = b"%PDF-1.4 factura") -> str:
+        ruta = tmp_path / nombre
+        ruta.write_bytes(contenido)
+        return str(ruta)
+    return crear
+
+
+@pytest.fixture
+def motor(tmp_path):
+    """MotorOCR apuntado al stub (base_url), con un prompt de prueba."""
+    ruta_prompt = tmp_path / "prompt.txt"
+    ruta_prompt.write_text("Extrae los datos de la factura.", encoding="utf-8")
+
+    def crear(servidor: ServidorOpenAIFalso, **kwargs) -> MotorOCR:
+        return MotorOCR(api_key="sk-prueba", base_url=servidor.base_url, prompt_path=str(ruta_prompt), **kwargs)
+    return crear
+
+
+def test_reintenta_429_con_backoff_exponencial(esperas, pdf, motor):
+    servidor = ServidorOpenAIFalso(fallos=[None, None])
+    try:
+        factura = FacturaEndesaCliente(cups="ES0031405000000001AB", numero_factura="F1")
+        ok = asyncio.run(motor(servidor, espera_base=0.5, max_reintentos=3).procesar(factura, pdf()))
+    finally:
+        servidor.cerrar()
+
+    assert ok
+    assert servidor.llamadas("/responses") == 3
+    assert esperas == [0.5, 1.0]
+    assert (factura.tarifa, factura.importe_facturado, factura.potencia_p1) == ("3.0TD", 123.45, 15.0)
+    assert factura.origen_datos == "PDF_OCR"
+    # El archivo subido se borra al terminar
+    assert servidor.llamadas("/files/file-1") == 1
+
+
+def test_respeta_retry_after(esperas, pdf, motor):
+    servidor = ServidorOpenAIFalso(fallos=["7"])
+    try:
+        factura = FacturaEndesaCliente(cups="ES0031405000000001AB", numero_factura="F1")
+        ok = asyncio.run(motor(servidor, espera_base=0.5).procesar(factura, pdf()))
+    finally:
+        servidor.cerrar()
+
+    assert ok
+    assert esperas == [7.0]
+
+
+def test_agota_reintentos(esperas, pdf, motor):
+    servidor = ServidorOpenAIFalso(fallos=[None] * 5)
+    try:
+        factura = FacturaEndesaCliente(cups="ES0031405000000001AB", numero_factura="F1")
+        ok = asyncio.run(motor(servidor, espera_base=0.5, max_reintentos=2).procesar(factura, pdf()))
+    finally:
+        servidor.cerrar()
+
+    assert not ok
+    assert servidor.llamadas("/responses") == 3
+    assert esperas == [0.5, 1.0]
+    assert factura.tarifa in (None, "N/A")
+
+
+def test_concurrencia_limitada_por_el_semaforo(pdf, motor):
+    servidor = ServidorOpenAIFalso(demora=0.1)
+    try:
+        documentos = [
+            (FacturaEndesaCliente(cups="ES0031405000000001AB", numero_factura=f"F{i}"), pdf(f"f{i}.pdf", f"%PDF-1.4 {i}".encode()))
+            for i in range(6)
+        ]
+        resultados = asyncio.run(motor(servidor, max_concurrentes=2).procesar_lote(documentos))
+    finally:
+        servidor.cerrar()
+
+    assert resultados == [True] * 6
+    assert servidor.llamadas("/responses") == 6
+    assert servidor.max_en_curso == 2
+
+
+def test_cache_evita_la_llamada(tmp_path, pdf, motor):
+    servidor = ServidorOpenAIFalso()
+    motor_cache = motor(servidor, cache=CacheOCR(str(tmp_path / "cache_ocr.db")))
+    primera = FacturaEndesaCliente(cups="ES0031405000000001AB", numero_factura="F1")
+    segunda = FacturaEndesaCliente(cups="ES0031405000000001AB", numero_factura="F1")
+
+    async def dos_veces():
+        return await motor_cache.procesar(primera, pdf()), await motor_cache.procesar(segunda, pdf())
+    try:
+        assert asyncio.run(dos_veces()) == (True, True)
+    finally:
+        servidor.cerrar()
+
+    assert servidor.llamadas("/responses") == 1
+    assert servidor.llamadas("/files") == 1
+    assert (primera.origen_datos, segunda.origen_datos) == ("PDF_OCR", "PDF_OCR_CACHE")
+    assert segunda.importe_facturado == 123.45
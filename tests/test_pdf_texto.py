@@ -0,0 +1,175 @@
+import asyncio
+
+import pytest
+
+import pipeline_documentos
+import pdf_texto
+from modelos_datos import FacturaEndesaCliente
+from pdf_texto import procesar_pdf_texto
+
+pytest.importorskip("pypdf")
+
+# Capa de texto de una factura 3.0TD con los seis periodos (variantes de etiqueta incluidas)
+LINEAS_FACTURA = [
+    "Factura electrónica Endesa Energía",
+    "Tarifa de acceso: 3.0 TD",
+    "Dirección de suministro: CALLE MAYOR 1, 28001 MADRID",
+    "Potencia facturada P1 4,600 kW x 31 días 10,50",
+    "Potencia facturada P2 4,600 kW x 31 días 2,30",
+    "Potencia facturada P3 4,600 kW x 31 días 1,00",
+    "Pot. P4 15 kW x 31 días 4,00",
+    "Potencia Periodo 5 15 kW x 31 días 3,20",
+    "Potencia P6 15 kW x 31 días 5,00",
+    "Consumo P1 120 kWh x 0,166667 €/kWh 20,00",
+    "Consumo P2 80,5 kWh 10,25",
+    "Consumo P3 200 kWh 15,75",
+    "Energía activa P4 1.234 kWh 5,00",
+    "Consumo Periodo 5 50 kWh 6,00",
+    "Consumo P6 30 kWh 3,00",
+    "Impuesto sobre la Electricidad 5,11269632% 4,40",
+    "Alquiler del contador 31 días x 0,026630 €/día 0,83",
+    "Financiación Bono Social 0,40",
+    "Base imponible 91,63",
+    "IVA 21% s/ 91,63 19,24",
+    "Total importe factura 110,87",
+    "Fecha límite de pago: 25/02/2024",
+    "Fecha de cargo en cuenta: 26-02-2024",
+]
+
+
+def _pdf_con_texto(lineas: list[str]) -> bytes:
+    """PDF mínimo de una página con 'lineas' como capa de texto (Helvetica, WinAnsi)."""
+    def literal(texto: str) -> bytes:
+        return b"(" + texto.encode("cp1252").replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+    contenido = b"BT /F1 9 Tf 40 800 Td 12 TL " + b" ".join(literal(l) + b" Tj T*" for l in lineas) + b" ET"
+    objetos = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(contenido) + contenido + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    pdf = b"%PDF-1.4\n"
+    posiciones = []
+    for i, objeto in enumerate(objetos, start=1):
+        posiciones.append(len(pdf))
+        pdf += b"%d 0 obj\n" % i + objeto + b"\nendobj\n"
+    inicio_xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objetos) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % p for p in posiciones)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objetos) + 1, inicio_xref)
+    return pdf
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    def crear(lineas: list[str], nombre: str = "factura.pdf") -> str:
+        ruta = tmp_path / nombre
+        ruta.write_bytes(_pdf_con_texto(lineas))
+        return str(ruta)
+    return crear
+
+
+def _factura(**campos) -> FacturaEndesaCliente:
+    return FacturaEndesaCliente(cups="ES0031405000000001AB", numero_factura="F1", **campos)
+
+
+def _sin(lineas: list[str], prefijo: str) -> list[str]:
+    return [l for l in lineas if not l.startswith(prefijo)]
+
+
+def test_extrae_la_plantilla_completa(pdf):
+    factura = _factura(importe_total_tabla=110.87)
+    assert procesar_pdf_texto(factura, pdf(LINEAS_FACTURA))
+
+    assert factura.origen_datos == "PDF_TEXTO"
+    assert factura.tarifa == "3.0TD"
+    assert factura.direccion_suministro == "CALLE MAYOR 1, 28001 MADRID"
+    assert [getattr(factura, f"potencia_p{i}") for i in range(1, 7)] == [10.5, 2.3, 1.0, 4.0, 3.2, 5.0]
+    assert [getattr(factura, f"importe_consumo_p{i}") for i in range(1, 7)] == [20.0, 10.25, 15.75, 5.0, 6.0, 3.0]
+    assert [getattr(factura, f"consumo_kw_p{i}") for i in range(1, 7)] == [120.0, 80.5, 200.0, 1234.0, 50.0, 30.0]
+    assert factura.importe_de_potencia == 26.0
+    assert factura.importe_consumo == 60.0
+    assert factura.kw_totales == 1714.5
+    assert factura.importe_impuesto_electrico == 4.4
+    assert factura.importe_alquiler_equipos == 0.83
+    assert factura.importe_bono_social == 0.4
+    assert factura.num_dias == 31
+    assert factura.importe_base_imponible == 91.63
+    assert factura.importe_facturado == 110.87
+    assert factura.importe_total_final == 110.87 # sin línea "Total a pagar": el total de la factura
+    assert factura.fecha_de_vencimiento == "25/02/2024"
+    assert factura.fecha_de_cobro_en_banco == "26/02/2024"
+
+
+@pytest.mark.parametrize("lineas, motivo", [
+    (_sin(LINEAS_FACTURA, "Base imponible"), "sin base imponible"),
+    (_sin(LINEAS_FACTURA, "Tarifa"), "sin tarifa"),
+    ([l.replace("kWh", "") for l in LINEAS_FACTURA], "sin consumos en kWh"),
+    ([l.replace("Base imponible 91,63", "Base imponible 50,00") for l in LINEAS_FACTURA], "términos mayores que la base"),
+    ([l.replace("Total importe factura 110,87", "Total importe factura 80,00") for l in LINEAS_FACTURA], "total menor que la base"),
+])
+def test_incompleta_o_inconsistente_no_modifica_la_factura(pdf, lineas, motivo):
+    factura = _factura()
+    original = factura.model_dump()
+    assert not procesar_pdf_texto(factura, pdf(lineas)), motivo
+    # Se valida sobre un borrador: la factura llega intacta al OCR
+    assert factura.model_dump() == original
+
+
+def test_total_distinto_del_de_la_tabla(pdf):
+    factura = _factura(importe_total_tabla=99.99)
+    assert not procesar_pdf_texto(factura, pdf(LINEAS_FACTURA))
+    assert factura.importe_facturado != 110.87
+
+
+def test_pdf_sin_capa_de_texto(pdf):
+    factura = _factura()
+    assert not procesar_pdf_texto(factura, pdf([]))
+    assert factura.origen_datos is None
+
+
+class MotorOCRFalso:
+    """Sustituto de MOTOR_OCR: anota las llamadas y rellena la factura como lo haría el LLM."""
+    def __init__(self):
+        self.llamadas: list[str] = []
+
+    async def procesar(self, factura: FacturaEndesaCliente, ruta_pdf: str) -> bool:
+        self.llamadas.append(ruta_pdf)
+        factura.tarifa = "2.0TD"
+        factura.origen_datos = "PDF_OCR"
+        return True
+
+
+@pytest.fixture
+def ocr(monkeypatch) -> MotorOCRFalso:
+    motor = MotorOCRFalso()
+    monkeypatch.setattr(pipeline_documentos, "MOTOR_OCR", motor)
+    monkeypatch.setattr(pipeline_documentos, "MAX_PROCESOS_XML", 0) # en un hilo, sin pool de procesos
+    return motor
+
+
+def test_via_capa_de_texto_sin_llm(pdf, ocr):
+    factura = _factura()
+    assert asyncio.run(pipeline_documentos.extraer_pdf(factura, pdf(LINEAS_FACTURA)))
+    assert factura.origen_datos == "PDF_TEXTO"
+    assert ocr.llamadas == []
+
+
+def test_incompleta_pasa_al_llm(pdf, ocr):
+    factura = _factura()
+    ruta = pdf(_sin(LINEAS_FACTURA, "Total importe factura"))
+    assert asyncio.run(pipeline_documentos.extraer_pdf(factura, ruta))
+    assert ocr.llamadas == [ruta]
+    assert factura.origen_datos == "PDF_OCR"
+    # El LLM parte de la factura sin los datos parciales de la plantilla
+    assert factura.importe_de_potencia == 0.0
+
+
+def test_sin_pypdf_pasa_al_llm(pdf, ocr, monkeypatch):
+    monkeypatch.setattr(pdf_texto, "PdfReader", None)
+    factura = _factura()
+    assert asyncio.run(pipeline_documentos.extraer_pdf(factura, pdf(LINEAS_FACTURA)))
+    assert factura.origen_datos == "PDF_OCR"
+    assert len(ocr.llamadas) == 1
@@ -0,0 +1,39 @@
+import asyncio
+
+import pool_navegadores
+from pool_navegadores import PoolNavegadores
+
+
+class NavegadorFalso:
+    def __init__(self):
+        self.cerrado = False
+
+    def esta_sano(self) -> bool:
+        return not self.cerrado
+
+    async def cerrar(self):
+        self.cerrado = True
+
+
+async def _preparar(robot):
+    pass
+
+
+def test_prestamo_sin_libres_usa_navegador_temporal(monkeypatch):
+    monkeypatch.setattr(pool_navegadores, "NavegadorAsync", NavegadorFalso)
+
+    async def escenario():
+        pool = PoolNavegadores(1, _preparar, espera_s=0.05)
+        await pool.iniciar()
+        async with pool.prestar() as primero:
+            assert isinstance(primero, NavegadorFalso)
+            # El único navegador está prestado: la segunda petición no se queda esperando
+            async with pool.prestar() as segundo:
+                assert segundo is None
+        # Devuelto al terminar: vuelve a estar disponible
+        assert pool.libres() == 1
+        async with pool.prestar() as tercero:
+            assert tercero is primero
+        await pool.cerrar()
+
+    asyncio.run(asyncio.wait_for(escenario(), timeout=5))
@@ -0,0 +1,129 @@
+import os
+from email.utils import formatdate
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from respuesta_archivo import responder_archivo
+
+CONTENIDO = bytes(range(256)) * 4 # 1024 bytes
+
+
+@pytest.fixture
+def archivos(tmp_path) -> dict[str, str]:
+    rutas = {"factura.pdf": tmp_path / "factura.pdf", "vacio.pdf": tmp_path / "vacio.pdf"}
+    rutas["factura.pdf"].write_bytes(CONTENIDO)
+    rutas["vacio.pdf"].write_bytes(b"")
+    return {nombre: str(ruta) for nombre, ruta in rutas.items()}
+
+
+@pytest.fixture
+def cliente(archivos) -> TestClient:
+    app = FastAPI()
+
+    @app.api_route("/archivo/{nombre}", methods=["GET", "HEAD"])
+    async def archivo(nombre: str, request: Request):
+        return await responder_archivo(request, archivos[nombre], "application/pdf", nombre)
+
+    return TestClient(app)
+
+
+def test_completo(cliente):
+    r = cliente.get("/archivo/factura.pdf")
+    assert r.status_code == 200
+    assert r.content == CONTENIDO
+    assert r.headers["content-length"] == "1024"
+    assert r.headers["accept-ranges"] == "bytes"
+    assert r.headers["content-disposition"] == 'inline; filename="factura.pdf"'
+    assert r.headers["etag"].startswith('"') and len(r.headers["etag"]) == 66 # SHA-256 entre comillas
+    assert "last-modified" in r.headers
+
+
+def test_head_sin_cuerpo(cliente):
+    r = cliente.head("/archivo/factura.pdf")
+    assert r.status_code == 200
+    assert r.headers["content-length"] == "1024"
+    assert r.content == b""
+
+
+@pytest.mark.parametrize("rango, inicio, fin", [
+    ("bytes=0-99", 0, 99),
+    ("bytes=1000-", 1000, 1023), # abierto hasta el final
+    ("bytes=-24", 1000, 1023), # sufijo: los últimos 24 bytes
+    ("bytes=-5000", 0, 1023), # sufijo mayor que el archivo
+    ("bytes=1000-9999", 1000, 1023), # el fin se recorta al tamaño
+])
+def test_rango(cliente, rango, inicio, fin):
+    r = cliente.get("/archivo/factura.pdf", headers={"Range": rango})
+    assert r.status_code == 206
+    assert r.headers["content-range"] == f"bytes {inicio}-{fin}/1024"
+    assert r.headers["content-length"] == str(fin - inicio + 1)
+    assert r.content == CONTENIDO[inicio:fin + 1]
+
+
+@pytest.mark.parametrize("rango", ["bytes=1024-", "bytes=5000-6000", "bytes=-0"])
+def test_rango_no_satisfacible(cliente, rango):
+    r = cliente.get("/archivo/factura.pdf", headers={"Range": rango})
+    assert r.status_code == 416
+    assert r.headers["content-range"] == "bytes */1024"
+
+
+@pytest.mark.parametrize("rango", ["bytes=0-10,20-30", "items=0-10", "bytes=50-10", "bytes=abc"])
+def test_rango_no_soportado_envia_completo(cliente, rango):
+    r = cliente.get("/archivo/factura.pdf", headers={"Range": rango})
+    assert r.status_code == 200
+    assert "content-range" not in r.headers
+    assert r.content == CONTENIDO
+
+
+def test_etag_coincidente_304(cliente):
+    etag = cliente.get("/archivo/factura.pdf").headers["etag"]
+    for cabecera in (etag, f'W/{etag}', f'"otro", {etag}', "*"):
+        r = cliente.get("/archivo/factura.pdf", headers={"If-None-Match": cabecera})
+        assert r.status_code == 304, cabecera
+        assert r.headers["etag"] == etag
+        assert r.content == b""
+        assert "content-disposition" not in r.headers
+    assert cliente.get("/archivo/factura.pdf", headers={"If-None-Match": '"otro"'}).status_code == 200
+
+
+def test_if_modified_since(cliente, archivos):
+    mtime = os.stat(archivos["factura.pdf"]).st_mtime
+    assert cliente.get("/archivo/factura.pdf", headers={"If-Modified-Since": formatdate(mtime + 60, usegmt=True)}).status_code == 304
+    assert cliente.get("/archivo/factura.pdf", headers={"If-Modified-Since": formatdate(mtime - 60, usegmt=True)}).status_code == 200
+    # If-None-Match manda sobre If-Modified-Since
+    r = cliente.get("/archivo/factura.pdf", headers={
+        "If-None-Match": '"otro"', "If-Modified-Since": formatdate(mtime + 60, usegmt=True),
+    })
+    assert r.status_code == 200
+
+
+def test_if_range(cliente, archivos):
+    etag = cliente.get("/archivo/factura.pdf").headers["etag"]
+    r = cliente.get("/archivo/factura.pdf", headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert r.status_code == 206
+    assert r.content == CONTENIDO[:10]
+    # El archivo cambió (otro ETag): se envía entero
+    r = cliente.get("/archivo/factura.pdf", headers={"Range": "bytes=0-9", "If-Range": '"antiguo"'})
+    assert r.status_code == 200
+    assert r.content == CONTENIDO
+
+
+def test_etag_cambia_con_el_contenido(cliente, archivos):
+    antes = cliente.get("/archivo/factura.pdf").headers["etag"]
+    with open(archivos["factura.pdf"], "ab") as f:
+        f.write(b"mas")
+    despues = cliente.get("/archivo/factura.pdf")
+    assert despues.headers["etag"] != antes
+    assert despues.headers["content-length"] == "1027"
+
+
+def test_archivo_vacio(cliente):
+    r = cliente.get("/archivo/vacio.pdf")
+    assert r.status_code == 200
+    assert r.headers["content-length"] == "0"
+    assert r.content == b""
+    r = cliente.get("/archivo/vacio.pdf", headers={"Range": "bytes=-10"})
+    assert r.status_code == 416
+    assert r.headers["content-range"] == "bytes */0"
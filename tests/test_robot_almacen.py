@@ -0,0 +1,47 @@
+import asyncio
+from datetime import date
+
+import robotEndesa
+from almacen_facturas import AlmacenFacturas
+from modelos_datos import FacturaEndesaCliente
+
+CUPS_PEDIDO = "ES0031405000000001AB"
+CUPS_PORTAL = "ES0031405000000001AB0F"
+
+
+def test_combinar_cups_con_cups22_del_portal(tmp_path, monkeypatch):
+    monkeypatch.setattr(robotEndesa, "ALMACEN", AlmacenFacturas(str(tmp_path / "facturas.db")))
+    monkeypatch.setattr(robotEndesa, "LOG_FILE_NAME_TEMPLATE", str(tmp_path / "log_{cups}.csv"))
+    desde, hasta = date(2024, 1, 1), date(2024, 3, 31)
+    trabajo = (0, CUPS_PEDIDO, "01/01/2024", "31/03/2024")
+    extraidas = [
+        FacturaEndesaCliente(cups=CUPS_PORTAL, numero_factura="F1", fecha_emision="15/01/2024"),
+        FacturaEndesaCliente(cups=CUPS_PORTAL, numero_factura="F2", fecha_emision="15/02/2024"),
+    ]
+
+    primera = asyncio.run(robotEndesa._combinar_cups(CUPS_PEDIDO, [(trabajo, extraidas)], desde, hasta, True))
+    assert sorted(f.numero_factura for f in primera) == ["F1", "F2"]
+    assert robotEndesa.ALMACEN.rangos_pendientes(CUPS_PEDIDO, desde, hasta) == []
+
+    # Consulta posterior servida solo desde el almacén (sin búsquedas en el portal)
+    segunda = asyncio.run(robotEndesa._combinar_cups(CUPS_PEDIDO, [], desde, hasta, True))
+    assert [f.numero_factura for f in segunda] == ["F2", "F1"]
+
+
+def test_rango_cubierto_se_sirve_del_almacen(tmp_path, monkeypatch):
+    almacen = AlmacenFacturas(str(tmp_path / "facturas.db"))
+    almacen.guardar_facturas([FacturaEndesaCliente(cups=CUPS_PORTAL, numero_factura="F1", fecha_emision="15/01/2024")])
+    almacen.marcar_cubierto(CUPS_PEDIDO, date(2024, 1, 1), date(2024, 1, 31))
+    monkeypatch.setattr(robotEndesa, "ALMACEN", almacen)
+    monkeypatch.setattr(robotEndesa, "LOG_FILE_NAME_TEMPLATE", str(tmp_path / "log_{cups}.csv"))
+
+    async def sin_navegador(*args, **kwargs):
+        raise AssertionError("no debería abrirse el navegador")
+    monkeypatch.setattr(robotEndesa, "_ejecutar_trabajos_con_navegador", sin_navegador)
+
+    async def consultar():
+        return [r async for r in robotEndesa.iterar_robot_api([CUPS_PEDIDO], "01/01/2024", "31/01/2024")]
+
+    [(posicion, cups, facturas)] = asyncio.run(consultar())
+    assert (posicion, cups) == (0, CUPS_PEDIDO)
+    assert [f.numero_factura for f in facturas] == ["F1"]
@@ -0,0 +1,95 @@
+import asyncio
+from datetime import date
+
+from almacen_facturas import FORMATO_FECHA_API
+from modelos_datos import FacturaEndesaCliente
+from sincronizacion import PlanificadorSincronizacion, RegistroSincronizacion
+
+CUPS_OK = "ES0031405000000001AB"
+CUPS_FALLO = "ES0031405000000002CD"
+
+
+class RobotFalso:
+    """Sustituto de ejecutar_robot_api: devuelve las facturas preparadas y anota las llamadas."""
+    def __init__(self, facturas: list[FacturaEndesaCliente]):
+        self.facturas = facturas
+        self.llamadas: list[dict] = []
+
+    async def __call__(self, **parametros) -> list[FacturaEndesaCliente]:
+        self.llamadas.append(parametros)
+        return self.facturas
+
+
+def _registro(tmp_path, *cups: str) -> RegistroSincronizacion:
+    registro = RegistroSincronizacion(str(tmp_path / "facturas.db"))
+    for c in cups:
+        registro.registrar(c, date(2024, 1, 1))
+    return registro
+
+
+def _marcas(registro: RegistroSincronizacion) -> dict[str, str | None]:
+    return {e.cups: e.marca for e in registro.listar()}
+
+
+def test_marca_avanza_con_cups22_del_portal(tmp_path):
+    registro = _registro(tmp_path, CUPS_OK)
+    robot = RobotFalso([
+        FacturaEndesaCliente(cups=CUPS_OK + "0F", numero_factura="F1", fecha_emision="15/01/2024"),
+        FacturaEndesaCliente(cups=CUPS_OK + "0F", numero_factura="F2", fecha_emision="15/02/2024"),
+    ])
+    planificador = PlanificadorSincronizacion(robot, registro, intervalo_min=0)
+
+    nuevas = asyncio.run(planificador.sincronizar())
+
+    assert nuevas == {CUPS_OK: 2}
+    assert _marcas(registro) == {CUPS_OK: "2024-02-15"}
+    assert robot.llamadas[0]["lista_cups"] == [CUPS_OK]
+    assert robot.llamadas[0]["fecha_desde"] == "01/01/2024"
+
+
+def test_cups_con_error_no_mueve_su_marca(tmp_path):
+    registro = _registro(tmp_path, CUPS_OK, CUPS_FALLO)
+    registro.actualizar(CUPS_FALLO, date(2024, 1, 10))
+    robot = RobotFalso([
+        FacturaEndesaCliente(cups=CUPS_OK, numero_factura="F1", fecha_emision="15/03/2024"),
+        FacturaEndesaCliente(cups=CUPS_FALLO, numero_factura="F9", fecha_emision="20/03/2024"),
+        FacturaEndesaCliente(cups=CUPS_FALLO, error_RPA=True, direccion_suministro="ERROR_DESCARGA: timeout"),
+    ])
+    planificador = PlanificadorSincronizacion(robot, registro, intervalo_min=0)
+
+    asyncio.run(planificador.sincronizar())
+
+    estados = {e.cups: e for e in registro.listar()}
+    assert estados[CUPS_OK].marca == "2024-03-15"
+    assert estados[CUPS_OK].ultimo_error is None
+    assert estados[CUPS_FALLO].marca == "2024-01-10"
+    assert estados[CUPS_FALLO].ultimo_error == "ERROR_DESCARGA: timeout"
+    # La siguiente pasada vuelve a empezar desde la marca más antigua
+    asyncio.run(planificador.sincronizar())
+    assert robot.llamadas[1]["fecha_desde"] == date(2024, 1, 10).strftime(FORMATO_FECHA_API)
+
+
+def test_lanzar_bajo_demanda(tmp_path):
+    registro = _registro(tmp_path, CUPS_OK)
+    robot = RobotFalso([FacturaEndesaCliente(cups=CUPS_OK, numero_factura="F1", fecha_emision="15/01/2024")])
+
+    async def escenario():
+        # Intervalo 0: el bucle solo sincroniza cuando se le despierta
+        planificador = PlanificadorSincronizacion(robot, registro, intervalo_min=0)
+        await planificador.iniciar()
+        try:
+            await asyncio.sleep(0.05)
+            assert robot.llamadas == []
+            planificador.lanzar()
+            for _ in range(100):
+                if robot.llamadas and not planificador.en_curso():
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await planificador.cerrar()
+        return planificador
+
+    planificador = asyncio.run(escenario())
+    assert len(robot.llamadas) == 1
+    assert planificador.ultima_ejecucion is not None
+    assert _marcas(registro) == {CUPS_OK: "2024-01-15"}
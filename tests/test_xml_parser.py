@@ -0,0 +1,52 @@
+import contextlib
+import io
+import json
+import os
+
+import pytest
+
+from generador_facturae import generar_corpus
+from modelos_datos import FacturaEndesaCliente
+from xml_parser import procesar_xml_local
+
+# Campos que extraía el parser original por expresiones regulares (commit d98c897) sobre el
+# corpus sintético, congelados. El parser de una sola pasada debe devolver exactamente lo mismo.
+# Para regenerarlo: ejecutar el xml_parser.py de ese commit sobre generar_corpus(dir, 48, 1).
+ORIGINAL_PATH = os.path.join(os.path.dirname(__file__), "datos", "xml_parser_original.json")
+# Campos añadidos después del parser original (no existían en su salida)
+CAMPOS_NUEVOS = {"origen_datos"}
+
+
+def _campos(factura: FacturaEndesaCliente) -> dict:
+    """Misma normalización que benchmark_xml: sin vacíos ni el CUPS (viene de la tabla)."""
+    return {
+        k: v for k, v in factura.model_dump().items()
+        if v not in (None, 0.0, "N/A", False) and k != "cups" and k not in CAMPOS_NUEVOS
+    }
+
+
+@pytest.fixture(scope="module")
+def original() -> dict:
+    with open(ORIGINAL_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="module")
+def corpus(original, tmp_path_factory) -> tuple[str, list[dict]]:
+    directorio = str(tmp_path_factory.mktemp("corpus_xml"))
+    return directorio, generar_corpus(directorio, original["cantidad"], original["semilla"])
+
+
+def test_corpus_completo(original, corpus):
+    _, variantes = corpus
+    assert sorted(v["nombre"] for v in variantes) == sorted(original["resultados"])
+
+
+def test_mismos_campos_que_el_parser_original(original, corpus):
+    directorio, variantes = corpus
+    for variante in variantes:
+        factura = FacturaEndesaCliente(cups=variante["cups"], numero_factura=variante["numero_factura"])
+        with contextlib.redirect_stdout(io.StringIO()):
+            ok = procesar_xml_local(factura, os.path.join(directorio, variante["nombre"]))
+        assert {"ok": ok, **_campos(factura)} == original["resultados"][variante["nombre"]], variante["nombre"]
+        assert factura.origen_datos == "XML"
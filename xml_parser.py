@@ -5,26 +5,90 @@ from modelos_datos import FacturaEndesaCliente
 from logs import escribir_log
 
 # --------------------------------------------------------------------------------
-# --- FUNCIONES AUXILIARES PARA LECTURA POR REGEX ---
+# --- ÍNDICE DE UNA SOLA PASADA SOBRE EL DOCUMENTO ---
 # --------------------------------------------------------------------------------
 
-# Usamos re.DOTALL (re.S) para que el punto coincida con saltos de línea,
-RE_FLAG = re.DOTALL
+# Etiqueta sin atributos, con o sin prefijo de Namespace: <ns0:Tag>, </Tag>...
+# Se recorre el documento UNA sola vez con este patrón (precompilado) en lugar de
+# limpiar los Namespaces y lanzar una búsqueda completa por cada campo.
+TAG_PATTERN = re.compile(r"<(/?)(?:\w+:)?(\w+)>")
 
-def _clean_text(text: str) -> str:
-    """Limpia el texto, eliminando los prefijos de Namespace de las etiquetas XML."""
-    # Busca patrones como <ns0:Tag o </ns0:Tag y los deja como <Tag o </Tag
-    text = re.sub(r'<([/]?)\w+:', r'<\1', text)
-    return text
+# Contenido válido de los importes/cantidades (mismo criterio que las regex originales)
+COST_PATTERN = re.compile(r"[\d.,]+")
+QUANTITY_PATTERN = re.compile(r"[0-9.]+")
 
-def _extract_simple_value(file_content: str, tag_name: str, is_float: bool = False, is_date: bool = False, default=None):
-    """Extrae la primera ocurrencia de un valor basado en su etiqueta (ignorando Namespaces)."""
-    # Patrón: <TagNombre>(Valor)</TagNombre>
-    pattern = r"<" + re.escape(tag_name) + r">([\s\S]*?)</" + re.escape(tag_name) + r">"
-    
-    match = re.search(pattern, file_content, RE_FLAG)
-    if match:
-        value = match.group(1).strip()
+# Etiquetas de las que solo interesa la primera aparición
+SIMPLE_TAGS = {
+    'CodigoTarifa', 'Direccion', 'CodigoPostal', 'Poblacion', 'Provincia',
+    'TransactionDate', 'TotalGrossAmountBeforeTaxes', 'InvoiceTotal',
+    'InstallmentAmount', 'InstallmentDueDate',
+}
+
+class _IndiceFacturae:
+    """
+    Índice construido en una única pasada sobre el XML:
+    - valores:     primera aparición de cada etiqueta de SIMPLE_TAGS.
+    - costes:      ItemDescription (minúsculas) -> primer TotalCost numérico posterior.
+    - cantidades:  ItemDescription -> primera Quantity numérica posterior.
+    - consumos:    CodigoDH -> primer ConsumoCalculado numérico posterior.
+    """
+    def __init__(self, content: str):
+        self.valores: dict[str, str] = {}
+        self.costes: dict[str, str] = {}
+        self.cantidades: dict[str, str] = {}
+        self.consumos: dict[str, str] = {}
+
+        # Posición de inicio del texto de cada etiqueta abierta que nos interesa
+        abiertas: dict[str, int] = {}
+        # Descripciones/códigos a la espera de su primer importe, cantidad o consumo
+        pendientes_coste: list[str] = []
+        pendientes_cantidad: list[str] = []
+        pendientes_consumo: list[str] = []
+
+        for match in TAG_PATTERN.finditer(content):
+            es_cierre, tag = match.group(1), match.group(2)
+
+            if not es_cierre:
+                if tag in SIMPLE_TAGS and tag in self.valores:
+                    continue
+                if tag in SIMPLE_TAGS or tag in ('ItemDescription', 'TotalCost', 'Quantity', 'CodigoDH', 'ConsumoCalculado'):
+                    abiertas.setdefault(tag, match.end())
+                continue
+
+            inicio = abiertas.pop(tag, None)
+            if inicio is None:
+                continue
+            texto = content[inicio:match.start()]
+
+            if tag in SIMPLE_TAGS:
+                self.valores.setdefault(tag, texto)
+            elif tag == 'ItemDescription':
+                descripcion = texto.strip()
+                pendientes_coste.append(descripcion.lower())
+                pendientes_cantidad.append(descripcion)
+            elif tag == 'TotalCost':
+                if pendientes_coste and COST_PATTERN.fullmatch(texto):
+                    for descripcion in pendientes_coste:
+                        self.costes.setdefault(descripcion, texto)
+                    pendientes_coste.clear()
+            elif tag == 'Quantity':
+                if pendientes_cantidad and QUANTITY_PATTERN.fullmatch(texto):
+                    for descripcion in pendientes_cantidad:
+                        self.cantidades.setdefault(descripcion, texto)
+                    pendientes_cantidad.clear()
+            elif tag == 'CodigoDH':
+                pendientes_consumo.append(texto)
+            elif tag == 'ConsumoCalculado':
+                if pendientes_consumo and QUANTITY_PATTERN.fullmatch(texto):
+                    for codigo in pendientes_consumo:
+                        self.consumos.setdefault(codigo, texto)
+                    pendientes_consumo.clear()
+
+def _extract_simple_value(indice: _IndiceFacturae, tag_name: str, is_float: bool = False, default=None):
+    """Devuelve la primera ocurrencia de un valor basado en su etiqueta (ignorando Namespaces)."""
+    value = indice.valores.get(tag_name)
+    if value is not None:
+        value = value.strip()
         if is_float:
             try:
                 # Limpiamos el valor numérico (quitando cualquier cosa que no sea dígito o punto)
@@ -35,32 +99,27 @@ def _extract_simple_value(file_content: str, tag_name: str, is_float: bool = Fal
     
     return default if default is not None else (0.0 if is_float else None)
 
-def _extract_cost_by_description(file_content: str, item_description: str) -> float:
-    pattern = (
-        r"<ItemDescription>\s*" + re.escape(item_description) + r"\s*</ItemDescription>"
-        r"[\s\S]*?<TotalCost>([\d.,]+)</TotalCost>" # Acepta coma y punto
-    )
-    
-    match = re.search(pattern, file_content, re.DOTALL | re.IGNORECASE)
-    
-    if match:
-        cost_str = match.group(1).strip().replace(',', '.') # Normaliza coma a punto
-        try:
-            return float(cost_str)
-        except ValueError:
-            return 0.0
-    return 0.0
+def _extract_cost_by_description(indice: _IndiceFacturae, item_description: str) -> float:
+    """Importe (TotalCost) asociado a una línea de factura por su descripción (sin distinguir mayúsculas)."""
+    cost_str = indice.costes.get(item_description.lower())
+    if cost_str is None:
+        return 0.0
+    try:
+        return float(cost_str.strip().replace(',', '.')) # Normaliza coma a punto
+    except ValueError:
+        return 0.0
 
 
 
 
 # --------------------------------------------------------------------------------
-# --- FUNCIÓN PRINCIPAL DE PROCESAMIENTO (REGEX) ---
+# --- FUNCIÓN PRINCIPAL DE PROCESAMIENTO (ÍNDICE) ---
 # --------------------------------------------------------------------------------
 
 def procesar_xml_local(factura: FacturaEndesaCliente, filepath: str):
     """
-    Lee el archivo XML como texto plano y extrae los datos usando Regex.
+    Lee el archivo XML como texto plano, lo indexa en una sola pasada
+    y rellena los campos de la factura a partir del índice.
     """
     
     # 1. Lectura y limpieza del archivo
@@ -68,7 +127,7 @@ def procesar_xml_local(factura: FacturaEndesaCliente, filepath: str):
         # !!! CAMBIO CLAVE: Cambiar 'utf-8' por 'latin-1' o 'cp1252' !!!
         with open(filepath, 'r', encoding='latin-1') as f:
             raw_content = f.read()
-            content = _clean_text(raw_content) # Eliminamos NS para facilitar el Regex
+            indice = _IndiceFacturae(raw_content) # Una única pasada sobre el documento
             
     except FileNotFoundError:
         escribir_log(f"    -> [ERROR XML] Archivo no encontrado en: {filepath}")
@@ -84,18 +143,18 @@ def procesar_xml_local(factura: FacturaEndesaCliente, filepath: str):
     
     # --- 2. EXTRACCIÓN DE DATOS DE CABECERA Y GENERALES ---
     
-    factura.tarifa = _extract_simple_value(content, 'CodigoTarifa', default='N/A')
+    factura.tarifa = _extract_simple_value(indice, 'CodigoTarifa', default='N/A')
     # --- EXTRACCIÓN DETALLADA DE DIRECCIÓN DE SUMINISTRO ---
-    dir_calle = _extract_simple_value(content, 'Direccion', default='')
-    dir_cp = _extract_simple_value(content, 'CodigoPostal', default='')
-    dir_pob = _extract_simple_value(content, 'Poblacion', default='')
-    dir_prov = _extract_simple_value(content, 'Provincia', default='')
+    dir_calle = _extract_simple_value(indice, 'Direccion', default='')
+    dir_cp = _extract_simple_value(indice, 'CodigoPostal', default='')
+    dir_pob = _extract_simple_value(indice, 'Poblacion', default='')
+    dir_prov = _extract_simple_value(indice, 'Provincia', default='')
 
     # Concatenamos siguiendo el formato: Calle, CP Poblacion, Provincia
     factura.direccion_suministro = f"{dir_calle}, {dir_cp} {dir_pob}, {dir_prov}".strip(", ")
     
    # Mes Facturado (de TransactionDate) convertido a NOMBRE EN MAYÚSCULAS
-    transaction_date = _extract_simple_value(content, 'TransactionDate')
+    transaction_date = _extract_simple_value(indice, 'TransactionDate')
     if transaction_date:
         try:
             # Diccionario de traducción
@@ -114,18 +173,18 @@ def procesar_xml_local(factura: FacturaEndesaCliente, filepath: str):
             pass # Se mantiene como None según tu lógica original
     
     # Base Imponible: <TotalGrossAmountBeforeTaxes>
-    base_imponible = _extract_simple_value(content, 'TotalGrossAmountBeforeTaxes', is_float=True)
+    base_imponible = _extract_simple_value(indice, 'TotalGrossAmountBeforeTaxes', is_float=True)
     if base_imponible == 0.0:
         escribir_log(f"    -> [ERROR XML] Datos críticos no encontrados en XML para {factura.cups}")
         return False
     factura.importe_base_imponible = base_imponible
 
     # Totales Finales
-    factura.importe_facturado = _extract_simple_value(content, 'InvoiceTotal', is_float=True)
-    factura.importe_total_final = _extract_simple_value(content, 'InstallmentAmount', is_float=True)
+    factura.importe_facturado = _extract_simple_value(indice, 'InvoiceTotal', is_float=True)
+    factura.importe_total_final = _extract_simple_value(indice, 'InstallmentAmount', is_float=True)
     
     # Extracción segura de la fecha de cobro
-    fecha_cobro_raw = _extract_simple_value(content, 'InstallmentDueDate')
+    fecha_cobro_raw = _extract_simple_value(indice, 'InstallmentDueDate')
     if fecha_cobro_raw:
         try:
             factura.fecha_de_cobro_en_banco = datetime.strptime(fecha_cobro_raw, '%Y-%m-%d').strftime('%d/%m/%Y')
@@ -137,7 +196,7 @@ def procesar_xml_local(factura: FacturaEndesaCliente, filepath: str):
     for i in range(1, 7):
         attr = f'potencia_p{i}'
         desc = f'Pot. P{i}'
-        cost = _extract_cost_by_description(content, desc)
+        cost = _extract_cost_by_description(indice, desc)
         setattr(factura, attr, cost)
         total_importe_potencia += cost
     factura.importe_de_potencia = round(total_importe_potencia, 2)
@@ -149,13 +208,13 @@ def procesar_xml_local(factura: FacturaEndesaCliente, filepath: str):
     for i in range(1, 7):
         # Consumo Fijo
         desc_consumo = f'Consumo P{i}'
-        cost_consumo = _extract_cost_by_description(content, desc_consumo)
+        cost_consumo = _extract_cost_by_description(indice, desc_consumo)
         setattr(factura, f'importe_consumo_p{i}', cost_consumo)
         total_importe_consumo += cost_consumo
         
         # Energía Precio Indexado
         desc_index = f'Energia precio indexado P{i}'
-        cost_index = _extract_cost_by_description(content, desc_index)
+        cost_index = _extract_cost_by_description(indice, desc_index)
         setattr(factura, f'energia_precio_indexado_p{i}', cost_index)
         total_importe_consumo += cost_index
         
@@ -166,32 +225,27 @@ def procesar_xml_local(factura: FacturaEndesaCliente, filepath: str):
     for i in range(1, 7):
         attr = f'importe_exceso_potencia_p{i}'
         desc = f'Exceso Pot. P{i}'
-        cost = _extract_cost_by_description(content, desc)
+        cost = _extract_cost_by_description(indice, desc)
         setattr(factura, attr, cost)
         total_exceso_potencia += cost
     factura.importe_exceso_potencia = round(total_exceso_potencia, 2)
     
     # D. Conceptos Únicos
-    factura.importe_impuesto_electrico = _extract_cost_by_description(content, 'Impuesto Electricidad')
-    factura.importe_alquiler_equipos = _extract_cost_by_description(content, 'Alquiler del contador')
+    factura.importe_impuesto_electrico = _extract_cost_by_description(indice, 'Impuesto Electricidad')
+    factura.importe_alquiler_equipos = _extract_cost_by_description(indice, 'Alquiler del contador')
     # Nota: Usamos la versión de búsqueda que contiene 'Bono Social' para la robustez
-    factura.importe_bono_social = _extract_cost_by_description(content, 'Bono Social') 
+    factura.importe_bono_social = _extract_cost_by_description(indice, 'Bono Social') 
 
     # --- 4. EXTRACCIÓN DE CONSUMOS (kWh) ---
     
     consumo_kw_fields = {f'consumo_kw_p{i}': f'AEA{i}' for i in range(1, 7)}
     total_kw = 0.0
     
-    # Patrón: <CodigoDH>DH_CODE</CodigoDH>.*?<ConsumoCalculado>VALOR</ConsumoCalculado>
+    # Índice: CodigoDH -> ConsumoCalculado
     for attr, dh_code in consumo_kw_fields.items():
-        pattern = (
-            r"<CodigoDH>" + re.escape(dh_code) + r"</CodigoDH>"
-            r"[\s\S]*?<ConsumoCalculado>([0-9.]+)</ConsumoCalculado>"
-        )
-        
-        match = re.search(pattern, content, RE_FLAG)
-        if match:
-            consumo = float(match.group(1).strip())
+        valor = indice.consumos.get(dh_code)
+        if valor is not None:
+            consumo = float(valor.strip())
             setattr(factura, attr, consumo)
             total_kw += consumo
         else:
@@ -201,16 +255,11 @@ def procesar_xml_local(factura: FacturaEndesaCliente, filepath: str):
     factura.kw_totales = round(total_kw, 2)
     
     # Días (Extraído del alquiler del contador)
-    # Patrón para CodigoDH y ConsumoCalculado
     try:
         # Extraemos la cantidad de días del tag <Quantity> asociado a 'Alquiler del contador'
-        quantity_match = re.search(
-            r"<ItemDescription>\s*Alquiler del contador\s*</ItemDescription>[\s\S]*?<Quantity>([0-9.]+)</Quantity>",
-            content,
-            RE_FLAG
-        )
-        if quantity_match:
-            factura.num_dias = int(float(quantity_match.group(1).strip()))
+        quantity = indice.cantidades.get('Alquiler del contador')
+        if quantity:
+            factura.num_dias = int(float(quantity.strip()))
     except Exception:
         # Si falla el parseo, se queda en None o 0 (ya que es un int)
         pass
@@ -218,5 +267,6 @@ def procesar_xml_local(factura: FacturaEndesaCliente, filepath: str):
     if factura.tarifa == 'N/A' or factura.importe_base_imponible is None:
         return False
 
+    factura.origen_datos = "XML"
     escribir_log(f"    -> [OK] [XML PARSED] Datos extraídos del XML para factura {factura.numero_factura} ({factura.cups})")
     return True
\ No newline at end of file
@@ -0,0 +1,96 @@
+import asyncio
+import io
+import json
+import os
+import time
+import zipfile
+from datetime import datetime
+from typing import AsyncIterator
+from logs import escribir_log
+
+# --- ZIP DE DOCUMENTOS EN STREAMING (POST /documentos/zip) ---
+# El ZIP se escribe sobre un flujo no posicionable (zipfile usa descriptores de datos) y cada
+# bloque comprimido se envía al cliente en cuanto se produce: ni el ZIP ni los documentos se
+# montan enteros en memoria o en disco. La lectura y la compresión se hacen en hilos.
+
+TAMANO_BLOQUE = 256 * 1024
+NOMBRE_MANIFIESTO = "manifiesto.json"
+# Los PDF ya van comprimidos: se guardan tal cual. Los XML se comprimen.
+COMPRESION = {"PDF": zipfile.ZIP_STORED, "XML": zipfile.ZIP_DEFLATED}
+
+
+class _SalidaZip(io.RawIOBase):
+    """Destino del ZipFile: acumula lo escrito hasta que se recoge con 'vaciar'."""
+    def __init__(self):
+        self._bloques: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, datos) -> int:
+        self._bloques.append(bytes(datos))
+        return len(datos)
+
+    def vaciar(self) -> bytes:
+        datos = b"".join(self._bloques)
+        self._bloques.clear()
+        return datos
+
+
+def _abrir(ruta: str):
+    f = open(ruta, "rb")
+    return f, os.fstat(f.fileno())
+
+
+def _entrada(nombre: str, tipo: str, mtime: float) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(nombre, date_time=time.localtime(mtime)[:6])
+    info.compress_type = COMPRESION.get(tipo, zipfile.ZIP_DEFLATED)
+    return info
+
+
+async def generar_zip_documentos(documentos: list[dict]) -> AsyncIterator[bytes]:
+    """
+    Bloques de un ZIP con los documentos pedidos. Cada documento es un dict con
+    'cups', 'numero_factura', 'tipo' (PDF/XML) y 'ruta'; dentro del ZIP va en '{cups}/{archivo}'.
+    Al final se añade 'manifiesto.json' con los documentos incluidos y los que faltaban en disco.
+    """
+    salida = _SalidaZip()
+    zf = zipfile.ZipFile(salida, "w")
+    incluidos, faltantes = [], []
+    for doc in documentos:
+        referencia = {"cups": doc["cups"], "numero_factura": doc["numero_factura"], "tipo": doc["tipo"]}
+        try:
+            f, estado = await asyncio.to_thread(_abrir, doc["ruta"])
+        except FileNotFoundError:
+            faltantes.append({**referencia, "motivo": "ARCHIVO_NO_ENCONTRADO"})
+            continue
+        except OSError as e:
+            faltantes.append({**referencia, "motivo": f"ERROR_LECTURA: {e}"})
+            continue
+
+        nombre = f"{doc['cups']}/{os.path.basename(doc['ruta'])}"
+        try:
+            destino = zf.open(_entrada(nombre, doc["tipo"], estado.st_mtime), "w", force_zip64=estado.st_size > 2**31)
+            try:
+                while bloque := await asyncio.to_thread(f.read, TAMANO_BLOQUE):
+                    await asyncio.to_thread(destino.write, bloque)
+                    if datos := salida.vaciar():
+                        yield datos
+            finally:
+                await asyncio.to_thread(destino.close)
+        finally:
+            await asyncio.to_thread(f.close)
+        incluidos.append({**referencia, "archivo": nombre, "bytes": estado.st_size})
+        if datos := salida.vaciar():
+            yield datos
+
+    manifiesto = {
+        "generado": datetime.now().isoformat(timespec="seconds"),
+        "incluidos": incluidos,
+        "faltantes": faltantes,
+    }
+    zf.writestr(_entrada(NOMBRE_MANIFIESTO, "XML", time.time()), json.dumps(manifiesto, ensure_ascii=False, indent=2))
+    zf.close() # directorio central
+    escribir_log(f"[ZIP] {len(incluidos)} documento(s) enviados, {len(faltantes)} no encontrados.")
+    if datos := salida.vaciar():
+        yield datos